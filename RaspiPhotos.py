@@ -1,6 +1,7 @@
 from enum import Enum
-import os
+import argparse
 import cv2
+from aruco.frame_source import open_source
 
 class Res(Enum):
     LOW = (320, 240)
@@ -8,37 +9,62 @@ class Res(Enum):
     MP5 = (2592, 1944)
     MP8 = (3280, 2464)
 
-def capture(filename, res):
-    "System command for raspistill capture"
+def capture(source, filename, res):
+    "Capture a still frame at the given resolution and save it"
     print("Capture {} with: {}x{}".format(filename, *res.value))
-    cmd = "raspistill -w {} -h {} -o {}".format(*res.value, filename)
-    os.system(cmd)
+    img = source.capture(res.value)
+    cv2.imwrite(filename, img)
 
-def view(filename):
-    "Read and view image"
-    img = cv2.imread(filename, cv2.IMREAD_COLOR)
+def save_frame(source, i):
+    "Save the next frame of a source without stills, named by its size"
+    frame = source.read()
+    if frame is None:
+        print("No frame to save, the source has stopped")
+        return
+    height, width = frame.image.shape[:2]
+    filename = 'img{}_{}x{}.jpg'.format(i, width, height)
+    print("Saving", filename)
+    cv2.imwrite(filename, frame.image)
+
+def view(img):
+    "View image"
     cv2.imshow('window', img)
-    print('Previewing')
-    return cv2.waitKey(0)
+    return cv2.waitKey(1)
 
 def main():
+    parser = argparse.ArgumentParser(
+        description='Preview the camera and save photos in all resolutions.')
+    parser.add_argument('-s', '--source', type=str, nargs=1, default=['picamera'],
+                        help='picamera, synthetic, a camera number, '
+                             'a directory or a video file (default: picamera)')
+    args = parser.parse_args()
+
     cv2.namedWindow('window', cv2.WINDOW_NORMAL)
     cv2.resizeWindow('window', (1280, 960))
     i = 0
-    while True:
-        # Capture preview
-        capture('temp.jpg', Res.LOW)
-        key = view('temp.jpg')
-        # Kill program
-        if key == ord("q"):
-            break
-        # Capture all resolutions
-        elif key == ord("s"):
-            for res in Res:
-                filename = 'img{}_{}.jpg'.format(i, res.name)
-                print("Saving", filename)
-                capture(filename, res)
-            i += 1
+    print('Previewing')
+    with open_source(args.source[0], Res.LOW.value) as source:
+        # Grab preview frames in the background
+        source.start()
+        while True:
+            frame = source.read()
+            if frame is None:
+                break
+            key = view(frame.image)
+            # Kill program
+            if key == ord("q"):
+                break
+            # Capture all resolutions
+            elif key == ord("s"):
+                if hasattr(source, 'capture'):
+                    for res in Res:
+                        filename = 'img{}_{}.jpg'.format(i, res.name)
+                        print("Saving", filename)
+                        capture(source, filename, res)
+                else:
+                    # Other sources only have their own resolution
+                    save_frame(source, i)
+                i += 1
 
     # Clean up
     cv2.destroyAllWindows()
@@ -1,5 +1,6 @@
 
 from .detector import Detector
+from .pyramid import PyramidDetector
 from .read import read_detector_params
 from .read import read_camera_file
 from .camera_parameters import read_camera_parameters, CameraParameters
\ No newline at end of file
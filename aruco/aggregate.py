@@ -0,0 +1,193 @@
+import argparse
+import numpy as np
+import pandas as pd
+from aruco.rotation import normals, quaternions, quaternion_rotation_vectors
+
+
+SNAPSHOT_COLUMNS = [
+    'id', 'count', 'outliers', 'last_frame',
+    'tx', 'ty', 'tz', 'tx_var', 'ty_var', 'tz_var',
+    'nx', 'ny', 'nz', 'nx_var', 'ny_var', 'nz_var',
+    'rx', 'ry', 'rz',
+]
+
+
+class _MarkerStats:
+    """ Running statistics of one marker id"""
+    __slots__ = ('count', 'outliers', 'last_frame', 't_mean', 't_m2',
+                 'n_mean', 'n_m2', 'q_sum', 'q_mean')
+
+    def __init__(self):
+        self.count = 0
+        self.outliers = 0
+        self.last_frame = -1
+        self.t_mean = np.zeros(3)
+        self.t_m2 = np.zeros(3)
+        self.n_mean = np.zeros(3)
+        self.n_m2 = np.zeros(3)
+        # Sum of quaternion outer products, its main eigenvector is the mean
+        self.q_sum = np.zeros((4, 4))
+        self.q_mean = None
+
+    def add(self, tvec, normal, quat):
+        # Welford updates of mean and sum of squared differences
+        self.count += 1
+        delta = tvec - self.t_mean
+        self.t_mean += delta / self.count
+        self.t_m2 += delta * (tvec - self.t_mean)
+        delta = normal - self.n_mean
+        self.n_mean += delta / self.count
+        self.n_m2 += delta * (normal - self.n_mean)
+        self.q_sum += np.outer(quat, quat)
+        self.q_mean = np.linalg.eigh(self.q_sum)[1][:, -1]
+
+    def variance(self, m2):
+        return m2 / (self.count - 1) if self.count > 1 else np.full(3, np.nan)
+
+
+class PoseAggregator:
+    """
+    Per marker id running mean and variance of translation and normal,
+    and mean rotation, updated one detection at a time in constant memory.
+
+    The rotation mean is the quaternion minimizing the summed squared
+    chordal distance to all samples (main eigenvector of the sum of their
+    outer products), which does not depend on the sign of the quaternions.
+    Once an id has min_samples samples, a detection is counted as an
+    outlier and left out when its translation is more than outlier_sigma
+    standard deviations (at least min_std) from the mean, or its rotation
+    is more than max_angle degrees from the mean rotation.
+
+    append has the signature of MarkerResults.append, so an aggregator
+    can be passed as results to Detector.estimate_markers.
+    """
+
+    def __init__(self, outlier_sigma=3.0, min_samples=5, min_std=0.005, max_angle=10.0):
+        self.outlier_sigma = outlier_sigma
+        self.min_samples = min_samples
+        self.min_std = min_std
+        self.max_angle = np.radians(max_angle)
+        self.markers = {}
+        self.frames = 0
+        self.last_frame = None
+
+    def __len__(self):
+        return sum(stats.count for stats in self.markers.values())
+
+    def is_outlier(self, stats, tvec, quat):
+        if stats.count < self.min_samples:
+            return False
+        std = np.maximum(np.sqrt(stats.t_m2 / (stats.count - 1)), self.min_std)
+        if np.any(np.abs(tvec - stats.t_mean) > self.outlier_sigma * std):
+            return True
+        # Angle between rotations from the quaternion dot product
+        angle = 2 * np.arccos(min(abs(np.dot(quat, stats.q_mean)), 1.0))
+        return angle > self.max_angle
+
+    def append(self, frame, ids, rvecs, tvecs, corners=None):
+        """ Add the markers found in one frame"""
+        count = 0 if ids is None else len(ids)
+        if frame != self.last_frame:
+            self.frames += 1
+            self.last_frame = frame
+        if not count:
+            return
+        ids = np.reshape(ids, count)
+        rvecs = np.reshape(rvecs, (count, 3))
+        tvecs = np.reshape(tvecs, (count, 3)).astype(np.float64)
+        for marker_id, tvec, normal, quat in zip(ids, tvecs, normals(rvecs), quaternions(rvecs)):
+            stats = self.markers.get(marker_id)
+            if stats is None:
+                stats = self.markers[marker_id] = _MarkerStats()
+            stats.last_frame = frame
+            if self.is_outlier(stats, tvec, quat):
+                stats.outliers += 1
+            else:
+                stats.add(tvec, normal, quat)
+
+    def extend(self, results):
+        """ Add all rows of a MarkerResults"""
+        frames = results.frames
+        # Rows of a frame are consecutive
+        starts = np.flatnonzero(np.diff(frames, prepend=np.nan) != 0)
+        for start, stop in zip(starts, [*starts[1:], len(frames)]):
+            rows = slice(start, stop)
+            self.append(frames[start], results.ids[rows], results.rvecs[rows], results.tvecs[rows])
+
+    def snapshot(self):
+        """ Return a dataframe with the current statistics, one row per id"""
+        rows = []
+        for marker_id in sorted(self.markers):
+            stats = self.markers[marker_id]
+            if not stats.count:
+                rvec = np.full(3, np.nan)
+            else:
+                rvec = quaternion_rotation_vectors(stats.q_mean)[0]
+            rows.append([
+                marker_id, stats.count, stats.outliers, stats.last_frame,
+                *stats.t_mean, *stats.variance(stats.t_m2),
+                *stats.n_mean, *stats.variance(stats.n_m2),
+                *rvec,
+            ])
+        return pd.DataFrame(rows, columns=SNAPSHOT_COLUMNS)
+
+
+def read_frames(filename, chunk_size=10000):
+    """
+    Read a results csv file chunk by chunk and yield (frame, rows) for
+    every frame. The rows of a frame that continues in the next chunk are
+    carried over, so each frame is yielded once with all its rows.
+    Rows of a frame must be consecutive.
+    """
+    carry = None
+    for chunk in pd.read_csv(filename, chunksize=chunk_size):
+        # Files without frames are one frame, passed on chunk by chunk
+        if 'frame' not in chunk:
+            yield 0, chunk
+            continue
+        if carry is not None:
+            chunk = pd.concat((carry, chunk), ignore_index=True)
+        # The last frame may go on in the next chunk
+        last = chunk['frame'].values == chunk['frame'].values[-1]
+        carry = chunk[last]
+        for frame, rows in chunk[~last].groupby('frame', sort=False):
+            yield frame, rows
+    if carry is not None and len(carry):
+        yield carry['frame'].values[0], carry
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Average marker poses of a results file in one pass.')
+    parser.add_argument('file', type=str, nargs=1,
+                        help='a csv-file with pose data, ordered by frame')
+    parser.add_argument('-s', '--sigma', required=False,
+                        type=float, nargs=1, default=[3.0],
+                        help='outlier distance in standard deviations')
+    parser.add_argument('-a', '--max-angle', required=False,
+                        dest='max_angle', type=float, nargs=1, default=[10.0],
+                        help='outlier angle from the mean rotation in degrees')
+    parser.add_argument('--chunk-size', required=False,
+                        dest='chunk_size', type=int, nargs=1, default=[10000],
+                        help='rows read at a time')
+    parser.add_argument('-o', '--output', required=False,
+                        type=str, nargs=1,
+                        help='output csv-file')
+    args = parser.parse_args()
+
+    aggregator = PoseAggregator(outlier_sigma=args.sigma[0], max_angle=args.max_angle[0])
+    for frame, rows in read_frames(args.file[0], args.chunk_size[0]):
+        aggregator.append(
+            frame, rows['id'].values, rows[['rx', 'ry', 'rz']].values,
+            rows[['tx', 'ty', 'tz']].values
+        )
+
+    snapshot = aggregator.snapshot()
+    if args.output:
+        snapshot.to_csv(args.output[0], index=False)
+    else:
+        print(snapshot)
+
+
+if __name__ == "__main__":
+    main()
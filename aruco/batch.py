@@ -0,0 +1,254 @@
+import argparse
+import json
+import multiprocessing
+import os
+import cv2
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detector import Detector, UNDISTORT_MODES, UNDISTORT_REMAP
+from aruco.images import list_images
+from aruco.map_cache import UndistortMapCache, default_cache_dir
+from aruco.read import read_detector_params
+from aruco.registry import CalibrationRegistry
+from aruco.results import MarkerResults
+
+
+MANIFEST = 'manifest.json'
+
+# Detector of the current worker process, created once by _init_worker,
+# or one per calibration when calibrations are picked by image size
+_detector = None
+_detectors = {}
+_registry = None
+_config = None
+
+
+def make_shards(images, shard_size):
+    """ Split images into a list of (first frame index, image list)"""
+    return [
+        (start, images[start:start + shard_size])
+        for start in range(0, len(images), shard_size)
+    ]
+
+
+def _make_detector(config, cam_params):
+    return Detector(
+        cam_params,
+        read_detector_params(config['detector_params']),
+        cv2.aruco.getPredefinedDictionary(config['dictionary']),
+        config['marker_length'],
+        undistort_mode=config['undistort_mode']
+    )
+
+
+def _init_worker(config):
+    global _detector, _registry, _config
+    # Maps are already in the cache, so every worker memory maps the same
+    # files instead of computing its own copy
+    map_cache = UndistortMapCache(config['map_cache'])
+    _config = config
+    if config['camera_file'] is None:
+        _registry = CalibrationRegistry(config['calibration_dir'], map_cache=map_cache)
+        return
+    cam_params = read_camera_parameters(config['camera_file'], map_cache=map_cache)
+    _detector = _make_detector(config, cam_params)
+
+
+def _detector_for(img):
+    if _registry is None:
+        return _detector
+    cam_params = _registry.for_image(img)
+    if cam_params.calibration_hash not in _detectors:
+        _detectors[cam_params.calibration_hash] = _make_detector(_config, cam_params)
+    return _detectors[cam_params.calibration_hash]
+
+
+def _detect_shard(task):
+    shard, start, images, filename = task
+    results = MarkerResults()
+    for frame, image in enumerate(images, start):
+        img = cv2.imread(image)
+        if img is None:
+            raise IOError('Could not read image {}'.format(image))
+        # Images are thrown away, so detect and estimate without drawing
+        detector = _detector_for(img)
+        corners, ids, _ = detector.detect(img)
+        if ids is not None and ids.size:
+            rvecs, tvecs = detector.estimate_poses(corners)
+            results.append(frame, ids, rvecs, tvecs, corners)
+    # Write to a temporary file first, so a killed job never leaves a
+    # truncated shard behind
+    tmp = filename + '.tmp.npz'
+    results.save(tmp)
+    os.replace(tmp, filename)
+    return shard
+
+
+class BatchRunner:
+    """
+    Detect markers in a large set of images with a pool of processes.
+
+    Images are split into shards, and every finished shard is written to
+    workdir and recorded in a manifest. Running again with the same
+    images and settings only processes the shards that are missing.
+
+    Without a camera_file, each image is processed with the calibration
+    of its size in calibration_dir, so sizes may be mixed.
+    """
+
+    def __init__(self, workdir, camera_file, detector_params, dictionary,
+                 marker_length=1.0, undistort_mode=UNDISTORT_REMAP,
+                 map_cache=None, shard_size=32, processes=None,
+                 calibration_dir='calibration'):
+        self.workdir = workdir
+        self.shard_size = shard_size
+        self.processes = processes or os.cpu_count()
+        self.config = {
+            'camera_file': os.path.abspath(camera_file) if camera_file else None,
+            'calibration_dir': os.path.abspath(calibration_dir),
+            'detector_params': os.path.abspath(detector_params),
+            'dictionary': int(dictionary),
+            'marker_length': float(marker_length),
+            'undistort_mode': undistort_mode,
+            'map_cache': map_cache or default_cache_dir(),
+        }
+        os.makedirs(workdir, exist_ok=True)
+
+    def shard_file(self, shard):
+        return os.path.join(self.workdir, 'shard-{:06d}.npz'.format(shard))
+
+    def read_manifest(self, images):
+        """ Return the finished shards of a previous run on the same job"""
+        try:
+            with open(os.path.join(self.workdir, MANIFEST)) as stream:
+                manifest = json.load(stream)
+        except (OSError, ValueError):
+            return set()
+        same_job = (
+            manifest['images'] == images and
+            manifest['config'] == self.config and
+            manifest['shard_size'] == self.shard_size
+        )
+        if not same_job:
+            return set()
+        return {
+            shard for shard in manifest['done']
+            if os.path.exists(self.shard_file(shard))
+        }
+
+    def write_manifest(self, images, done):
+        manifest = {
+            'images': images,
+            'config': self.config,
+            'shard_size': self.shard_size,
+            'done': sorted(done),
+        }
+        tmp = os.path.join(self.workdir, MANIFEST + '.tmp')
+        with open(tmp, 'w') as stream:
+            json.dump(manifest, stream)
+        os.replace(tmp, os.path.join(self.workdir, MANIFEST))
+
+    def run(self, images, progress=None):
+        """
+        Process all images and return their merged MarkerResults, ordered
+        by frame. The frame of a detection is the index of its image.
+        """
+        shards = make_shards(images, self.shard_size)
+        done = self.read_manifest(images)
+        self.write_manifest(images, done)
+        todo = [
+            (shard, start, shard_images, self.shard_file(shard))
+            for shard, (start, shard_images) in enumerate(shards)
+            if shard not in done
+        ]
+
+        if todo:
+            # Compute undistortion maps once, before the workers start
+            map_cache = UndistortMapCache(self.config['map_cache'])
+            if self.config['camera_file'] is None:
+                registry = CalibrationRegistry(self.config['calibration_dir'], map_cache=map_cache)
+                for width, height in registry.sizes():
+                    registry.for_size(width, height)
+            else:
+                read_camera_parameters(self.config['camera_file'], map_cache=map_cache)
+            with multiprocessing.Pool(
+                    self.processes, _init_worker, (self.config,)
+            ) as pool:
+                for shard in pool.imap_unordered(_detect_shard, todo):
+                    done.add(shard)
+                    self.write_manifest(images, done)
+                    if progress is not None:
+                        progress(len(done), len(shards))
+
+        # Merge in shard order, so the output does not depend on scheduling
+        results = MarkerResults()
+        for shard in range(len(shards)):
+            results.extend(MarkerResults.load(self.shard_file(shard)))
+        return results
+
+
+def main():
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description='Detect markers in many images using several processes.')
+    parser.add_argument('-c', '--camera-file', required=False,
+                        dest='camera_file', type=str, nargs=1, default=[None],
+                        help='camera file (default: the calibration in '
+                             '--calibration-dir matching each image size)')
+    parser.add_argument('--calibration-dir', required=False,
+                        dest='calibration_dir', type=str, nargs=1,
+                        default=['calibration'],
+                        help='directory with calibration files')
+    parser.add_argument('-d', '--dictionary', required=True,
+                        dest='dictionary', type=int, nargs=1,
+                        help='dictionary')
+    parser.add_argument('-dp', '--detector-params', required=True,
+                        dest='detect_params', type=str, nargs=1,
+                        help='detector parameters')
+    parser.add_argument('-l', '--length', required=False,
+                        type=float, nargs=1, default=[1.0],
+                        help='marker length')
+    parser.add_argument('-o', '--output', required=True,
+                        dest='output', type=str, nargs=1,
+                        help='output file (.csv, .parquet or .feather)')
+    parser.add_argument('-w', '--workdir', required=True,
+                        dest='workdir', type=str, nargs=1,
+                        help='directory for shards and the resume manifest')
+    parser.add_argument('-j', '--processes', required=False,
+                        dest='processes', type=int, nargs=1, default=[None],
+                        help='number of processes (default: all cores)')
+    parser.add_argument('-s', '--shard-size', required=False,
+                        dest='shard_size', type=int, nargs=1, default=[32],
+                        help='images per shard')
+    parser.add_argument('-u', '--undistort', required=False,
+                        dest='undistort_mode', type=str, nargs=1,
+                        choices=UNDISTORT_MODES, default=[UNDISTORT_REMAP],
+                        help='undistort the whole image or only the corners')
+    parser.add_argument('--map-cache', required=False,
+                        dest='map_cache', type=str, nargs=1,
+                        default=[default_cache_dir()],
+                        help='undistortion map cache directory')
+    parser.add_argument('--corners', required=False,
+                        dest='corners',
+                        action='store_true', default=False,
+                        help='also output marker corners')
+    parser.add_argument('images', metavar='image', type=str, nargs='+',
+                        help='image files or directories')
+    args = parser.parse_args()
+
+    runner = BatchRunner(
+        args.workdir[0], args.camera_file[0], args.detect_params[0],
+        args.dictionary[0], marker_length=args.length[0],
+        undistort_mode=args.undistort_mode[0], map_cache=args.map_cache[0],
+        shard_size=args.shard_size[0], processes=args.processes[0],
+        calibration_dir=args.calibration_dir[0]
+    )
+
+    def progress(done, total):
+        print('Shard {}/{}'.format(done, total))
+
+    results = runner.run(list_images(args.images), progress=progress)
+    results.write(args.output[0], corners=args.corners)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+import argparse
+import collections
+import json
+import os
+import platform
+import sys
+import time
+import cv2
+import numpy as np
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detector import Detector, UNDISTORT_REMAP, UNDISTORT_CORNERS, INTERPOLATIONS
+from aruco.map_cache import UndistortMapCache, default_cache_dir
+from aruco.pyramid import PyramidDetector, coarse_level
+from aruco.read import read_detector_params
+from aruco.rotation import rotation_matrices
+from aruco.synthetic import SceneRenderer, floor_scene, marker_object_points, project_points
+
+
+RESOLUTIONS = ('low', 'mp3', 'mp5', 'mp8')
+# Resolutions benchmarked by default. Markers in the rendered scenes are
+# about 8 px wide at LOW, and its calibration gives a degenerate
+# undistorted camera matrix, so LOW results measure nothing
+DEFAULT_RESOLUTIONS = ('mp3', 'mp5', 'mp8')
+
+
+# A pipeline: undistort mode, coarse to fine search, grayscale input,
+# remap interpolation and scale of the decoded image
+Mode = collections.namedtuple(
+    'Mode', ['undistort_mode', 'pyramid', 'gray', 'interpolation', 'scale']
+)
+
+MODES = {
+    'remap': Mode(UNDISTORT_REMAP, False, False, 'cubic', 1.0),
+    'corners': Mode(UNDISTORT_CORNERS, False, False, 'cubic', 1.0),
+    'pyramid': Mode(UNDISTORT_REMAP, True, False, 'cubic', 1.0),
+    'pyramid-corners': Mode(UNDISTORT_CORNERS, True, False, 'cubic', 1.0),
+    'remap-gray': Mode(UNDISTORT_REMAP, False, True, 'cubic', 1.0),
+    'remap-gray-linear': Mode(UNDISTORT_REMAP, False, True, 'linear', 1.0),
+    'corners-gray': Mode(UNDISTORT_CORNERS, False, True, 'cubic', 1.0),
+    # Not a plain fast path: at half size the remap loses small markers
+    # and accuracy (mp3: detection_rate 0.89, 3x the corner error), while
+    # corner undistortion keeps them
+    'remap-gray-half': Mode(UNDISTORT_REMAP, False, True, 'linear', 0.5),
+    'corners-gray-half': Mode(UNDISTORT_CORNERS, False, True, 'cubic', 0.5),
+}
+
+
+def make_detector(mode, cam_params, params, dictionary, marker_length):
+    """
+    Create the detector of a mode, or None when it does not apply.
+    Pyramid modes search a half size frame first, see coarse_level.
+    """
+    if mode.scale != 1.0:
+        cam_params = cam_params.scaled(mode.scale)
+    if mode.pyramid:
+        coarse = coarse_level(cam_params)
+        if coarse is None:
+            return None
+        return PyramidDetector(
+            cam_params, params, dictionary, marker_length, coarse,
+            undistort_mode=mode.undistort_mode,
+            interpolation=INTERPOLATIONS[mode.interpolation]
+        )
+    return Detector(
+        cam_params, params, dictionary, marker_length,
+        undistort_mode=mode.undistort_mode,
+        interpolation=INTERPOLATIONS[mode.interpolation]
+    )
+
+
+def prepare_image(mode, img):
+    """
+    The image as the mode decodes it, i.e. as cv2.IMREAD_GRAYSCALE or
+    cv2.IMREAD_REDUCED_GRAYSCALE_2 would give it
+    """
+    if mode.gray:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if mode.scale != 1.0:
+        height, width = img.shape[:2]
+        size = (int(round(width * mode.scale)), int(round(height * mode.scale)))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img
+
+
+# Allowed relative change before a result counts as a regression
+TOLERANCES = {
+    'fps': 0.2,
+    'detection_rate': 0.05,
+    'translation_error': 0.25,
+    'rotation_error': 0.25,
+}
+
+
+def make_frames(renderer, frames, markers, seed):
+    """ Render frames, return a list of (image, ids, rvecs, tvecs)"""
+    rng = np.random.default_rng(seed)
+    ids = np.arange(markers)
+    scenes = []
+    for _ in range(frames):
+        rvecs, tvecs = floor_scene(rng, ids, renderer.marker_length)
+        img = renderer.render(ids, rvecs, tvecs, noise=2.0, blur=0.7, rng=rng)
+        scenes.append((img, ids, rvecs, tvecs))
+    return scenes
+
+
+def run_mode(detector, scenes, repeat=1, cam_params=None, prepare=None):
+    """
+    Time detection and pose estimation on the scenes and compare the
+    result with the ground truth. Scenes were rendered with cam_params,
+    which defaults to the detector's, and are passed through prepare
+    before timing.
+    """
+    latencies = []
+    found = expected = 0
+    t_errors, r_errors, c_errors = [], [], []
+    cam_params = cam_params or detector.cam_params
+    object_points = marker_object_points(detector.marker_length)
+    for img, ids, rvecs, tvecs in scenes:
+        if prepare is not None:
+            img = prepare(img)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            corners, found_ids, _ = detector.detect(img)
+            if found_ids is not None and found_ids.size:
+                est_rvecs, est_tvecs = detector.estimate_poses(corners)
+            latencies.append(time.perf_counter() - start)
+
+        expected += len(ids)
+        if found_ids is None or not found_ids.size:
+            continue
+        truth = {marker_id: i for i, marker_id in enumerate(ids)}
+        matched = [
+            (i, truth[marker_id]) for i, marker_id in enumerate(found_ids[:, 0])
+            if marker_id in truth
+        ]
+        if not matched:
+            continue
+        found += len(matched)
+        est, gt = (np.array(index) for index in zip(*matched))
+        t_errors.extend(np.linalg.norm(est_tvecs[est, 0] - tvecs[gt], axis=1))
+        # Angle of the rotation between estimated and true orientation
+        diff = np.matmul(
+            np.transpose(rotation_matrices(est_rvecs[est, 0]), (0, 2, 1)),
+            rotation_matrices(rvecs[gt])
+        )
+        cos = (np.trace(diff, axis1=1, axis2=2) - 1) / 2
+        r_errors.extend(np.degrees(np.arccos(np.clip(cos, -1, 1))))
+        # Corner error in pixels of the distorted, full size image
+        detected = cam_params.rays_to_points(
+            detector.cam_params.points_to_rays(np.concatenate([corners[i] for i in est])),
+            distorted=True
+        ).reshape(-1, 4, 2)
+        for points, g in zip(detected, gt):
+            true_corners = project_points(cam_params, object_points, rvecs[g], tvecs[g])
+            c_errors.extend(np.linalg.norm(points - true_corners, axis=1))
+
+    latencies = np.array(latencies) * 1000
+
+    def mean(values):
+        return float(np.mean(values)) if len(values) else None
+
+    return {
+        'fps': float(1000 / latencies.mean()),
+        'latency_p50': float(np.percentile(latencies, 50)),
+        'latency_p95': float(np.percentile(latencies, 95)),
+        'latency_p99': float(np.percentile(latencies, 99)),
+        'detection_rate': found / expected if expected else 0.0,
+        'translation_error': mean(t_errors),
+        'rotation_error': mean(r_errors),
+        'corner_error': mean(c_errors),
+    }
+
+
+def run_benchmark(calibration_dir, detector_params, dictionary, marker_length=0.174,
+                  resolutions=DEFAULT_RESOLUTIONS, modes=tuple(MODES), frames=5, markers=9,
+                  repeat=1, seed=0, map_cache=None, log=None):
+    """
+    Benchmark every mode on every resolution. Return nested dicts of
+    results, by resolution and mode
+    """
+    def camera(resolution):
+        return read_camera_parameters(
+            os.path.join(calibration_dir, 'fisheye_calibration_{}.xml'.format(resolution)),
+            map_cache=map_cache
+        )
+
+    results = {}
+    for resolution in resolutions:
+        cam_params = camera(resolution)
+        renderer = SceneRenderer(cam_params, dictionary, marker_length)
+        scenes = make_frames(renderer, frames, markers, seed)
+        results[resolution] = {}
+        for name in modes:
+            mode = MODES[name]
+            detector = make_detector(
+                mode, cam_params, detector_params, dictionary, marker_length
+            )
+            if detector is None:
+                continue
+            results[resolution][name] = run_mode(
+                detector, scenes, repeat, cam_params,
+                lambda img: prepare_image(mode, img)
+            )
+            if log is not None:
+                log(resolution, name, results[resolution][name])
+    return results
+
+
+def full_frame_mode(name):
+    """ Name of the mode that searches the whole frame like a pyramid mode"""
+    mode = MODES[name]._replace(pyramid=False)
+    return next(other for other, value in MODES.items() if value == mode)
+
+
+def reference_mode(name):
+    """ Name of the full frame, full size color mode a mode speeds up"""
+    mode = Mode(MODES[name].undistort_mode, False, False, 'cubic', 1.0)
+    return next(other for other, value in MODES.items() if value == mode)
+
+
+def tradeoffs(results):
+    """
+    Return a line per mode comparing its speed and accuracy with its
+    reference mode, so the cost of a faster mode is shown next to it
+    """
+    lines = []
+    for resolution, modes in results.items():
+        for mode, result in modes.items():
+            reference = reference_mode(mode)
+            base = modes.get(reference)
+            if mode == reference or base is None:
+                continue
+            line = '{:4} {:18} {:5.2f}x fps of {}, rate {:.2f} ({:+.2f})'.format(
+                resolution, mode, result['fps'] / base['fps'], reference,
+                result['detection_rate'], result['detection_rate'] - base['detection_rate']
+            )
+            for key, unit in (('translation_error', 'm'), ('corner_error', 'px')):
+                if result[key] is not None and base[key] is not None:
+                    line += ', {} {:.4g} {} ({:+.4g})'.format(
+                        key.split('_')[0], result[key], unit, result[key] - base[key]
+                    )
+            lines.append(line)
+    return lines
+
+
+def check_recall(results):
+    """
+    Return a list of messages for pyramid modes finding fewer markers
+    than the same mode searching the full frame
+    """
+    failures = []
+    for resolution, modes in results.items():
+        for mode, result in modes.items():
+            if not MODES[mode].pyramid:
+                continue
+            full = modes.get(full_frame_mode(mode))
+            if full is not None and result['detection_rate'] < full['detection_rate']:
+                failures.append('{} {} detection_rate: {:.4g} (full frame {:.4g})'.format(
+                    resolution, mode, result['detection_rate'], full['detection_rate']
+                ))
+    return failures
+
+
+def compare(results, baseline, tolerances=TOLERANCES):
+    """ Return a list of messages for results worse than the baseline"""
+    regressions = []
+    for resolution, modes in results.items():
+        for mode, result in modes.items():
+            base = baseline.get(resolution, {}).get(mode)
+            if base is None:
+                continue
+            for key, tolerance in tolerances.items():
+                new, old = result.get(key), base.get(key)
+                if new is None or old is None:
+                    continue
+                if key == 'fps':
+                    worse = new < old * (1 - tolerance)
+                elif key == 'detection_rate':
+                    worse = new < old - tolerance
+                else:
+                    # Small absolute slack for errors close to zero
+                    worse = new > old * (1 + tolerance) + 1e-3
+                if worse:
+                    regressions.append('{} {} {}: {:.4g} (baseline {:.4g})'.format(
+                        resolution, mode, key, new, old
+                    ))
+    return regressions
+
+
+def format_row(resolution, mode, result):
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else '-'.rjust(len(format(0, spec)))
+    return '{:4} {:18} {} fps  p50 {} ms  p95 {} ms  rate {}  t {} m  r {} deg  c {} px'.format(
+        resolution, mode, fmt(result['fps'], '7.2f'),
+        fmt(result['latency_p50'], '8.1f'), fmt(result['latency_p95'], '8.1f'),
+        fmt(result['detection_rate'], '5.2f'), fmt(result['translation_error'], '7.4f'),
+        fmt(result['rotation_error'], '6.2f'), fmt(result['corner_error'], '5.2f')
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark marker detection on rendered scenes.')
+    parser.add_argument('-dp', '--detector-params', required=False,
+                        dest='detect_params', type=str, nargs=1,
+                        default=['detector_params.yaml'],
+                        help='detector parameters')
+    parser.add_argument('-d', '--dictionary', required=False,
+                        dest='dictionary', type=int, nargs=1,
+                        default=[cv2.aruco.DICT_6X6_250],
+                        help='dictionary')
+    parser.add_argument('-l', '--length', required=False,
+                        type=float, nargs=1, default=[0.174],
+                        help='marker length')
+    parser.add_argument('--calibration-dir', required=False,
+                        dest='calibration_dir', type=str, nargs=1,
+                        default=['calibration'],
+                        help='directory with fisheye_calibration_<res>.xml')
+    parser.add_argument('-r', '--resolutions', required=False,
+                        dest='resolutions', type=str, nargs='+',
+                        choices=RESOLUTIONS, default=list(DEFAULT_RESOLUTIONS),
+                        help='resolutions to benchmark (default: mp3 mp5 mp8)')
+    parser.add_argument('-m', '--modes', required=False,
+                        dest='modes', type=str, nargs='+',
+                        choices=list(MODES), default=list(MODES),
+                        help='pipeline modes to benchmark')
+    parser.add_argument('-f', '--frames', required=False,
+                        dest='frames', type=int, nargs=1, default=[5],
+                        help='rendered frames per resolution')
+    parser.add_argument('--repeat', required=False,
+                        dest='repeat', type=int, nargs=1, default=[3],
+                        help='timed runs per frame')
+    parser.add_argument('--seed', required=False,
+                        dest='seed', type=int, nargs=1, default=[0],
+                        help='random seed of the scenes')
+    parser.add_argument('-o', '--output', required=False,
+                        dest='output', type=str, nargs=1,
+                        help='write results to a json file')
+    parser.add_argument('--merge', required=False,
+                        dest='merge',
+                        action='store_true', default=False,
+                        help='only add the results of modes missing from an '
+                             'existing output file, keeping its entries')
+    parser.add_argument('-b', '--baseline', required=False,
+                        dest='baseline', type=str, nargs=1,
+                        help='json file with baseline results to compare with')
+    args = parser.parse_args()
+
+    def log(resolution, mode, result):
+        print(format_row(resolution, mode, result), flush=True)
+
+    results = run_benchmark(
+        args.calibration_dir[0], read_detector_params(args.detect_params[0]),
+        cv2.aruco.getPredefinedDictionary(args.dictionary[0]),
+        marker_length=args.length[0], resolutions=args.resolutions,
+        modes=args.modes, frames=args.frames[0], repeat=args.repeat[0],
+        seed=args.seed[0], map_cache=UndistortMapCache(default_cache_dir()), log=log
+    )
+
+    if args.output:
+        output = results
+        if args.merge and os.path.exists(args.output[0]):
+            with open(args.output[0]) as stream:
+                output = json.load(stream)['results']
+            # Existing entries are kept, so a merge never re-baselines them
+            for resolution, modes in results.items():
+                for mode, result in modes.items():
+                    output.setdefault(resolution, {}).setdefault(mode, result)
+        with open(args.output[0], 'w') as stream:
+            json.dump({
+                'platform': platform.platform(),
+                'machine': platform.machine(),
+                'opencv': cv2.__version__,
+                'results': output,
+            }, stream, indent=2)
+
+    print('Compared with the full frame, full size color mode:')
+    for line in tradeoffs(results):
+        print(line)
+
+    # Coarse to fine search must not lose markers
+    regressions = check_recall(results)
+    if args.baseline:
+        with open(args.baseline[0]) as stream:
+            baseline = json.load(stream)
+        regressions += compare(results, baseline['results'])
+        if baseline.get('machine') != platform.machine():
+            print('Baseline is from a {} machine, timings may not compare'.format(
+                baseline.get('machine')))
+    for regression in regressions:
+        print('REGRESSION', regression)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
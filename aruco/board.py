@@ -0,0 +1,282 @@
+import argparse
+import cv2
+import numpy as np
+import pandas as pd
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detect_markers import read_images
+from aruco.detector import Detector, UNDISTORT_MODES, UNDISTORT_REMAP
+from aruco.map_cache import UndistortMapCache, default_cache_dir
+from aruco.read import read_detector_params
+from aruco.results import MarkerResults
+from aruco.rotation import rotation_matrices, rotation_vectors
+from aruco.synthetic import marker_object_points
+
+
+LAYOUT_COLUMNS = ['id'] + ['c{}{}'.format(i, axis) for i in range(4) for axis in 'xyz']
+
+
+def mean_rotations(rvecs):
+    """
+    Mean of rotation vectors, as the rotation closest to the mean of
+    their rotation matrices
+    """
+    u, _, vt = np.linalg.svd(rotation_matrices(rvecs).mean(axis=0))
+    if np.linalg.det(u @ vt) < 0:
+        u[:, -1] = -u[:, -1]
+    return rotation_vectors((u @ vt)[None])[0]
+
+
+def floor_frame(points):
+    """
+    Rotation and origin of a frame on the plane through (N, 3) points:
+    origin at their centroid, z towards the camera and x along the
+    camera x axis projected onto the plane
+    """
+    centroid = points.mean(axis=0)
+    _, _, vt = np.linalg.svd(points - centroid, full_matrices=False)
+    z = vt[-1] if np.dot(vt[-1], centroid) < 0 else -vt[-1]
+    x = np.array([1.0, 0, 0]) - z[0] * z
+    x /= np.linalg.norm(x)
+    # Rows are the frame axes in camera coordinates
+    return np.array([x, np.cross(z, x), z]), centroid
+
+
+class MarkerLayout:
+    """
+    Known corner positions of markers in a common frame, i.e. a custom
+    aruco board. Corners are (N, 4, 3), in detectMarkers order.
+    """
+
+    def __init__(self, ids, corners, dictionary):
+        self.ids = np.asarray(ids, dtype=np.int32).ravel()
+        self.corners = np.asarray(corners, dtype=np.float32).reshape(-1, 4, 3)
+        self.dictionary = dictionary
+        self.board = cv2.aruco.Board_create(
+            list(self.corners), dictionary, self.ids.reshape(-1, 1)
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_poses(cls, df, marker_length, dictionary, scale=1.0, floor=True):
+        """
+        Create a layout from a dataframe of marker poses (id, tx..rz) seen
+        by one camera, e.g. averaged over a survey. Rows with the same id
+        are averaged. Positions are multiplied by scale, e.g. the scaling
+        factor of floor_plane.py. With floor, the layout is expressed in
+        a frame on the plane through the markers instead of the camera
+        frame.
+        """
+        grouped = df.groupby('id', sort=True)
+        ids = np.array(list(grouped.groups))
+        tvecs = grouped[['tx', 'ty', 'tz']].mean().values * scale
+        rvecs = np.array([
+            mean_rotations(group[['rx', 'ry', 'rz']].values) for _, group in grouped
+        ])
+        corners = np.matmul(
+            marker_object_points(marker_length), np.transpose(rotation_matrices(rvecs), (0, 2, 1))
+        ) + tvecs[:, None]
+        if floor and len(ids) >= 3:
+            axes, origin = floor_frame(tvecs)
+            corners = np.matmul(corners - origin, axes.T)
+        return cls(ids, corners, dictionary)
+
+    @classmethod
+    def read(cls, filename, dictionary):
+        """ Read a layout written by write"""
+        df = pd.read_csv(filename)
+        return cls(df['id'].values, df[LAYOUT_COLUMNS[1:]].values, dictionary)
+
+    def write(self, filename):
+        df = pd.DataFrame(self.corners.reshape(-1, 12), columns=LAYOUT_COLUMNS[1:])
+        df.insert(0, 'id', self.ids)
+        df.to_csv(filename, index=False)
+
+    def marker_poses(self, rvec, tvec):
+        """
+        Given the pose of the layout, return (N, 3) rvecs and tvecs of
+        the centers of all its markers in the camera frame
+        """
+        rot_mat = rotation_matrices(np.reshape(rvec, (1, 3)))[0]
+        centers = self.corners.mean(axis=1) @ rot_mat.T + np.ravel(tvec)
+        # Marker axes from the corners: x from corner 0 to 1, y from 3 to 0
+        x = self.corners[:, 1] - self.corners[:, 0]
+        y = self.corners[:, 0] - self.corners[:, 3]
+        x /= np.linalg.norm(x, axis=1, keepdims=True)
+        y /= np.linalg.norm(y, axis=1, keepdims=True)
+        axes = np.stack((x, y, np.cross(x, y)), axis=2)
+        return rotation_vectors(np.matmul(rot_mat, axes)), centers
+
+
+def estimate_layout_pose(layout, corners, ids, cam_mat, dist_coeffs):
+    """
+    Estimate the pose of a layout with a single solvePnP over the corners
+    of all detected markers that belong to it. Return rvec, tvec and a
+    dataframe of the mean reprojection error of each used marker, or
+    None, None and an empty dataframe when no layout marker was found.
+    """
+    residuals = pd.DataFrame(columns=['id', 'residual'])
+    if ids is None or not ids.size:
+        return None, None, residuals
+    known = np.isin(ids[:, 0], layout.ids)
+    if not known.any():
+        return None, None, residuals
+    used_ids = ids[known]
+    used_corners = [c for c, k in zip(corners, known) if k]
+    object_points, image_points = cv2.aruco.getBoardObjectAndImagePoints(
+        layout.board, used_corners, used_ids
+    )
+    # A single planar marker has two ambiguous solutions, IPPE picks the best
+    flags = cv2.SOLVEPNP_IPPE if len(used_ids) == 1 else cv2.SOLVEPNP_ITERATIVE
+    ok, rvec, tvec = cv2.solvePnP(
+        object_points, image_points, cam_mat, dist_coeffs, flags=flags
+    )
+    if not ok:
+        return None, None, residuals
+    projected, _ = cv2.projectPoints(object_points, rvec, tvec, cam_mat, dist_coeffs)
+    errors = np.linalg.norm(
+        projected.reshape(-1, 4, 2) - image_points.reshape(-1, 4, 2), axis=2
+    ).mean(axis=1)
+    residuals = pd.DataFrame({'id': used_ids[:, 0], 'residual': errors})
+    return rvec.ravel(), tvec.ravel(), residuals
+
+
+def estimate_layout(detector, layout, images):
+    """
+    Detect markers in every image and estimate the layout pose. Return a
+    dataframe with one row per frame (frame, markers, rx..tz, rms), a
+    dataframe of per marker residuals (frame, id, residual), and
+    MarkerResults with the pose of every layout marker that was seen,
+    derived from the layout pose.
+    """
+    poses, all_residuals = [], []
+    marker_results = MarkerResults()
+    for frame, img in enumerate(images):
+        corners, ids, _ = detector.detect(img)
+        rvec, tvec, residuals = estimate_layout_pose(
+            layout, corners, ids,
+            detector.cam_params.pose_cam_mat, detector.cam_params.pose_dist_coeffs
+        )
+        if rvec is None:
+            continue
+        poses.append([frame, len(residuals), *rvec, *tvec,
+                      np.sqrt(np.mean(residuals['residual'] ** 2))])
+        all_residuals.append(residuals.assign(frame=frame))
+
+        # Layout markers seen in this frame, posed from the layout
+        rvecs, tvecs = layout.marker_poses(rvec, tvec)
+        seen = np.isin(layout.ids, residuals['id'])
+        order = {marker_id: i for i, marker_id in enumerate(ids[:, 0])}
+        seen_corners = [corners[order[marker_id]] for marker_id in layout.ids[seen]]
+        marker_results.append(
+            frame, layout.ids[seen], rvecs[seen], tvecs[seen], seen_corners
+        )
+
+    poses = pd.DataFrame(
+        poses, columns=['frame', 'markers', 'rx', 'ry', 'rz', 'tx', 'ty', 'tz', 'rms']
+    )
+    if all_residuals:
+        residuals = pd.concat(all_residuals, ignore_index=True)[['frame', 'id', 'residual']]
+    else:
+        residuals = pd.DataFrame(columns=['frame', 'id', 'residual'])
+    return poses, residuals, marker_results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Estimate the pose of a known marker layout with one '
+                    'solvePnP per frame.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    create = subparsers.add_parser(
+        'create', help='create a layout from averaged marker poses')
+    create.add_argument('poses', type=str, nargs=1,
+                        help='a csv-file with marker poses (id, tx..rz)')
+    create.add_argument('-l', '--length', required=True,
+                        type=float, nargs=1,
+                        help='marker length')
+    create.add_argument('-s', '--scale', required=False,
+                        type=float, nargs=1, default=[1.0],
+                        help='scale positions, e.g. by the scaling factor '
+                             'of floor_plane.py')
+    create.add_argument('--camera-frame', required=False,
+                        dest='camera_frame',
+                        action='store_true', default=False,
+                        help='keep the layout in the camera frame instead '
+                             'of a frame on the floor plane')
+    create.add_argument('-o', '--output', required=True,
+                        type=str, nargs=1,
+                        help='output layout csv-file')
+
+    detect = subparsers.add_parser(
+        'detect', help='estimate the layout pose in images')
+    detect.add_argument('layout', type=str, nargs=1,
+                        help='layout csv-file')
+    detect.add_argument('-c', '--camera-file', required=True,
+                        dest='camera_file', type=str, nargs=1,
+                        help='camera file')
+    detect.add_argument('-dp', '--detector-params', required=True,
+                        dest='detect_params', type=str, nargs=1,
+                        help='detector parameters')
+    detect.add_argument('-u', '--undistort', required=False,
+                        dest='undistort_mode', type=str, nargs=1,
+                        choices=UNDISTORT_MODES, default=[UNDISTORT_REMAP],
+                        help='undistort the whole image or only the corners')
+    detect.add_argument('-o', '--output', required=False,
+                        type=str, nargs=1,
+                        help='output csv-file with the layout pose per frame')
+    detect.add_argument('--residuals', required=False,
+                        type=str, nargs=1,
+                        help='output csv-file with per marker residuals')
+    detect.add_argument('--markers', required=False,
+                        type=str, nargs=1,
+                        help='output file with marker poses from the layout '
+                             'pose, in the format of detect_markers')
+    detect.add_argument('images', metavar='image', type=str, nargs='+',
+                        help='image files')
+
+    for subparser in (create, detect):
+        subparser.add_argument('-d', '--dictionary', required=False,
+                               dest='dictionary', type=int, nargs=1,
+                               default=[cv2.aruco.DICT_6X6_250],
+                               help='dictionary')
+    args = parser.parse_args()
+
+    dictionary = cv2.aruco.getPredefinedDictionary(args.dictionary[0])
+    if args.command == 'create':
+        layout = MarkerLayout.from_poses(
+            pd.read_csv(args.poses[0]), args.length[0], dictionary,
+            scale=args.scale[0], floor=not args.camera_frame
+        )
+        layout.write(args.output[0])
+        print('Layout of {} markers'.format(len(layout)))
+        return
+
+    layout = MarkerLayout.read(args.layout[0], dictionary)
+    cam_params = read_camera_parameters(
+        args.camera_file[0], map_cache=UndistortMapCache(default_cache_dir())
+    )
+    # Marker length only matters for per marker poses, which are not used
+    detector = Detector(
+        cam_params, read_detector_params(args.detect_params[0]), dictionary,
+        float(np.linalg.norm(layout.corners[0, 1] - layout.corners[0, 0])),
+        undistort_mode=args.undistort_mode[0]
+    )
+    images = read_images(args.images)
+    poses, residuals, marker_results = estimate_layout(detector, layout, images)
+
+    if args.output:
+        poses.to_csv(args.output[0], index=False)
+    else:
+        print(poses)
+    if args.residuals:
+        residuals.to_csv(args.residuals[0], index=False)
+    else:
+        print(residuals.groupby('id')['residual'].describe())
+    if args.markers:
+        marker_results.write(args.markers[0])
+
+
+if __name__ == "__main__":
+    main()
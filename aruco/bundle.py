@@ -0,0 +1,627 @@
+import argparse
+import collections
+import time
+import cv2
+import numpy as np
+import pandas as pd
+from aruco.camera_parameters import read_camera_parameters
+from aruco.results import read_results
+from aruco.rotation import cross_matrices, right_jacobians, rotation_matrices, rotation_vectors
+from aruco.synthetic import marker_object_points
+
+
+# Corner error in pixels of markers used to place a camera initially
+INIT_THRESHOLD_PX = 8.0
+
+# Levenberg-Marquardt damping, relative to the diagonal of J^T J
+MIN_DAMPING = 1e-9
+MAX_DAMPING = 1e9
+
+EPSILON = 1e-12
+
+# Normal equations split into the dense block of the scale and markers,
+# (6, 6) camera blocks and the blocks coupling cameras with each detection
+NormalEquations = collections.namedtuple('NormalEquations', [
+    'kept', 'kept_gradient', 'cameras', 'camera_gradients', 'marker_cameras', 'scale_cameras'
+])
+
+
+def measured_pairs(measured):
+    """
+    Given a dataframe of measured pairwise distances (id,
+    measured_distance), return (N, 2) marker id pairs and distances.
+    As in floor_plane.py, even id is paired with the following odd id.
+    """
+    ids = measured['id'].values.astype(np.int64)
+    return np.column_stack((ids, ids + 1)), measured['measured_distance'].values.astype(np.float64)
+
+
+def normalized_corners(results, cam_params):
+    """
+    Corners of MarkerResults as (N, 4, 2) normalized image coordinates,
+    i.e. with the camera matrix and distortion of the poses removed
+    """
+    corners = results.corners.reshape(-1, 1, 2).astype(np.float64)
+    points = cv2.undistortPoints(corners, cam_params.pose_cam_mat, cam_params.pose_dist_coeffs)
+    return points.reshape(-1, 4, 2)
+
+
+def _compose(rot_a, t_a, rot_b, t_b):
+    """ Transform b followed by transform a"""
+    return rot_a @ rot_b, rot_a @ t_b + t_a
+
+
+def _invert(rot, t):
+    return rot.T, -rot.T @ t
+
+
+def initial_poses(frames, ids, rvecs, tvecs, points, object_points, threshold=0.01):
+    """
+    Chain single marker poses into a common frame, the camera frame of
+    the frame with the most markers. Frames are placed in order of most
+    placed markers seen, with solvePnPRansac on their corners (threshold
+    in normalized image coordinates), or through the pose of the one
+    placed marker they see, and place the markers they see largest, until
+    no frame is left that shares a marker with the placed ones.
+    Return dicts of camera poses by frame and marker poses by id, as
+    (rotation matrix, translation) from the common frame, and from the
+    marker frame respectively.
+    """
+    rot_mats = rotation_matrices(rvecs)
+    by_frame = {}
+    by_marker = {}
+    for i, (frame, marker_id) in enumerate(zip(frames, ids)):
+        by_frame.setdefault(frame, []).append(i)
+        by_marker.setdefault(marker_id, []).append(frame)
+
+    # Areas of the markers in normalized image coordinates
+    diagonals = np.cross(points[:, 2] - points[:, 0], points[:, 3] - points[:, 1])
+    areas = np.abs(diagonals) / 2
+
+    root = max(by_frame, key=lambda frame: len(by_frame[frame]))
+    cameras = {root: (np.eye(3), np.zeros(3))}
+    markers = {}
+    sources = {}
+    # Placed markers seen by each frame not placed yet
+    shared = {frame: 0 for frame in by_frame if frame != root}
+
+    def place(i, pose):
+        if ids[i] not in markers:
+            for frame in by_marker[ids[i]]:
+                if frame in shared:
+                    shared[frame] += 1
+        markers[ids[i]] = pose
+        sources[ids[i]] = areas[i]
+
+    for i in by_frame[root]:
+        place(i, (rot_mats[i], tvecs[i]))
+    while shared:
+        # Next the frame sharing the most placed markers
+        frame = max(shared, key=shared.get)
+        if not shared.pop(frame):
+            break
+        known = [i for i in by_frame[frame] if ids[i] in markers]
+        world = np.concatenate([
+            (markers[ids[i]][0] @ object_points.T).T + markers[ids[i]][1] for i in known
+        ])
+        image = np.concatenate([points[i] for i in known])
+        if len(known) > 1:
+            # Markers placed through a flipped pose are outliers
+            ok, rvec, tvec, inliers = cv2.solvePnPRansac(
+                world, image, np.eye(3), None, reprojectionError=threshold,
+                flags=cv2.SOLVEPNP_SQPNP
+            )
+        else:
+            ok = False
+        if ok:
+            rot, t = cv2.Rodrigues(rvec)[0], tvec.ravel()
+        else:
+            # Camera pose through the first placed marker
+            first = known[0]
+            rot, t = _compose(rot_mats[first], tvecs[first], *_invert(*markers[ids[first]]))
+        cameras[frame] = (rot, t)
+        inverse = _invert(rot, t)
+        for i in by_frame[frame]:
+            # Placed through the largest view, whose pose is most accurate
+            if areas[i] > sources.get(ids[i], 0.0):
+                place(i, _compose(*inverse, rot_mats[i], tvecs[i]))
+
+    # Of the poses of a marker through each of its views, keep the one
+    # that best explains all views, which undoes flipped single marker poses
+    placed = np.array([frame in cameras for frame in frames], dtype=bool)
+    for marker_id in markers:
+        rows = np.flatnonzero(placed & (ids == marker_id))
+        if len(rows) < 3:
+            continue
+        cam_rot = np.array([cameras[frames[i]][0] for i in rows])
+        cam_t = np.array([cameras[frames[i]][1] for i in rows])
+        cand_rot = np.matmul(cam_rot.transpose(0, 2, 1), rot_mats[rows])
+        cand_t = np.matmul(cam_rot.transpose(0, 2, 1), (tvecs[rows] - cam_t)[:, :, None])[:, :, 0]
+        # (candidates, views, corners, 3)
+        world = np.matmul(object_points, cand_rot.transpose(0, 2, 1)) + cand_t[:, None]
+        cam = np.matmul(world[:, None], cam_rot.transpose(0, 2, 1)[None]) + cam_t[None, :, None]
+        errors = np.sum((cam[..., :2] / cam[..., 2:] - points[rows]) ** 2, axis=-1)
+        errors[~(cam[..., 2] > 0)] = np.inf
+        score = np.minimum(errors, threshold ** 2).sum(axis=(1, 2))
+        best = np.argmin(score)
+        markers[marker_id] = (cand_rot[best], cand_t[best])
+    return cameras, markers
+
+
+def huber_weights(errors, f_scale):
+    """ Weights of errors in least squares that minimize the Huber loss"""
+    return np.where(errors <= f_scale, 1.0, f_scale / np.maximum(errors, EPSILON))
+
+
+class BundleProblem:
+    """
+    Joint estimate of marker poses, camera poses and scale from the
+    corners of many frames.
+
+    Parameters are the scale of the markers (only with pair distances,
+    otherwise the marker length sets the scale), the pose of every
+    camera but the first, which defines the frame of the result, and the
+    pose of every marker, each as rotation vector and translation.
+    Residuals are corner reprojection errors in pixels divided by
+    sigma_px, and differences between marker distances and measured
+    pair distances divided by sigma_distance.
+    """
+
+    def __init__(self, frames, ids, points, marker_length, focal, pairs=None,
+                 distances=None, sigma_px=1.0, sigma_distance=0.002):
+        self.frame_ids, self.det_frames = np.unique(frames, return_inverse=True)
+        self.marker_ids, self.det_markers = np.unique(ids, return_inverse=True)
+        self.points = points
+        self.object_points = marker_object_points(marker_length)
+        self.focal = focal
+        self.sigma_px = sigma_px
+        self.sigma_distance = sigma_distance
+        # Pairs of markers that were both seen
+        self.pairs = np.zeros((0, 2), dtype=np.int64)
+        self.distances = np.zeros(0)
+        if pairs is not None:
+            index = {marker_id: i for i, marker_id in enumerate(self.marker_ids)}
+            known = [k for k, (a, b) in enumerate(pairs) if a in index and b in index]
+            self.pairs = np.array(
+                [(index[pairs[k][0]], index[pairs[k][1]]) for k in known], dtype=np.int64
+            ).reshape(-1, 2)
+            self.distances = np.asarray(distances, dtype=np.float64)[known]
+        self.free_scale = len(self.pairs) > 0
+        self.n_cameras = len(self.frame_ids)
+        self.n_markers = len(self.marker_ids)
+        # Detections of each camera
+        order = np.argsort(self.det_frames, kind='stable')
+        self.frame_rows = np.split(order, np.cumsum(np.bincount(self.det_frames))[:-1])
+        # Markers of each camera, once even when a frame has the same id
+        # twice, and the marker of each of its detections
+        self.frame_markers = [
+            np.unique(self.det_markers[rows], return_inverse=True) for rows in self.frame_rows
+        ]
+
+    @property
+    def n_residuals(self):
+        return 8 * len(self.points) + len(self.pairs)
+
+    @property
+    def n_params(self):
+        return int(self.free_scale) + 6 * (self.n_cameras - 1) + 6 * self.n_markers
+
+    def pack(self, scale, cam_rvecs, cam_tvecs, marker_rvecs, marker_tvecs):
+        return np.concatenate((
+            [scale] if self.free_scale else [],
+            np.hstack((cam_rvecs[1:], cam_tvecs[1:])).ravel(),
+            np.hstack((marker_rvecs, marker_tvecs)).ravel(),
+        ))
+
+    def unpack(self, x):
+        """ Return scale, camera and marker rvecs and tvecs"""
+        offset = int(self.free_scale)
+        scale = x[0] if self.free_scale else 1.0
+        cameras = np.vstack((np.zeros((1, 6)), x[offset:offset + 6 * (self.n_cameras - 1)].reshape(-1, 6)))
+        markers = x[offset + 6 * (self.n_cameras - 1):].reshape(-1, 6)
+        return scale, cameras[:, :3], cameras[:, 3:], markers[:, :3], markers[:, 3:]
+
+    def _transform(self, x):
+        """
+        Rotations of the cameras and markers of all detections, corners in
+        the marker frame rotated to the common frame, corners in the common
+        frame and corners in the camera frame
+        """
+        scale, cam_rvecs, cam_tvecs, marker_rvecs, marker_tvecs = self.unpack(x)
+        cam_rots = rotation_matrices(cam_rvecs)
+        marker_rots = rotation_matrices(marker_rvecs)
+        cam_rot = cam_rots[self.det_frames]
+        marker_rot = marker_rots[self.det_markers]
+        # matmul of stacks is much faster than the equivalent einsum
+        local = np.matmul(self.object_points, marker_rot.transpose(0, 2, 1))
+        world = scale * local + marker_tvecs[self.det_markers, None]
+        cam = np.matmul(world, cam_rot.transpose(0, 2, 1)) + cam_tvecs[self.det_frames, None]
+        return cam_rots, marker_rots, cam_rot, marker_rot, local, world, cam
+
+    def project(self, x):
+        """ (N, 4, 2) normalized projections of the corners of all detections"""
+        cam = self._transform(x)[-1]
+        return cam[..., :2] / cam[..., 2:]
+
+    def pair_distances(self, x):
+        marker_tvecs = self.unpack(x)[4]
+        return np.linalg.norm(marker_tvecs[self.pairs[:, 0]] - marker_tvecs[self.pairs[:, 1]], axis=1)
+
+    def residuals(self, x):
+        """
+        (N, 4, 2) corner reprojection residuals and (P,) pair distance
+        residuals, in standard deviations
+        """
+        reprojection = (self.project(x) - self.points) * self.focal / self.sigma_px
+        distance = (self.pair_distances(x) - self.distances) / self.sigma_distance
+        return reprojection, distance
+
+    def cost(self, x, f_scale=None):
+        """
+        Half the sum of squared residuals, with the Huber loss of the error
+        of each corner and pair distance when f_scale is given
+        """
+        reprojection, distance = self.residuals(x)
+        errors = np.concatenate((np.linalg.norm(reprojection, axis=2).ravel(), np.abs(distance)))
+        if f_scale is None:
+            return 0.5 * np.sum(errors ** 2)
+        return 0.5 * np.sum(np.where(
+            errors <= f_scale, errors ** 2, 2 * f_scale * errors - f_scale ** 2
+        ))
+
+    def jacobian(self, x):
+        """
+        Jacobian in blocks: (N, 8, 13) derivatives of the corner residuals
+        of every detection by the scale, the camera pose and the marker
+        pose, and (P, 3) derivatives of the pair distance residuals by the
+        position of the first marker, the negative of those by the second
+        """
+        scale, cam_rvecs, _, marker_rvecs, marker_tvecs = self.unpack(x)
+        cam_rots, marker_rots, cam_rot, marker_rot, local, world, cam = self._transform(x)
+        cam_jacs = right_jacobians(cam_rvecs, cam_rots)[self.det_frames]
+        marker_jacs = right_jacobians(marker_rvecs, marker_rots)[self.det_markers]
+
+        # Derivatives of the projection by the point in the camera frame
+        inv_z = 1 / cam[..., 2]
+        d_proj = np.zeros(cam.shape[:2] + (2, 3))
+        d_proj[..., 0, 0] = inv_z
+        d_proj[..., 1, 1] = inv_z
+        d_proj[..., :, 2] = -cam[..., :2] * inv_z[..., None] ** 2
+        d_proj *= self.focal / self.sigma_px
+
+        # Derivatives of the point in the camera frame, (N, 4, 3, 13)
+        n_detections, n_corners = cam.shape[:2]
+        d_cam = np.empty((n_detections, n_corners, 3, 13))
+        d_cam[..., 0] = np.matmul(local, cam_rot.transpose(0, 2, 1))
+        d_cam[..., 1:4] = -np.matmul(
+            np.matmul(cam_rot[:, None], cross_matrices(world).reshape(n_detections, n_corners, 3, 3)),
+            cam_jacs[:, None]
+        )
+        d_cam[..., 4:7] = np.eye(3)
+        d_cam[..., 7:10] = -np.matmul(
+            np.matmul(np.matmul(cam_rot, marker_rot)[:, None], cross_matrices(scale * self.object_points)),
+            marker_jacs[:, None]
+        )
+        d_cam[..., 10:13] = cam_rot[:, None]
+        blocks = np.matmul(d_proj, d_cam).reshape(n_detections, 8, 13)
+
+        delta = marker_tvecs[self.pairs[:, 0]] - marker_tvecs[self.pairs[:, 1]]
+        unit = delta / np.linalg.norm(delta, axis=1, keepdims=True) / self.sigma_distance
+        return blocks, unit
+
+    def normal_equations(self, x, f_scale=None):
+        """
+        Gauss-Newton normal equations J^T J dx = J^T r, with the residuals
+        weighted for the Huber loss when f_scale is given, as a NormalEquations
+        """
+        blocks, unit = self.jacobian(x)
+        reprojection, pair_residuals = self.residuals(x)
+        corner_weights = np.ones(reprojection.shape[:2])
+        pair_weights = np.ones(len(self.pairs))
+        if f_scale is not None:
+            # Iteratively reweighted least squares
+            corner_weights = huber_weights(np.linalg.norm(reprojection, axis=2), f_scale)
+            pair_weights = huber_weights(np.abs(pair_residuals), f_scale)
+        reprojection = reprojection.reshape(-1, 8)
+        weights = np.repeat(corner_weights, 2, axis=1)
+        weighted = blocks * weights[..., None]
+        # Per detection (13, 13) J^T J and J^T r
+        hessians = np.matmul(blocks.transpose(0, 2, 1), weighted)
+        gradients = np.matmul(weighted.transpose(0, 2, 1), reprojection[..., None])[..., 0]
+
+        scales = int(self.free_scale)
+        n_kept = scales + 6 * self.n_markers
+        marker_index = scales + 6 * self.det_markers[:, None] + np.arange(6)
+
+        # Markers and scale, kept dense as pairs couple markers
+        kept = np.zeros((n_kept, n_kept))
+        kept_gradient = np.zeros(n_kept)
+        np.add.at(kept, (marker_index[:, :, None], marker_index[:, None, :]), hessians[:, 7:, 7:])
+        np.add.at(kept_gradient, marker_index, gradients[:, 7:])
+        if self.free_scale:
+            kept[0, 0] = hessians[:, 0, 0].sum()
+            np.add.at(kept[0], marker_index, hessians[:, 0, 7:])
+            kept[1:, 0] = kept[0, 1:]
+            kept_gradient[0] = gradients[:, 0].sum()
+        pair_index = scales + 6 * self.pairs[:, :, None] + np.arange(3, 6)
+        signs = np.array([1.0, -1.0])
+        pair_jac = signs[None, :, None] * unit[:, None, :]
+        pair_hessians = pair_weights[:, None, None, None, None] * \
+            pair_jac[:, :, None, :, None] * pair_jac[:, None, :, None, :]
+        np.add.at(kept, (
+            pair_index[:, :, None, :, None], pair_index[:, None, :, None, :]
+        ), pair_hessians)
+        np.add.at(kept_gradient, pair_index, (pair_weights * pair_residuals)[:, None, None] * pair_jac)
+
+        # Cameras only share markers, and the first is fixed
+        cameras = np.zeros((self.n_cameras, 6, 6))
+        camera_gradients = np.zeros((self.n_cameras, 6))
+        np.add.at(cameras, self.det_frames, hessians[:, 1:7, 1:7])
+        np.add.at(camera_gradients, self.det_frames, gradients[:, 1:7])
+        return NormalEquations(
+            kept, kept_gradient, cameras[1:], camera_gradients[1:],
+            hessians[:, 7:, 1:7], hessians[:, 0, 1:7]
+        )
+
+    def step(self, normal, damping=0.0):
+        """
+        Solve the damped normal equations for the parameter step, with the
+        cameras eliminated by their Schur complement. Also return the
+        reduced matrix of the markers and scale, whose inverse is their
+        covariance.
+        """
+        scales = int(self.free_scale)
+        reduced = normal.kept.copy()
+        reduced[np.diag_indices_from(reduced)] *= 1 + damping
+        cameras = normal.cameras.copy()
+        cameras[:, np.arange(6), np.arange(6)] *= 1 + damping
+        inverse = np.linalg.inv(cameras) if len(cameras) else cameras
+        rhs = normal.kept_gradient.copy()
+
+        # (M, 6, M, 6) view of the marker blocks
+        blocks = reduced[scales:, scales:].reshape(self.n_markers, 6, self.n_markers, 6)
+        couplings = []
+        for camera, rows in enumerate(self.frame_rows[1:]):
+            markers, detections = self.frame_markers[camera + 1]
+            index = (scales + 6 * markers[:, None] + np.arange(6)).ravel()
+            # Coupling of each marker, summed over its detections, so the
+            # block indices below are unique
+            coupling = np.zeros((len(markers), 6, 6))
+            np.add.at(coupling, detections, normal.marker_cameras[rows])
+            coupling = coupling.reshape(-1, 6)
+            product = coupling @ inverse[camera]
+            # Scattered as 6x6 blocks, much faster than elementwise
+            blocks[markers[:, None], :, markers, :] -= (product @ coupling.T).reshape(
+                len(markers), 6, len(markers), 6
+            ).transpose(0, 2, 1, 3)
+            rhs[index] -= product @ normal.camera_gradients[camera]
+            if self.free_scale:
+                scale_coupling = normal.scale_cameras[rows].sum(axis=0)
+                scale_product = scale_coupling @ inverse[camera]
+                reduced[0, index] -= scale_product @ coupling.T
+                reduced[index, 0] = reduced[0, index]
+                reduced[0, 0] -= scale_product @ scale_coupling
+                rhs[0] -= scale_product @ normal.camera_gradients[camera]
+                index = np.concatenate(([0], index))
+                coupling = np.vstack((scale_coupling, coupling))
+            couplings.append((index, coupling))
+
+        kept_step = np.linalg.solve(reduced, rhs)
+        camera_steps = np.zeros((self.n_cameras - 1, 6))
+        for camera, (index, coupling) in enumerate(couplings):
+            camera_steps[camera] = inverse[camera] @ (
+                normal.camera_gradients[camera] - coupling.T @ kept_step[index]
+            )
+        step = np.concatenate((
+            kept_step[:scales], camera_steps.ravel(), kept_step[scales:]
+        ))
+        return -step, reduced
+
+
+def levenberg_marquardt(problem, x, f_scale=None, max_iterations=100, tolerance=1e-6):
+    """
+    Minimize the cost of a BundleProblem from x. Return the solution, its
+    cost, the number of iterations and of cost evaluations.
+    """
+    cost = problem.cost(x, f_scale)
+    damping = 1e-3
+    evaluations = 1
+    for iteration in range(1, max_iterations + 1):
+        normal = problem.normal_equations(x, f_scale)
+        while True:
+            step = problem.step(normal, damping)[0]
+            new_cost = problem.cost(x + step, f_scale)
+            evaluations += 1
+            if new_cost < cost:
+                break
+            if new_cost - cost <= tolerance * cost:
+                # At the minimum, no step lowers the cost any more
+                return x, cost, iteration, evaluations
+            damping *= 10
+            if damping > MAX_DAMPING:
+                return x, cost, iteration, evaluations
+        x = x + step
+        damping = max(damping / 10, MIN_DAMPING)
+        converged = cost - new_cost < tolerance * cost
+        cost = new_cost
+        if converged:
+            break
+    return x, cost, iteration, evaluations
+
+
+def bundle_adjust(results, cam_params, marker_length, measured=None, sigma_px=1.0,
+                  sigma_distance=0.002, f_scale=3.0, max_iterations=100):
+    """
+    Refine the marker poses of MarkerResults (with corners) jointly over
+    all frames, see BundleProblem. measured is a dataframe of measured
+    pairwise distances. Errors above f_scale standard deviations get the
+    Huber loss, or all the squared loss if f_scale is None. Return a dict
+    with dataframes of markers (pose in the frame of the first camera,
+    standard deviations of the position and rms reprojection error) and
+    cameras, the scale and its standard deviation, rms errors and solver
+    statistics.
+    """
+    start = time.perf_counter()
+    valid = np.isfinite(results.corners).all(axis=(1, 2))
+    frames, ids = results.frames[valid], results.ids[valid]
+    points = normalized_corners(results, cam_params)[valid]
+    object_points = marker_object_points(marker_length)
+    cameras, markers = initial_poses(
+        frames, ids, results.rvecs[valid], results.tvecs[valid], points, object_points,
+        INIT_THRESHOLD_PX / cam_params.pose_cam_mat[0, 0]
+    )
+    # Frames not connected to the others by shared markers are left out
+    connected = np.array([frame in cameras for frame in frames], dtype=bool)
+    frames, ids, points = frames[connected], ids[connected], points[connected]
+
+    pairs, distances = measured_pairs(measured) if measured is not None else (None, None)
+    problem = BundleProblem(
+        frames, ids, points, marker_length, cam_params.pose_cam_mat[0, 0], pairs, distances,
+        sigma_px, sigma_distance
+    )
+    # Common frame of the first camera
+    root_rot, root_t = cameras[problem.frame_ids[0]]
+    root_inverse = _invert(root_rot, root_t)
+    cam_poses = [_compose(*cameras[frame], *root_inverse) for frame in problem.frame_ids]
+    marker_poses = [_compose(root_rot, root_t, *markers[marker_id]) for marker_id in problem.marker_ids]
+    cam_tvecs = np.array([t for _, t in cam_poses])
+    marker_tvecs = np.array([t for _, t in marker_poses])
+    scale = 1.0
+    if problem.free_scale:
+        # Single marker poses scale with the marker length, so scale them
+        # all to the measured distances
+        scale = np.median(problem.distances / np.linalg.norm(
+            marker_tvecs[problem.pairs[:, 0]] - marker_tvecs[problem.pairs[:, 1]], axis=1
+        ))
+    x0 = problem.pack(
+        scale,
+        rotation_vectors(np.array([rot for rot, _ in cam_poses])), scale * cam_tvecs,
+        rotation_vectors(np.array([rot for rot, _ in marker_poses])), scale * marker_tvecs,
+    )
+    initial_cost = problem.cost(x0)
+
+    x, cost, iterations, evaluations = levenberg_marquardt(problem, x0, max_iterations=max_iterations)
+    if f_scale is not None:
+        # Far from the solution most errors would count as outliers, so
+        # the robust loss only refines
+        x, cost, more_iterations, more_evaluations = levenberg_marquardt(
+            problem, x, f_scale, max_iterations
+        )
+        iterations += more_iterations
+        evaluations += more_evaluations
+
+    scale, cam_rvecs, cam_tvecs, marker_rvecs, marker_tvecs = problem.unpack(x)
+    errors = np.linalg.norm((problem.project(x) - problem.points) * problem.focal, axis=2)
+
+    # Covariance of the scale and markers from the inverse of the reduced
+    # normal equations, scaled by the variance of the residuals
+    reduced = problem.step(problem.normal_equations(x, f_scale))[1]
+    dof = max(problem.n_residuals - problem.n_params, 1)
+    try:
+        covariance = np.linalg.inv(reduced)
+    except np.linalg.LinAlgError:
+        # Singular, some markers are not determined by the observations
+        covariance = np.linalg.pinv(reduced, hermitian=True)
+    variance = np.clip(np.diag(covariance), 0, None) * 2 * cost / dof
+    scales = int(problem.free_scale)
+    scale_std = np.sqrt(variance[0]) if problem.free_scale else 0.0
+    marker_std = np.sqrt(variance[scales:].reshape(-1, 6)[:, 3:])
+    marker_df = pd.DataFrame({
+        'id': problem.marker_ids,
+        'tx': marker_tvecs[:, 0], 'ty': marker_tvecs[:, 1], 'tz': marker_tvecs[:, 2],
+        'rx': marker_rvecs[:, 0], 'ry': marker_rvecs[:, 1], 'rz': marker_rvecs[:, 2],
+        'tx_std': marker_std[:, 0], 'ty_std': marker_std[:, 1], 'tz_std': marker_std[:, 2],
+        'observations': np.bincount(problem.det_markers, minlength=problem.n_markers),
+        'rms_px': np.sqrt(
+            np.bincount(problem.det_markers, (errors ** 2).mean(axis=1), problem.n_markers) /
+            np.bincount(problem.det_markers, minlength=problem.n_markers)
+        ),
+    })
+    camera_df = pd.DataFrame({
+        'frame': problem.frame_ids,
+        'tx': cam_tvecs[:, 0], 'ty': cam_tvecs[:, 1], 'tz': cam_tvecs[:, 2],
+        'rx': cam_rvecs[:, 0], 'ry': cam_rvecs[:, 1], 'rz': cam_rvecs[:, 2],
+        'markers': np.bincount(problem.det_frames, minlength=problem.n_cameras),
+        'rms_px': np.sqrt(
+            np.bincount(problem.det_frames, (errors ** 2).mean(axis=1), problem.n_cameras) /
+            np.bincount(problem.det_frames, minlength=problem.n_cameras)
+        ),
+    })
+    pair_errors = problem.pair_distances(x) - problem.distances
+    return {
+        'markers': marker_df,
+        'cameras': camera_df,
+        'scale': float(scale),
+        'scale_std': float(scale_std),
+        'rms_px': float(np.sqrt(np.mean(errors ** 2))),
+        'pair_rms': float(np.sqrt(np.mean(pair_errors ** 2))) if len(pair_errors) else None,
+        'dropped_frames': sorted(set(results.frames[valid][~connected])),
+        'initial_cost': float(initial_cost),
+        'cost': float(cost),
+        'iterations': iterations,
+        'evaluations': evaluations,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Refine marker positions jointly over all frames.')
+    parser.add_argument('file', type=str, nargs=1,
+                        help='detections with corners, from detect_markers --corners')
+    parser.add_argument('-c', '--camera-file', required=True,
+                        dest='camera_file', type=str, nargs=1,
+                        help='camera file the detections were made with')
+    parser.add_argument('-l', '--length', required=True,
+                        type=float, nargs=1,
+                        help='marker length')
+    parser.add_argument('-m', '--measured', required=False,
+                        type=str, nargs=1,
+                        help='a csv-file with measured pairwise distances, '
+                             'to also estimate the scale')
+    parser.add_argument('--sigma-px', required=False,
+                        dest='sigma_px', type=float, nargs=1, default=[1.0],
+                        help='corner error in pixels')
+    parser.add_argument('--sigma-distance', required=False,
+                        dest='sigma_distance', type=float, nargs=1, default=[0.002],
+                        help='error of the measured distances')
+    parser.add_argument('--huber', required=False,
+                        dest='huber', type=float, nargs=1, default=[3.0],
+                        help='errors above this many sigmas get the Huber loss, '
+                             '0 for least squares')
+    parser.add_argument('-o', '--output', required=False,
+                        type=str, nargs=1,
+                        help='output csv-file with marker poses')
+    parser.add_argument('--cameras', required=False,
+                        type=str, nargs=1,
+                        help='output csv-file with camera poses')
+    args = parser.parse_args()
+
+    results = read_results(args.file[0])
+    cam_params = read_camera_parameters(args.camera_file[0])
+    measured = pd.read_csv(args.measured[0]) if args.measured else None
+    solution = bundle_adjust(
+        results, cam_params, args.length[0], measured,
+        sigma_px=args.sigma_px[0], sigma_distance=args.sigma_distance[0],
+        f_scale=args.huber[0] or None
+    )
+
+    markers = solution['markers']
+    print('{} markers, {} frames, {} iterations in {:.2f} s'.format(
+        len(markers), len(solution['cameras']), solution['iterations'], solution['seconds']))
+    print('Reprojection rms = {:.3f} px'.format(solution['rms_px']))
+    if solution['pair_rms'] is not None:
+        print('Scale = {:.4f} +- {:.4f}, pair distance rms = {:.4f}'.format(
+            solution['scale'], solution['scale_std'], solution['pair_rms']))
+    if solution['dropped_frames']:
+        print('Frames without markers in common: {}'.format(solution['dropped_frames']))
+    if args.output:
+        markers.to_csv(args.output[0], index=False)
+    else:
+        print(markers)
+    if args.cameras:
+        solution['cameras'].to_csv(args.cameras[0], index=False)
+
+
+if __name__ == "__main__":
+    main()
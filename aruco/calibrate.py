@@ -0,0 +1,389 @@
+import argparse
+import collections
+import multiprocessing
+import os
+import time
+import cv2
+import numpy as np
+from aruco.map_cache import file_hash
+
+
+PATTERNS = ('CHESSBOARD', 'CIRCLES_GRID', 'ASYMMETRIC_CIRCLES_GRID')
+
+CalibrationSettings = collections.namedtuple('CalibrationSettings', [
+    'board_size', 'square_size', 'pattern', 'image_list', 'frames',
+    'fix_aspect_ratio', 'zero_tangent_dist', 'fix_principal_point',
+    'use_fisheye', 'fix_k', 'output', 'write_points', 'write_extrinsics',
+])
+
+# Corner refinement of the OpenCV calibration sample
+SUBPIX_WINDOW = (11, 11)
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.0001)
+
+# Corner cache of the current worker process
+_cache = None
+
+
+def default_corner_cache_dir():
+    """ Directory used when no cache directory is given"""
+    return os.environ.get(
+        'ARUCO_CORNER_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'aruco', 'corners')
+    )
+
+
+def read_settings(filename):
+    """
+    Read a *_config_*.xml file of the OpenCV calibration sample. Paths
+    are relative to the directory of the file.
+    """
+    storage = cv2.FileStorage(filename, cv2.FILE_STORAGE_READ)
+    if not storage.isOpened():
+        raise IOError('Could not read calibration config {}'.format(filename))
+    node = storage.getNode('Settings')
+    directory = os.path.dirname(filename)
+
+    def flag(name):
+        return bool(int(node.getNode(name).real()))
+
+    settings = CalibrationSettings(
+        board_size=(int(node.getNode('BoardSize_Width').real()),
+                    int(node.getNode('BoardSize_Height').real())),
+        square_size=node.getNode('Square_Size').real(),
+        pattern=node.getNode('Calibrate_Pattern').string(),
+        image_list=os.path.normpath(os.path.join(directory, node.getNode('Input').string())),
+        frames=int(node.getNode('Calibrate_NrOfFrameToUse').real()),
+        fix_aspect_ratio=node.getNode('Calibrate_FixAspectRatio').real(),
+        zero_tangent_dist=flag('Calibrate_AssumeZeroTangentialDistortion'),
+        fix_principal_point=flag('Calibrate_FixPrincipalPointAtTheCenter'),
+        use_fisheye=flag('Calibrate_UseFisheyeModel'),
+        fix_k=tuple(flag('Fix_K{}'.format(i)) for i in range(1, 6)),
+        output=os.path.normpath(os.path.join(directory, node.getNode('Write_outputFileName').string())),
+        write_points=flag('Write_DetectedFeaturePoints'),
+        write_extrinsics=flag('Write_extrinsicParameters'),
+    )
+    storage.release()
+    assert settings.pattern in PATTERNS, settings.pattern
+    return settings
+
+
+def read_image_list(filename):
+    """ Read an *_imagelist_*.xml file, with paths relative to its directory"""
+    storage = cv2.FileStorage(filename, cv2.FILE_STORAGE_READ)
+    if not storage.isOpened():
+        raise IOError('Could not read image list {}'.format(filename))
+    node = storage.getNode('images')
+    directory = os.path.dirname(filename)
+    images = [
+        os.path.normpath(os.path.join(directory, node.at(i).string()))
+        for i in range(node.size())
+    ]
+    storage.release()
+    return images
+
+
+def write_image_list(filename, images):
+    """ Write an image list in the format of read_image_list"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    storage = cv2.FileStorage(filename, cv2.FILE_STORAGE_WRITE)
+    storage.startWriteStruct('images', cv2.FileNode_SEQ)
+    for image in images:
+        storage.write('', './' + os.path.relpath(os.path.abspath(image), directory))
+    storage.endWriteStruct()
+    storage.release()
+
+
+def board_points(settings):
+    """ (N, 3) object points of the pattern, in the order corners are found"""
+    width, height = settings.board_size
+    size = settings.square_size
+    if settings.pattern == 'ASYMMETRIC_CIRCLES_GRID':
+        points = [((2 * j + i % 2) * size, i * size, 0)
+                  for i in range(height) for j in range(width)]
+    else:
+        points = [(j * size, i * size, 0) for i in range(height) for j in range(width)]
+    return np.array(points, dtype=np.float64)
+
+
+def find_corners(filename, board_size, pattern='CHESSBOARD', use_fisheye=False):
+    """
+    Find the pattern in an image. Return the image size as (width,
+    height) and the (N, 2) corners, or None when not found.
+    """
+    img = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise IOError('Could not read image {}'.format(filename))
+    size = (img.shape[1], img.shape[0])
+    if pattern == 'CHESSBOARD':
+        flags = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE
+        # Like the OpenCV sample, the fast check misses strongly distorted boards
+        if not use_fisheye:
+            flags |= cv2.CALIB_CB_FAST_CHECK
+        found, corners = cv2.findChessboardCorners(img, board_size, flags=flags)
+        if found:
+            corners = cv2.cornerSubPix(img, corners, SUBPIX_WINDOW, (-1, -1), SUBPIX_CRITERIA)
+    elif pattern == 'CIRCLES_GRID':
+        found, corners = cv2.findCirclesGrid(img, board_size)
+    else:
+        found, corners = cv2.findCirclesGrid(img, board_size, flags=cv2.CALIB_CB_ASYMMETRIC_GRID)
+    if not found:
+        return size, None
+    return size, corners.reshape(-1, 2).astype(np.float32)
+
+
+class CornerCache:
+    """
+    On-disk cache of detected patterns. Every entry is a .npy file named
+    after a hash of the image content and the pattern, holding the image
+    size followed by the corners, or only the size when the pattern was
+    not found.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_corner_cache_dir()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, filename, board_size, pattern, use_fisheye):
+        return '{}-{}x{}-{}{}'.format(
+            file_hash(filename), board_size[0], board_size[1], pattern.lower(),
+            '-fisheye' if use_fisheye else ''
+        )
+
+    def get(self, key):
+        """ Return (size, corners or None) for key, or None on a miss"""
+        try:
+            packed = np.load(os.path.join(self.directory, key + '.npy'))
+        except (OSError, ValueError):
+            return None
+        size = (int(packed[0]), int(packed[1]))
+        if len(packed) == 2:
+            return size, None
+        return size, packed[2:].reshape(-1, 2).astype(np.float32)
+
+    def put(self, key, size, corners):
+        packed = np.concatenate((
+            size, [] if corners is None else np.ravel(corners)
+        )).astype(np.float64)
+        # Write under a temporary name, so readers never see a partial entry
+        tmp = os.path.join(self.directory, '.{}.{}.npy'.format(key, os.getpid()))
+        np.save(tmp, packed)
+        os.replace(tmp, os.path.join(self.directory, key + '.npy'))
+
+
+def _init_worker(cache_dir):
+    global _cache
+    _cache = CornerCache(cache_dir) if cache_dir is not None else None
+
+
+def _find_corners_task(task):
+    filename, board_size, pattern, use_fisheye = task
+    if _cache is None:
+        return filename, find_corners(filename, board_size, pattern, use_fisheye), False
+    key = _cache.key(filename, board_size, pattern, use_fisheye)
+    cached = _cache.get(key)
+    if cached is not None:
+        return filename, cached, True
+    size, corners = find_corners(filename, board_size, pattern, use_fisheye)
+    _cache.put(key, size, corners)
+    return filename, (size, corners), False
+
+
+def detect_corners(images, settings, cache_dir=None, workers=None, progress=None):
+    """
+    Find the pattern in all images, in parallel processes. Images found
+    in the corner cache are not read again. Return a list of (filename,
+    size, corners or None) in image order. progress is called with
+    (filename, found, cached) as images complete.
+    """
+    tasks = [
+        (filename, settings.board_size, settings.pattern, settings.use_fisheye)
+        for filename in images
+    ]
+    results = {}
+    with multiprocessing.Pool(workers, _init_worker, (cache_dir,)) as pool:
+        for filename, (size, corners), cached in pool.imap_unordered(_find_corners_task, tasks):
+            results[filename] = (size, corners)
+            if progress is not None:
+                progress(filename, corners is not None, cached)
+    return [(filename, *results[filename]) for filename in images]
+
+
+def calibration_flags(settings):
+    """ cv2.calibrateCamera or cv2.fisheye.calibrate flags of the settings"""
+    if settings.use_fisheye:
+        flags = cv2.fisheye.CALIB_FIX_SKEW | cv2.fisheye.CALIB_RECOMPUTE_EXTRINSIC
+        for fix, fix_flag in zip(settings.fix_k, (
+                cv2.fisheye.CALIB_FIX_K1, cv2.fisheye.CALIB_FIX_K2,
+                cv2.fisheye.CALIB_FIX_K3, cv2.fisheye.CALIB_FIX_K4)):
+            if fix:
+                flags |= fix_flag
+        if settings.fix_principal_point:
+            flags |= cv2.fisheye.CALIB_FIX_PRINCIPAL_POINT
+        return flags
+
+    flags = 0
+    if settings.fix_principal_point:
+        flags |= cv2.CALIB_FIX_PRINCIPAL_POINT
+    if settings.zero_tangent_dist:
+        flags |= cv2.CALIB_ZERO_TANGENT_DIST
+    if settings.fix_aspect_ratio:
+        flags |= cv2.CALIB_FIX_ASPECT_RATIO
+    for fix, fix_flag in zip(settings.fix_k, (
+            cv2.CALIB_FIX_K1, cv2.CALIB_FIX_K2, cv2.CALIB_FIX_K3,
+            cv2.CALIB_FIX_K4, cv2.CALIB_FIX_K5)):
+        if fix:
+            flags |= fix_flag
+    return flags
+
+
+def calibrate(settings, image_size, image_points):
+    """
+    Calibrate from a list of (N, 2) corners per view. Return a dict with
+    cam_mat, dist_coeffs, rvecs, tvecs, flags, the per view and the
+    average reprojection errors.
+    """
+    flags = calibration_flags(settings)
+    object_points = board_points(settings)
+    cam_mat = np.eye(3)
+    if settings.fix_aspect_ratio and not settings.use_fisheye:
+        cam_mat[0, 0] = settings.fix_aspect_ratio
+
+    if settings.use_fisheye:
+        _, cam_mat, dist_coeffs, rvecs, tvecs = cv2.fisheye.calibrate(
+            [object_points.reshape(-1, 1, 3)] * len(image_points),
+            [points.reshape(-1, 1, 2).astype(np.float64) for points in image_points],
+            image_size, cam_mat, np.zeros((4, 1)), flags=flags
+        )
+    else:
+        _, cam_mat, dist_coeffs, rvecs, tvecs = cv2.calibrateCamera(
+            [object_points.astype(np.float32)] * len(image_points),
+            [points.reshape(-1, 1, 2) for points in image_points],
+            image_size, cam_mat, np.zeros((8, 1)), flags=flags
+        )
+
+    # Reprojection errors as computed by the OpenCV sample
+    squared = []
+    for points, rvec, tvec in zip(image_points, rvecs, tvecs):
+        if settings.use_fisheye:
+            projected, _ = cv2.fisheye.projectPoints(
+                object_points.reshape(-1, 1, 3), rvec, tvec, cam_mat, dist_coeffs
+            )
+        else:
+            projected, _ = cv2.projectPoints(object_points, rvec, tvec, cam_mat, dist_coeffs)
+        squared.append(np.sum((projected.reshape(-1, 2) - points) ** 2))
+    squared = np.array(squared)
+    return {
+        'cam_mat': cam_mat,
+        'dist_coeffs': dist_coeffs,
+        'rvecs': np.reshape(rvecs, (-1, 3)),
+        'tvecs': np.reshape(tvecs, (-1, 3)),
+        'flags': flags,
+        'per_view_errors': np.sqrt(squared / len(object_points)),
+        'avg_error': float(np.sqrt(squared.sum() / (len(object_points) * len(image_points)))),
+    }
+
+
+def write_calibration(filename, settings, image_size, image_points, result):
+    """ Write a calibration file in the format of the OpenCV sample"""
+    storage = cv2.FileStorage(filename, cv2.FILE_STORAGE_WRITE)
+    storage.write('calibration_time', time.strftime('%c'))
+    storage.write('nr_of_frames', len(image_points))
+    storage.write('image_width', image_size[0])
+    storage.write('image_height', image_size[1])
+    storage.write('board_width', settings.board_size[0])
+    storage.write('board_height', settings.board_size[1])
+    storage.write('square_size', float(settings.square_size))
+    if settings.fix_aspect_ratio:
+        storage.write('fix_aspect_ratio', float(settings.fix_aspect_ratio))
+    storage.write('flags', int(result['flags']))
+    storage.write('fisheye_model', int(settings.use_fisheye))
+    storage.write('camera_matrix', result['cam_mat'])
+    storage.write('distortion_coefficients', result['dist_coeffs'])
+    storage.write('avg_reprojection_error', result['avg_error'])
+    storage.write(
+        'per_view_reprojection_errors',
+        result['per_view_errors'].astype(np.float32).reshape(-1, 1)
+    )
+    if settings.write_extrinsics:
+        storage.writeComment(
+            'a set of 6-tuples (rotation vector + translation vector) for each view'
+        )
+        storage.write('extrinsic_parameters', np.hstack((result['rvecs'], result['tvecs'])))
+    if settings.write_points:
+        storage.write('image_points', np.array(image_points, dtype=np.float32))
+    storage.release()
+
+
+def run_calibration(settings, images, cache_dir=None, workers=None, progress=None):
+    """
+    Find the pattern in images and calibrate with the first
+    settings.frames views it was found in. Return the image size, the
+    filenames and corners of the views used, and the calibrate result.
+    """
+    detections = detect_corners(images, settings, cache_dir, workers, progress)
+    sizes = {size for _, size, _ in detections}
+    if len(sizes) != 1:
+        raise ValueError('Images of different sizes: {}'.format(sorted(sizes)))
+    image_size = sizes.pop()
+    views = [(filename, corners) for filename, _, corners in detections if corners is not None]
+    views = views[:settings.frames]
+    if not views:
+        raise ValueError('Pattern not found in any image')
+    filenames, image_points = zip(*views)
+    result = calibrate(settings, image_size, list(image_points))
+    return image_size, list(filenames), list(image_points), result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Calibrate a camera from a calibration config file.')
+    parser.add_argument('config', type=str, nargs=1,
+                        help='config file, e.g. calibration/fisheye_config_mp8.xml')
+    parser.add_argument('-a', '--add', required=False,
+                        dest='add', type=str, nargs='+', default=[],
+                        help='add images to the image list of the config')
+    parser.add_argument('-o', '--output', required=False,
+                        dest='output', type=str, nargs=1,
+                        help='calibration file (default: the output of the config)')
+    parser.add_argument('-j', '--workers', required=False,
+                        dest='workers', type=int, nargs=1,
+                        help='processes finding corners (default: all cores)')
+    parser.add_argument('--corner-cache', required=False,
+                        dest='corner_cache', type=str, nargs=1,
+                        default=[default_corner_cache_dir()],
+                        help='detected corner cache directory')
+    parser.add_argument('--no-corner-cache', required=False,
+                        dest='no_corner_cache',
+                        action='store_true', default=False,
+                        help='always find corners again')
+    args = parser.parse_args()
+
+    settings = read_settings(args.config[0])
+    images = read_image_list(settings.image_list)
+    added = [os.path.normpath(image) for image in args.add if os.path.normpath(image) not in images]
+    images.extend(added)
+
+    def progress(filename, found, cached):
+        print('{} {}{}'.format(
+            filename, 'found' if found else 'NOT FOUND', ' (cached)' if cached else ''
+        ), flush=True)
+
+    image_size, filenames, image_points, result = run_calibration(
+        settings, images,
+        cache_dir=None if args.no_corner_cache else args.corner_cache[0],
+        workers=args.workers[0] if args.workers else None, progress=progress
+    )
+    # Only a successful calibration changes the image list
+    if added:
+        write_image_list(settings.image_list, images)
+        print('Added {} images to {}'.format(len(added), settings.image_list))
+    output = args.output[0] if args.output else settings.output
+    write_calibration(output, settings, image_size, image_points, result)
+    print('Calibrated {}x{} from {} of {} images, average reprojection error {:.4f} px'.format(
+        *image_size, len(filenames), len(images), result['avg_error']
+    ))
+    print('Wrote', output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,134 @@
 import cv2
 import numpy as np
+from .map_cache import array_hash, file_hash, fisheye_undistort_maps
+
+
+def scale_camera_matrix(cam_mat, scale):
+    """ Camera matrix for images resized by scale"""
+    cam_mat = cam_mat.copy()
+    cam_mat[:2, :2] *= scale
+    # Pixel centers are at integer coordinates
+    cam_mat[:2, 2] = (cam_mat[:2, 2] + 0.5) * scale - 0.5
+    return cam_mat
 
 
 class CameraParameters:
-    def __init__(self, cam_mat, dist_coeffs, width, height, use_fisheye):
+    def __init__(self, cam_mat, dist_coeffs, width, height, use_fisheye,
+                 map_cache=None, calibration_hash=None):
         assert isinstance(cam_mat, np.ndarray) and cam_mat.shape == (3, 3)
-        assert isinstance(cam_mat, np.ndarray) and dist_coeffs.shape == (4, 1)
+        assert isinstance(dist_coeffs, np.ndarray) and dist_coeffs.shape[1:] == (1,)
         assert isinstance(width, int) and isinstance(height, int)
         assert isinstance(use_fisheye, bool)
+        assert not use_fisheye or dist_coeffs.shape == (4, 1)
 
         self.cam_mat = cam_mat.copy()
         self.dist_coeffs = dist_coeffs.copy()
         self.size = height, width
         self.use_fisheye = use_fisheye
+        # Identifies the calibration, defaults to a hash of the matrices
+        self.calibration_hash = calibration_hash or array_hash(cam_mat, dist_coeffs)
 
         if use_fisheye:
-            new_cam_mat = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(
-                cam_mat, dist_coeffs, self.size, np.eye(3), balance=1.0
-            )
-            self.map1, self.map2 = cv2.fisheye.initUndistortRectifyMap(
-                cam_mat, dist_coeffs, np.eye(3),
-                new_cam_mat, self.size, cv2.CV_16SC2
-            )
+            if map_cache is not None:
+                new_cam_mat, self.map1, self.map2 = map_cache.fisheye_maps(
+                    self.calibration_hash, cam_mat, dist_coeffs, self.size
+                )
+            else:
+                new_cam_mat, self.map1, self.map2 = fisheye_undistort_maps(
+                    cam_mat, dist_coeffs, self.size
+                )
             self.new_cam_mat = new_cam_mat
             self.new_dist_coeffs = np.zeros((4, 1))
 
+    def scaled(self, scale, map_cache=None):
+        """
+        Parameters of the same camera for images resized by scale, e.g.
+        0.5 for images decoded with cv2.IMREAD_REDUCED_GRAYSCALE_2.
+        Distortion is in normalized coordinates and does not change.
+        """
+        height, width = self.size
+        return CameraParameters(
+            scale_camera_matrix(self.cam_mat, scale), self.dist_coeffs,
+            int(round(width * scale)), int(round(height * scale)),
+            self.use_fisheye, map_cache=map_cache,
+            calibration_hash='{}-x{}'.format(self.calibration_hash, scale)
+        )
+
+    @property
+    def pose_cam_mat(self):
+        """ Camera matrix to use with undistorted corners"""
+        return self.new_cam_mat if self.use_fisheye else self.cam_mat
+
+    @property
+    def pose_dist_coeffs(self):
+        """ Distortion coefficients to use with undistorted corners"""
+        return self.new_dist_coeffs if self.use_fisheye else self.dist_coeffs
+
+    def undistort_points(self, points):
+        """
+        Map pixel coordinates in the distorted image to the undistorted
+        image, i.e. the same coordinates a detection after remap gives.
+        Normal cameras keep their distortion in pose_dist_coeffs, so their
+        points are returned unchanged.
+        """
+        if not self.use_fisheye:
+            return points
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        return cv2.fisheye.undistortPoints(
+            points, self.cam_mat, self.dist_coeffs,
+            R=np.eye(3), P=self.new_cam_mat
+        )
+
+    def points_to_rays(self, points):
+        """
+        Map undistorted image coordinates (as given by undistort_points)
+        to normalized coordinates on the z = 1 plane.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if self.use_fisheye:
+            return cv2.undistortPoints(points, self.new_cam_mat, None)
+        return cv2.undistortPoints(points, self.cam_mat, self.dist_coeffs)
 
-def read_camera_parameters(filename):
-    # Open file
+    def rays_to_points(self, rays, distorted=False):
+        """
+        Map normalized coordinates to undistorted image coordinates, or
+        to coordinates in the distorted image if distorted is set.
+        """
+        rays = np.asarray(rays, dtype=np.float64).reshape(-1, 1, 2)
+        if self.use_fisheye and distorted:
+            return cv2.fisheye.distortPoints(rays, self.cam_mat, self.dist_coeffs)
+        rays = np.concatenate((rays, np.ones((len(rays), 1, 1))), axis=2)
+        points, _ = cv2.projectPoints(
+            rays, np.zeros(3), np.zeros(3),
+            self.pose_cam_mat, self.pose_dist_coeffs
+        )
+        return points
+
+
+def read_calibration(filename):
+    """
+    Parse a calibration file written by the OpenCV calibration sample.
+    Return cam_mat, dist_coeffs, width, height and whether it is a
+    fisheye model.
+    """
     cam_file = cv2.FileStorage(filename, cv2.FILE_STORAGE_READ)
-    # Read parameters
+    if not cam_file.isOpened():
+        raise IOError('Could not read calibration file {}'.format(filename))
     cam_mat = cam_file.getNode('camera_matrix').mat()
     dist_coeffs = cam_file.getNode('distortion_coefficients').mat()
     height = int(cam_file.getNode('image_height').real())
     width = int(cam_file.getNode('image_width').real())
-    use_fisheye = bool(cam_file.getNode('fisheye_model'))
-    # Release file
+    # The node itself is always truthy, its value is 0 or 1
+    fisheye_node = cam_file.getNode('fisheye_model')
+    use_fisheye = not fisheye_node.empty() and bool(int(fisheye_node.real()))
     cam_file.release()
-    # Create and return CameraParameters object
-    return CameraParameters(cam_mat, dist_coeffs, width, height, use_fisheye)
+    return cam_mat, dist_coeffs, width, height, use_fisheye
 
+
+def read_camera_parameters(filename, map_cache=None):
+    cam_mat, dist_coeffs, width, height, use_fisheye = read_calibration(filename)
+    # Create and return CameraParameters object
+    return CameraParameters(
+        cam_mat, dist_coeffs, width, height, use_fisheye,
+        map_cache=map_cache, calibration_hash=file_hash(filename)
+    )
@@ -1,87 +1,407 @@
 import argparse
+import sys
+import threading
+from contextlib import closing
 import yaml
 import cv2
 import numpy as np
 import pandas as pd
+from aruco.results import MarkerResults, ResultsWriter, is_csv
 from aruco.read import read_detector_params
-from aruco.read import read_camera_file
+from aruco.map_cache import UndistortMapCache, default_cache_dir
+from aruco.camera_parameters import CameraParameters, read_camera_parameters
+from aruco.camera_parameters import read_calibration, scale_camera_matrix
+from aruco.pipeline import Pipeline, PipelineStage
+from aruco.profiling import StageTimer, NULL_TIMER
+from aruco.pyramid import PyramidDetector, coarse_level
+from aruco.registry import CalibrationRegistry
+from aruco.result_cache import ResultCache, default_result_cache_dir
+from aruco.result_cache import DEFAULT_MAX_BYTES as DEFAULT_RESULT_CACHE_MAX_BYTES
+from aruco.session import Session
+from aruco.detector import Detector, UNDISTORT_MODES, INTERPOLATIONS
+from aruco.detector import UNDISTORT_REMAP, UNDISTORT_CORNERS
+
+
+# imread flags by reduction factor, for color and grayscale
+REDUCED_FLAGS = {
+    1: (cv2.IMREAD_COLOR, cv2.IMREAD_GRAYSCALE),
+    2: (cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    4: (cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    8: (cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+}
 
 
 # Camera matrix, distcoeffs, dictionary, detectorparams marker length isFisheye imagelist
 def estimate_markers(
         images,  img_size, cam_mat, dist_coeffs, dictionary,
-        detect_params, marker_length=1.0, use_fisheye=False
+        detect_params, marker_length=1.0, use_fisheye=False, map_cache=None,
+        undistort_mode=UNDISTORT_REMAP, draw=True, keep_images=True,
+        coarse_cam_params=None, timer=None, interpolation=cv2.INTER_CUBIC,
+        result_cache=None
 ):
-    new_images = []
-    marker_data = pd.DataFrame(
-        columns=['id', 'tx', 'ty', 'tz', 'rx', 'ry', 'rz']
+    return collect_markers(
+        iter_markers(
+            images, img_size, cam_mat, dist_coeffs, dictionary, detect_params,
+            marker_length, use_fisheye, map_cache, undistort_mode, draw,
+            coarse_cam_params, timer, interpolation, result_cache
+        ),
+        keep_images, timer
     )
 
-    # Compute matrix after undistorting fisheye
-    if use_fisheye:
-        new_cam_mat = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(
-            cam_mat, dist_coeffs, img_size, np.eye(3), balance=1.0
-        )
-        map1, map2 = cv2.fisheye.initUndistortRectifyMap(
-            cam_mat, dist_coeffs, np.eye(3),
-            new_cam_mat, img_size, cv2.CV_16SC2
-        )
-        cam_mat = new_cam_mat
-        dist_coeffs = np.zeros((4, 1))
 
-    for img in images:
+def collect_markers(markers, keep_images=True, timer=None):
+    """
+    Gather the output of iter_markers or iter_registry_markers into
+    MarkerResults and a list of images
+    """
+    timer = timer or NULL_TIMER
+    new_images = []
+    marker_data = MarkerResults()
+
+    for frame, corners, ids, rvecs, tvecs, img in markers:
+        with timer.stage('append'):
+            marker_data.append(frame, ids, rvecs, tvecs, corners)
+        if keep_images:
+            new_images.append(img)
+
+    return marker_data, new_images
+
+
+def iter_markers(
+        images, img_size, cam_mat, dist_coeffs, dictionary,
+        detect_params, marker_length=1.0, use_fisheye=False, map_cache=None,
+        undistort_mode=UNDISTORT_REMAP, draw=True, coarse_cam_params=None,
+        timer=None, interpolation=cv2.INTER_CUBIC, result_cache=None
+):
+    """
+    Generator version of estimate_markers. Images are consumed one at a
+    time and (frame, corners, ids, rvecs, tvecs, img) is yielded for each,
+    so only the current frame is held in memory. A frame is ended on the
+    timer once the consumer asks for the next one, or closes the generator.
+    """
+    timer = timer or NULL_TIMER
+    detector = make_detector(
+        img_size, cam_mat, dist_coeffs, dictionary, detect_params,
+        marker_length, use_fisheye, map_cache, undistort_mode,
+        coarse_cam_params, timer, interpolation
+    )
+
+    for frame, img in enumerate(images):
         assert img.shape[0:2] == img_size
-        # Undistort img
-        if use_fisheye:
-            img = cv2.remap(
-                img, map1, map2, cv2.INTER_CUBIC,
-                cv2.BORDER_CONSTANT
-            )
-        else:
-            pass
+        # Find markers, undistorting the image or only the corners
+        corners, ids, rvecs, tvecs, img = detect_frame(detector, img, draw, result_cache)
+        try:
+            yield frame, corners, ids, rvecs, tvecs, img
+        finally:
+            # Also when the consumer stops early and closes the generator
+            timer.end_frame(frame, 0 if ids is None else ids.size)
 
-        corners, ids, _ = cv2.aruco.detectMarkers(
-            img, dictionary,
-            parameters=detect_params,
-            cameraMatrix=cam_mat,
-            distCoeff=dist_coeffs
-        )
 
-        if ids.size:
-            rvecs, tvecs, _ = cv2.aruco.estimatePoseSingleMarkers(
-                corners, marker_length, cam_mat, dist_coeffs
-            )
+def iter_registry_markers(
+        images, registry, dictionary, detect_params, marker_length=1.0,
+        fisheye=None, undistort_mode=UNDISTORT_REMAP, draw=True,
+        coarse_cam_params=None, timer=None, interpolation=cv2.INTER_CUBIC,
+        reduce=1, result_cache=None
+):
+    """
+    Like iter_markers, but every image is processed with the calibration
+    of its size from a CalibrationRegistry, so sizes may be mixed. A
+    detector is created once per calibration. Images decoded at a reduced
+    size are matched with reduce set to the reduction factor.
+    """
+    timer = timer or NULL_TIMER
+    detector_for_image = registry_detectors(
+        registry, dictionary, detect_params, marker_length, fisheye, undistort_mode,
+        coarse_cam_params, timer, interpolation, reduce
+    )
+    for frame, img in enumerate(images):
+        detector = detector_for_image(img)
+        corners, ids, rvecs, tvecs, img = detect_frame(detector, img, draw, result_cache)
+        try:
+            yield frame, corners, ids, rvecs, tvecs, img
+        finally:
+            # Also when the consumer stops early and closes the generator
+            timer.end_frame(frame, 0 if ids is None else ids.size)
+
+
+def detect_frame(detector, img, draw=True, result_cache=None):
+    """
+    Find the markers of one image and estimate their poses. Return
+    corners, ids, rvecs, tvecs and the image markers were found in.
+    Images found in result_cache are not detected again. With draw, they
+    are undistorted and the cached markers drawn as for a detected image,
+    otherwise the image is returned as given.
+    """
+    key = None
+    if result_cache is not None:
+        with detector.timer.stage('cache'):
+            key = result_cache.key(detector, img)
+            cached = result_cache.get(key)
+        if cached is not None:
+            corners, ids, rvecs, tvecs = cached
+            if draw and detector.can_draw():
+                with detector.timer.stage('remap'):
+                    img = detector.undistort_image(img)
+                if ids is not None:
+                    detector.draw(img, corners, ids, rvecs, tvecs)
+            return corners, ids, rvecs, tvecs, img
+
+    corners, ids, img = detector.detect(img)
+    rvecs = tvecs = None
 
-            cv2.aruco.drawDetectedMarkers(img, corners, ids)
+    if ids is not None and ids.size:
+        rvecs, tvecs = detector.estimate_poses(corners)
 
-            for i, _ in enumerate(ids):
-                cv2.aruco.drawAxis(
-                    img, cam_mat, dist_coeffs,
-                    rvecs[i], tvecs[i], marker_length*0.5
+        if draw and detector.can_draw():
+            detector.draw(img, corners, ids, rvecs, tvecs)
+
+    if key is not None:
+        result_cache.put(key, corners, ids, rvecs, tvecs)
+    return corners, ids, rvecs, tvecs, img
+
+
+def registry_detectors(
+        registry, dictionary, detect_params, marker_length=1.0, fisheye=None,
+        undistort_mode=UNDISTORT_REMAP, coarse_cam_params=None, timer=None,
+        interpolation=cv2.INTER_CUBIC, reduce=1
+):
+    """
+    Return a thread safe function giving the detector for an image, with
+    the calibration of its size. A detector is created once per calibration.
+    """
+    detectors = {}
+    lock = threading.Lock()
+
+    def detector_for_image(img):
+        cam_params = registry.for_image(img, fisheye, reduce)
+        with lock:
+            detector = detectors.get(cam_params.calibration_hash)
+            if detector is None:
+                detector = detectors[cam_params.calibration_hash] = detector_for(
+                    cam_params, dictionary, detect_params, marker_length, undistort_mode,
+                    coarse_cam_params, timer, interpolation
                 )
-                row = marker_data.shape[0]
-                marker_data.loc[row] = {
-                    'id': ids[i, 0],
-                    'tx': tvecs[i, 0, 0],
-                    'ty': tvecs[i, 0, 1],
-                    'tz': tvecs[i, 0, 2],
-                    'rx': rvecs[i, 0, 0],
-                    'ry': rvecs[i, 0, 1],
-                    'rz': rvecs[i, 0, 2],
-                }
-
-        new_images.append(img)
+        return detector
+
+    return detector_for_image
+
+
+class _PipelineFrame:
+    """ State of one frame passed between the stages of marker_pipeline"""
+    __slots__ = ('frame', 'filename', 'img', 'detector', 'undistorted', 'key',
+                 'cached', 'corners', 'ids', 'rvecs', 'tvecs')
+
+    def __init__(self, frame, filename):
+        self.frame = frame
+        self.filename = filename
+        self.undistorted = False
+        self.key = self.cached = None
+        self.rvecs = self.tvecs = None
+
+
+def marker_pipeline(detector_for_image, flags=cv2.IMREAD_COLOR, draw=True,
+                    workers=2, queue_size=2, result_cache=None):
+    """
+    Create a Pipeline with imread, remap, detect and pose stages, taking
+    (frame, filename) items and giving the (frame, corners, ids, rvecs,
+    tvecs, img) of iter_markers. detector_for_image returns the detector
+    of a decoded image. Decoding, remapping and detection run in workers
+    threads each, since OpenCV releases the GIL. Frames found in
+    result_cache are not detected again, and only remapped and drawn
+    with draw.
+    """
+    def imread(item):
+        frame, filename = item
+        work = _PipelineFrame(frame, filename)
+        work.img = cv2.imread(filename, flags)
+        if work.img is None:
+            raise IOError('Could not read image {}'.format(filename))
+        work.detector = detector_for_image(work.img)
+        assert work.img.shape[0:2] == work.detector.cam_params.size
+        if result_cache is not None:
+            work.key = result_cache.key(work.detector, work.img)
+            work.cached = result_cache.get(work.key)
+        return work
+
+    def remap(work):
+        # Only for detectors searching the whole undistorted frame
+        if (work.cached is None or draw) and work.detector.can_draw():
+            work.img = work.detector.undistort_image(work.img)
+            work.undistorted = True
+        return work
+
+    def detect(work):
+        if work.cached is None:
+            work.corners, work.ids, work.img = work.detector.detect(work.img, work.undistorted)
+            # Asked in this thread, a pyramid detector knows if it fell back
+            # to the full, undistorted frame
+            work.undistorted = work.detector.can_draw(work.undistorted)
+        return work
+
+    def pose(work):
+        detector = work.detector
+        if work.cached is not None:
+            corners, ids, rvecs, tvecs = work.cached
+            if draw and ids is not None and detector.can_draw(work.undistorted):
+                detector.draw(work.img, corners, ids, rvecs, tvecs)
+            return work.frame, corners, ids, rvecs, tvecs, work.img
+        if work.ids is not None and work.ids.size:
+            work.rvecs, work.tvecs = detector.estimate_poses(work.corners)
+            if draw and detector.can_draw(work.undistorted):
+                detector.draw(work.img, work.corners, work.ids, work.rvecs, work.tvecs)
+        if work.key is not None:
+            result_cache.put(work.key, work.corners, work.ids, work.rvecs, work.tvecs)
+        return work.frame, work.corners, work.ids, work.rvecs, work.tvecs, work.img
+
+    return Pipeline([
+        PipelineStage('imread', imread, workers, queue_size),
+        PipelineStage('remap', remap, workers, queue_size),
+        PipelineStage('detect', detect, workers, queue_size),
+        PipelineStage('pose', pose, 1, queue_size),
+    ])
+
+
+def image_flags(gray=False, reduce=1):
+    """
+    cv2.imread flags to decode straight to grayscale and/or at a reduced
+    size, which for jpeg skips most of the decoding work
+    """
+    return REDUCED_FLAGS[reduce][gray]
+
+
+def read_images(filenames, flags=cv2.IMREAD_COLOR, timer=None):
+    """ Lazily decode image files one at a time"""
+    timer = timer or NULL_TIMER
+    for filename in filenames:
+        with timer.stage('imread'):
+            img = cv2.imread(filename, flags)
+        if img is None:
+            raise IOError('Could not read image {}'.format(filename))
+        yield img
+
+
+def make_detector(
+        img_size, cam_mat, dist_coeffs, dictionary, detect_params,
+        marker_length=1.0, use_fisheye=False, map_cache=None,
+        undistort_mode=UNDISTORT_REMAP, coarse_cam_params=None, timer=None,
+        interpolation=cv2.INTER_CUBIC
+):
+    """
+    Create a Detector from the arguments of estimate_markers. Given the
+    parameters of lower resolution cameras, a PyramidDetector is created.
+    """
+    height, width = img_size
+    cam_params = CameraParameters(
+        cam_mat, dist_coeffs, int(width), int(height), bool(use_fisheye),
+        map_cache=map_cache
+    )
+    return detector_for(
+        cam_params, dictionary, detect_params, marker_length, undistort_mode,
+        coarse_cam_params, timer, interpolation
+    )
+
+
+def detector_for(
+        cam_params, dictionary, detect_params, marker_length=1.0,
+        undistort_mode=UNDISTORT_REMAP, coarse_cam_params=None, timer=None,
+        interpolation=cv2.INTER_CUBIC
+):
+    """
+    Create a Detector for CameraParameters. Unless coarse_cam_params is
+    None, create a PyramidDetector with the coarse level coarse_level
+    picks from coarse_cam_params (CameraParameters or a list of them,
+    possibly empty).
+    """
+    if coarse_cam_params is not None:
+        coarse = coarse_level(cam_params, coarse_cam_params)
+        # Small frames are searched directly
+        if coarse is not None:
+            return PyramidDetector(
+                cam_params, detect_params, dictionary, float(marker_length),
+                coarse, undistort_mode=undistort_mode, timer=timer,
+                interpolation=interpolation
+            )
+    return Detector(
+        cam_params, detect_params, dictionary, float(marker_length),
+        undistort_mode=undistort_mode, timer=timer, interpolation=interpolation
+    )
+
+
+def compare_undistort_modes(
+        images, img_size, cam_mat, dist_coeffs, dictionary,
+        detect_params, marker_length=1.0, use_fisheye=False, map_cache=None
+):
+    """
+    Estimate poses both with a full frame remap and with undistorted
+    corners only. Return a dataframe with, for every marker found in both
+    modes, the translation difference, the rotation difference in degrees
+    and the mean corner distance in pixels.
+    """
+    detectors = [
+        make_detector(
+            img_size, cam_mat, dist_coeffs, dictionary, detect_params,
+            marker_length, use_fisheye, map_cache, mode
+        )
+        for mode in (UNDISTORT_REMAP, UNDISTORT_CORNERS)
+    ]
+    rows = []
+    for frame, img in enumerate(images):
+        poses = []
+        for detector in detectors:
+            corners, ids, _ = detector.detect(img)
+            if ids is None or not ids.size:
+                poses.append({})
+                continue
+            rvecs, tvecs = detector.estimate_poses(corners)
+            poses.append({
+                marker_id: (corners[i].reshape(4, 2), rvecs[i, 0], tvecs[i, 0])
+                for i, marker_id in enumerate(ids[:, 0])
+            })
+        remap_poses, corner_poses = poses
+        for marker_id in sorted(remap_poses.keys() & corner_poses.keys()):
+            remap_corners, remap_rvec, remap_tvec = remap_poses[marker_id]
+            corner_corners, corner_rvec, corner_tvec = corner_poses[marker_id]
+            # Angle of the rotation between both poses
+            rot_diff = np.matmul(
+                cv2.Rodrigues(remap_rvec)[0].T, cv2.Rodrigues(corner_rvec)[0]
+            )
+            angle = np.arccos(np.clip((np.trace(rot_diff) - 1) / 2, -1, 1))
+            rows.append({
+                'frame': frame,
+                'id': marker_id,
+                'dt': np.linalg.norm(remap_tvec - corner_tvec),
+                'drot': np.degrees(angle),
+                'dcorner': np.linalg.norm(remap_corners - corner_corners, axis=1).mean(),
+            })
+    return pd.DataFrame(rows, columns=['frame', 'id', 'dt', 'drot', 'dcorner'])
 
-    return marker_data, new_images
+
+def report_timing(timer, args, pipeline=None, result_cache=None):
+    """ Write and print the stage times requested on the command line"""
+    if result_cache is not None:
+        print(result_cache.format_stats(), file=sys.stderr)
+    if pipeline is not None and args.timing_summary:
+        print(pipeline.format_stats(), file=sys.stderr)
+    if timer is None:
+        return
+    if args.timing:
+        timer.write(args.timing[0])
+    if args.timing_summary:
+        print(timer.format_summary(), file=sys.stderr)
 
 
 def main():
     # Parse arguments
     parser = argparse.ArgumentParser(
         description='TBD Description.')
-    parser.add_argument('-c', '--camera-file', required=True,
+    parser.add_argument('-c', '--camera-file', required=False,
                         dest='camera_file', type=str, nargs=1,
-                        help='camera file')
+                        help='camera file (default: the calibration in '
+                             '--calibration-dir matching each image size)')
+    parser.add_argument('--calibration-dir', required=False,
+                        dest='calibration_dir', type=str, nargs=1,
+                        default=['calibration'],
+                        help='directory with calibration files')
     parser.add_argument('-d', '--dictionary', required=True,
                         dest='dictionary', type=int, nargs=1,
                         help='dictionary')
@@ -94,37 +414,244 @@ def main():
     parser.add_argument('-fe', '--fisheye', required=False,
                         dest='use_fisheye',
                         action='store_true', default=False,
-                        help='use fisheye')
+                        help='use fisheye (default: the model of the '
+                             'calibration file)')
     parser.add_argument('-o', '--output', required=False,
                         dest='output', type=str, nargs=1,
                         help='output file')
-    parser.add_argument('images', metavar='image', type=str, nargs='+',
+    parser.add_argument('--corners', required=False,
+                        dest='corners',
+                        action='store_true', default=False,
+                        help='also output marker corners')
+    parser.add_argument('-u', '--undistort', required=False,
+                        dest='undistort_mode', type=str, nargs=1,
+                        choices=UNDISTORT_MODES, default=[UNDISTORT_REMAP],
+                        help='undistort the whole image (remap) '
+                             'or only the marker corners (corners)')
+    parser.add_argument('--compare-undistort', required=False,
+                        dest='compare_undistort',
+                        action='store_true', default=False,
+                        help='print pose differences between undistort modes')
+    parser.add_argument('-p', '--pyramid', required=False,
+                        dest='pyramid', type=str, nargs='*',
+                        help='first search for markers in a downscaled image, '
+                             'using the best of the given lower resolution '
+                             'camera files or else a half size image')
+    parser.add_argument('--stream', required=False,
+                        dest='stream',
+                        action='store_true', default=False,
+                        help='process one image at a time and write csv '
+                             'rows as they are found')
+    parser.add_argument('--headless', required=False,
+                        dest='headless',
+                        action='store_true', default=False,
+                        help='do not draw markers or show images')
+    parser.add_argument('--map-cache', required=False,
+                        dest='map_cache', type=str, nargs=1,
+                        default=[default_cache_dir()],
+                        help='undistortion map cache directory')
+    parser.add_argument('--no-map-cache', required=False,
+                        dest='no_map_cache',
+                        action='store_true', default=False,
+                        help='always recompute undistortion maps')
+    parser.add_argument('--result-cache', required=False,
+                        dest='result_cache',
+                        action='store_true', default=False,
+                        help='reuse the results of images detected before '
+                             'with the same settings')
+    parser.add_argument('--result-cache-dir', required=False,
+                        dest='result_cache_dir', type=str, nargs=1,
+                        default=[default_result_cache_dir()],
+                        help='detection result cache directory')
+    parser.add_argument('--result-cache-max-bytes', required=False,
+                        dest='result_cache_max_bytes', type=int, nargs=1,
+                        default=[DEFAULT_RESULT_CACHE_MAX_BYTES],
+                        help='size above which the least recently used '
+                             'cached results are removed')
+    parser.add_argument('--gray', required=False,
+                        dest='gray',
+                        action='store_true', default=False,
+                        help='decode images to grayscale and remap one channel')
+    parser.add_argument('--reduce', required=False,
+                        dest='reduce', type=int, nargs=1,
+                        choices=sorted(REDUCED_FLAGS), default=[1],
+                        help='decode images at 1/2, 1/4 or 1/8 size (faster, but '
+                             'with -u remap small markers are lost)')
+    parser.add_argument('--interpolation', required=False,
+                        dest='interpolation', type=str, nargs=1,
+                        choices=list(INTERPOLATIONS), default=['cubic'],
+                        help='remap interpolation')
+    parser.add_argument('--pipeline', required=False,
+                        dest='pipeline',
+                        action='store_true', default=False,
+                        help='decode, undistort and detect in parallel '
+                             'threads, keeping frame order')
+    parser.add_argument('-j', '--workers', required=False,
+                        dest='workers', type=int, nargs=1, default=[2],
+                        help='threads per pipeline stage')
+    parser.add_argument('--queue-size', required=False,
+                        dest='queue_size', type=int, nargs=1, default=[2],
+                        help='frames waiting before each pipeline stage')
+    parser.add_argument('--timing', required=False,
+                        dest='timing', type=str, nargs=1,
+                        help='write per frame stage times to a .json or .csv file')
+    parser.add_argument('--timing-summary', required=False,
+                        dest='timing_summary',
+                        action='store_true', default=False,
+                        help='print a table of stage times')
+    parser.add_argument('--session', required=False,
+                        dest='session', type=str, nargs=1,
+                        help='read decoded frames from a session (see '
+                             'aruco.session) instead of image files')
+    parser.add_argument('--resolution', required=False,
+                        dest='resolution', type=str, nargs=1,
+                        help='only the session frames of a resolution, e.g. MP3')
+    parser.add_argument('images', metavar='image', type=str, nargs='*',
                         help='image files')
     args = parser.parse_args()
 
+    if bool(args.session) == bool(args.images):
+        parser.error('give either image files or --session')
+    if args.session and (args.pipeline or args.gray or args.reduce[0] != 1):
+        parser.error('session frames are already decoded, '
+                     '--pipeline, --gray and --reduce do not apply')
+
+    if args.stream and args.output and not is_csv(args.output[0]):
+        parser.error('--stream writes csv, use a .csv output file')
+    if args.compare_undistort and not args.camera_file:
+        parser.error('--compare-undistort needs a camera file')
+    if args.pipeline and args.timing:
+        parser.error('--pipeline reports stage times with --timing-summary only')
+
     # Read dictionary
     dictionary = cv2.aruco.getPredefinedDictionary(args.dictionary[0])
-    # Get fisheye mode
-    use_fisheye = args.use_fisheye
     # Get marker length
     marker_length = args.length[0]
     # Read detector params file
     detect_params = read_detector_params(args.detect_params[0])
 
-    # Read camera file
-    cam_mat, dist_coeffs, img_size = read_camera_file(args.camera_file[0])
+    # Open undistortion map cache
+    map_cache = None
+    if not args.no_map_cache:
+        map_cache = UndistortMapCache(args.map_cache[0])
 
-    cv2.namedWindow('frame', cv2.WINDOW_NORMAL)
-    cv2.resizeWindow('frame', 1024, 768)
-    images = [cv2.imread(img) for img in args.images]
-    marker_data, new_images = estimate_markers(
-        images, img_size, cam_mat, dist_coeffs, dictionary, detect_params, marker_length=marker_length, use_fisheye=True
-    )
+    # Read camera file, or pick calibrations by image size
+    registry = None
+    reduce = args.reduce[0]
+    if args.camera_file:
+        cam_mat, dist_coeffs, width, height, use_fisheye = read_calibration(args.camera_file[0])
+        # The fisheye model has 4 distortion coefficients
+        if args.use_fisheye and len(dist_coeffs) != 4:
+            parser.error('-fe needs a fisheye calibration, {} has {} distortion '
+                         'coefficients'.format(args.camera_file[0], len(dist_coeffs)))
+        use_fisheye = use_fisheye or args.use_fisheye
+        img_size = (height // reduce, width // reduce)
+        cam_mat = scale_camera_matrix(cam_mat, 1 / reduce)
+    else:
+        registry = CalibrationRegistry(args.calibration_dir[0], map_cache=map_cache)
+
+    # Open detection result cache
+    result_cache = None
+    if args.result_cache:
+        result_cache = ResultCache(args.result_cache_dir[0], args.result_cache_max_bytes[0])
+
+    # Read lower resolution camera files
+    coarse_cam_params = None
+    if args.pyramid is not None:
+        coarse_cam_params = [
+            read_camera_parameters(filename, map_cache=map_cache)
+            for filename in args.pyramid
+        ]
+
+    # Time pipeline stages only when asked to, the threaded pipeline
+    # keeps its own statistics
+    timer = None
+    if (args.timing or args.timing_summary) and not args.pipeline:
+        timer = StageTimer()
+
+    if args.session:
+        # Views of the mapped frames, nothing is decoded
+        images = Session(args.session[0]).images(
+            args.resolution[0] if args.resolution else None
+        )
+    else:
+        images = read_images(args.images, image_flags(args.gray, reduce), timer=timer)
+    interpolation = INTERPOLATIONS[args.interpolation[0]]
+
+    if args.compare_undistort:
+        diffs = compare_undistort_modes(
+            images, img_size, cam_mat, dist_coeffs, dictionary, detect_params,
+            marker_length=marker_length, use_fisheye=use_fisheye, map_cache=map_cache
+        )
+        print(diffs)
+        print(diffs[['dt', 'drot', 'dcorner']].describe())
+        return
+
+    show = not args.headless
+    if show:
+        cv2.namedWindow('frame', cv2.WINDOW_NORMAL)
+        cv2.resizeWindow('frame', 1024, 768)
+
+    pipeline = None
+    if args.pipeline:
+        if registry is not None:
+            detector_for_image = registry_detectors(
+                registry, dictionary, detect_params, marker_length,
+                True if args.use_fisheye else None, args.undistort_mode[0],
+                coarse_cam_params, interpolation=interpolation, reduce=reduce
+            )
+        else:
+            detector = make_detector(
+                img_size, cam_mat, dist_coeffs, dictionary, detect_params,
+                marker_length, use_fisheye, map_cache, args.undistort_mode[0],
+                coarse_cam_params, interpolation=interpolation
+            )
+            detector_for_image = lambda img: detector
+        pipeline = marker_pipeline(
+            detector_for_image, image_flags(args.gray, reduce), draw=show,
+            workers=args.workers[0], queue_size=args.queue_size[0],
+            result_cache=result_cache
+        )
+        markers = pipeline.run(enumerate(args.images))
+    elif registry is not None:
+        markers = iter_registry_markers(
+            images, registry, dictionary, detect_params, marker_length=marker_length,
+            fisheye=True if args.use_fisheye else None,
+            undistort_mode=args.undistort_mode[0], draw=show,
+            coarse_cam_params=coarse_cam_params, timer=timer,
+            interpolation=interpolation, reduce=reduce, result_cache=result_cache
+        )
+    else:
+        markers = iter_markers(
+            images, img_size, cam_mat, dist_coeffs, dictionary, detect_params,
+            marker_length=marker_length, use_fisheye=use_fisheye, map_cache=map_cache,
+            undistort_mode=args.undistort_mode[0], draw=show,
+            coarse_cam_params=coarse_cam_params, timer=timer,
+            interpolation=interpolation, result_cache=result_cache
+        )
+
+    if args.stream:
+        # Write and show each frame as soon as it is processed
+        output = args.output[0] if args.output else sys.stdout
+        # Closing the generator ends the last frame when quitting early
+        with ResultsWriter(output, corners=args.corners) as writer, closing(markers):
+            for frame, corners, ids, rvecs, tvecs, img in markers:
+                with (timer or NULL_TIMER).stage('write'):
+                    writer.append(frame, ids, rvecs, tvecs, corners)
+                if show:
+                    cv2.imshow('frame', img)
+                    if cv2.waitKey() == ord('q'):
+                        break
+        report_timing(timer, args, pipeline, result_cache)
+        return
+
+    marker_data, new_images = collect_markers(markers, keep_images=show, timer=timer)
 
     if args.output:
-        marker_data.to_csv(args.output[0])
+        marker_data.write(args.output[0], corners=args.corners)
     else:
-        print(marker_data)
+        print(marker_data.to_dataframe(corners=args.corners))
+    report_timing(timer, args, pipeline, result_cache)
 
     for img in new_images:
         cv2.imshow('frame', img)
@@ -132,6 +659,5 @@ def main():
         if key == ord('q'):
             break
 
-
 if __name__ == "__main__":
     main()
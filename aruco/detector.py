@@ -1,65 +1,229 @@
 
 import cv2
-import pandas as pd
+import numpy as np
 from .camera_parameters import CameraParameters
+from .profiling import NULL_TIMER
+from .results import MarkerResults
+
+
+# Undistort the whole frame with cv2.remap before detection
+UNDISTORT_REMAP = 'remap'
+# Detect on the distorted frame and undistort only the marker corners
+UNDISTORT_CORNERS = 'corners'
+UNDISTORT_MODES = (UNDISTORT_REMAP, UNDISTORT_CORNERS)
+
+# Remap interpolations by name, cubic is the most accurate and slowest
+INTERPOLATIONS = {
+    'nearest': cv2.INTER_NEAREST,
+    'linear': cv2.INTER_LINEAR,
+    'cubic': cv2.INTER_CUBIC,
+}
+
+# cv2.aruco.drawAxis was replaced by cv2.drawFrameAxes in newer OpenCV
+draw_axis = getattr(cv2.aruco, 'drawAxis', None) or cv2.drawFrameAxes
+
+
+def marker_regions(points, width, height, padding, min_padding=16):
+    """
+    Given (N, 4, 2) marker corners, return padded and clipped bounding
+    boxes (x0, y0, x1, y1), with overlapping boxes merged.
+    """
+    boxes = []
+    for corners in points:
+        (x0, y0), (x1, y1) = corners.min(axis=0), corners.max(axis=0)
+        pad = max(padding * max(x1 - x0, y1 - y0), min_padding)
+        boxes.append([
+            max(int(x0 - pad), 0), max(int(y0 - pad), 0),
+            min(int(np.ceil(x1 + pad)), width), min(int(np.ceil(y1 + pad)), height)
+        ])
+
+    # Merge overlapping boxes until none overlap
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]),
+                                max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(box) for box in boxes]
 
 
 class Detector:
     # TBD Add calibration parameters and other stuff
-    def __init__(self, cam_params, detector_params, default_dictionary, default_marker_length):
+    def __init__(self, cam_params, detector_params, default_dictionary, default_marker_length,
+                 undistort_mode=UNDISTORT_REMAP, timer=None, interpolation=cv2.INTER_CUBIC):
         assert isinstance(cam_params, CameraParameters)
         assert isinstance(detector_params, cv2.aruco_DetectorParameters)
         assert isinstance(default_dictionary, cv2.aruco_Dictionary)
         assert isinstance(default_marker_length, float)
+        assert undistort_mode in UNDISTORT_MODES
 
         self.cam_params = cam_params
         self.detector_params = detector_params
         self.dictionary = default_dictionary
         self.marker_length = default_marker_length
+        self.undistort_mode = undistort_mode
+        self.interpolation = interpolation
+        # Per stage timing, see aruco.profiling
+        self.timer = timer or NULL_TIMER
 
     # TBD Find corners and return  dataframe
     def undistort_and_estimate(self, img):
         assert False
 
-    def estimate_markers(self, img, undistorted=False):
-        if not undistorted:
-            img = self.undistort_image(img)
-        # Find aruco markers
-        corners, ids, _ = cv2.aruco.detectMarkers(
-            img, self.dictionary,
-            parameters=self.detector_params,
-            cameraMatrix=self.cam_params.cam_mat,
-            distCoeff=self.cam_params.dist_coeffs
-        )
-        if ids.size:
-            # Draw markers
-            cv2.aruco.drawDetectedMarkers(img, corners, ids)
-            # Estimate poses
+    def detect(self, img, undistorted=False):
+        """
+        Find markers in img. Return corners in undistorted image
+        coordinates, ids and the image the markers were found in.
+        """
+        timer = self.timer
+        if undistorted or self.undistort_mode == UNDISTORT_REMAP:
+            if not undistorted:
+                with timer.stage('remap'):
+                    img = self.undistort_image(img)
+            with timer.stage('detect'):
+                corners, ids, _ = cv2.aruco.detectMarkers(
+                    img, self.dictionary, parameters=self.detector_params
+                )
+        else:
+            # Detect on the distorted image, then undistort the corners only
+            with timer.stage('detect'):
+                corners, ids, _ = cv2.aruco.detectMarkers(
+                    img, self.dictionary, parameters=self.detector_params
+                )
+            with timer.stage('undistort_corners'):
+                corners = self.undistort_corners(corners)
+        return corners, ids, img
+
+    def detect_regions(self, img, regions):
+        """
+        Find markers in img, searching only the given (x0, y0, x1, y1)
+        regions of the search image (the undistorted image in remap mode,
+        the distorted image in corners mode). Return corners in
+        undistorted image coordinates, ids and img.
+        """
+        timer = self.timer
+        all_corners, all_ids = [], []
+        for x0, y0, x1, y1 in regions:
+            if self.undistort_mode == UNDISTORT_REMAP:
+                with timer.stage('remap'):
+                    region = self.undistort_region(img, x0, y0, x1, y1)
+            else:
+                region = img[y0:y1, x0:x1]
+            with timer.stage('detect'):
+                corners, ids, _ = cv2.aruco.detectMarkers(
+                    region, self.dictionary, parameters=self.detector_params
+                )
+            if ids is None or not ids.size:
+                continue
+            # Back to full frame coordinates
+            corners = [c + np.float32((x0, y0)) for c in corners]
+            if self.undistort_mode == UNDISTORT_CORNERS:
+                with timer.stage('undistort_corners'):
+                    corners = self.undistort_corners(corners)
+            all_corners.extend(corners)
+            all_ids.append(ids)
+
+        if not all_ids:
+            return [], None, img
+        return all_corners, np.concatenate(all_ids), img
+
+    def search_points(self, points):
+        """
+        Map undistorted image coordinates to the coordinates of the image
+        markers are searched in, i.e. the distorted image in corners mode
+        """
+        if self.undistort_mode == UNDISTORT_REMAP:
+            return np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        rays = self.cam_params.points_to_rays(points)
+        return self.cam_params.rays_to_points(rays, distorted=True)
+
+    def undistort_corners(self, corners):
+        """ Undistort a list of (1, 4, 2) marker corners"""
+        if not len(corners) or not self.cam_params.use_fisheye:
+            return corners
+        points = self.cam_params.undistort_points(np.concatenate(corners))
+        points = points.reshape(-1, 1, 4, 2).astype(np.float32)
+        return list(points)
+
+    def estimate_poses(self, corners):
+        """ Estimate rotation and translation vectors of undistorted corners"""
+        with self.timer.stage('pose'):
             rvecs, tvecs, _ = cv2.aruco.estimatePoseSingleMarkers(
-                corners, self.marker_length, self.cam_params.cam_mat, self.cam_params.dist_coeffs
+                corners, self.marker_length,
+                self.cam_params.pose_cam_mat, self.cam_params.pose_dist_coeffs
             )
+        return rvecs, tvecs
 
-            columns = ['id', 'tx', 'ty', 'tz', 'rx', 'ry', 'rz']
-            data = dict(zip(
-                columns,
-                (ids, tvecs[0::, 3], tvecs[1::, 3], tvecs[2::, 3],
-                 rvecs[0::, 3], rvecs[1::, 3], rvecs[1::, 3])
-            ))
-            dataframe = pd.DataFrame(data, columns=columns)
+    def estimate_markers(self, img, undistorted=False, results=None, frame=0):
+        """
+        Find markers in img and estimate their poses. Detections are
+        appended to results as frame, which is created if not given.
+        """
+        if results is None:
+            results = MarkerResults()
+        # Find aruco markers
+        corners, ids, img = self.detect(img, undistorted)
+        count = 0 if ids is None else ids.size
+        if count:
+            # Estimate poses
+            rvecs, tvecs = self.estimate_poses(corners)
+            with self.timer.stage('append'):
+                results.append(frame, ids, rvecs, tvecs, corners)
+
+            if self.can_draw(undistorted):
+                self.draw(img, corners, ids, rvecs, tvecs)
+        self.timer.end_frame(frame, count)
+        return results
+
+    def can_draw(self, undistorted=False):
+        """ Whether images returned by detect match the corners"""
+        # Axes can only be drawn on undistorted images
+        return undistorted or self.undistort_mode == UNDISTORT_REMAP
 
+    def draw(self, img, corners, ids, rvecs, tvecs):
+        """ Draw markers and their axes on an undistorted image"""
+        with self.timer.stage('draw'):
+            cv2.aruco.drawDetectedMarkers(img, corners, ids)
             for i, _ in enumerate(ids):
-                cv2.aruco.drawAxis(
-                    img, self.cam_params.cam_mat, self.cam_params.dist_coeffs,
+                draw_axis(
+                    img, self.cam_params.pose_cam_mat, self.cam_params.pose_dist_coeffs,
                     rvecs[i], tvecs[i], self.marker_length*0.5
                 )
 
     def undistort_image(self, img):
-        assert img.shape == (*self.cam_params.size, 3)
+        """ Undistort a color or, faster, a grayscale image"""
+        assert img.shape[:2] == self.cam_params.size
         if self.cam_params.use_fisheye:
             return cv2.remap(
                 img, self.cam_params.map1, self.cam_params.map2,
-                interpolation=cv2.INTER_CUBIC,
-                bordermode=cv2.BORDER_CONSTANT
+                interpolation=self.interpolation,
+                borderMode=cv2.BORDER_CONSTANT
             )
         else:
-            assert False
+            # Distortion is handled by the pose estimation. Markers are
+            # drawn into the result, so read only frames (e.g. memory
+            # mapped session frames) are copied
+            return img if img.flags.writeable else img.copy()
+
+    def undistort_region(self, img, x0, y0, x1, y1, interpolation=None):
+        """
+        Return the region [y0:y1, x0:x1] of the undistorted image, only
+        remapping the pixels inside it.
+        """
+        if not self.cam_params.use_fisheye:
+            return img[y0:y1, x0:x1]
+        return cv2.remap(
+            img,
+            np.ascontiguousarray(self.cam_params.map1[y0:y1, x0:x1]),
+            np.ascontiguousarray(self.cam_params.map2[y0:y1, x0:x1]),
+            interpolation=self.interpolation if interpolation is None else interpolation,
+            borderMode=cv2.BORDER_CONSTANT
+        )
@@ -0,0 +1,333 @@
+import collections
+import os
+import threading
+import time
+import cv2
+import numpy as np
+from .images import IMAGE_EXTENSIONS, list_images
+from .results import MarkerResults
+from .session import Session, is_session
+
+
+Frame = collections.namedtuple('Frame', ['index', 'timestamp', 'image'])
+
+
+class RingBuffer:
+    """
+    Bounded, thread safe frame queue. When full, the oldest frame is
+    dropped, so a slow consumer always gets recent frames and memory
+    stays bounded.
+    """
+
+    def __init__(self, capacity=4):
+        self.frames = collections.deque(maxlen=capacity)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, frame):
+        with self.condition:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(frame)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """ Return the oldest frame, or None when closed and empty"""
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.frames or self.closed, timeout):
+                raise TimeoutError('No frame within {} s'.format(timeout))
+            return self.frames.popleft() if self.frames else None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.frames)
+
+
+class FrameSource:
+    """
+    Base class of frame sources. Subclasses implement grab, which returns
+    the next image as an array, or None when the source is exhausted.
+
+    Iterating reads frames synchronously, so none are lost. After start,
+    a background thread grabs frames into a RingBuffer instead, and read
+    returns the oldest buffered frame; use this for live cameras. An
+    exception raised by grab in the thread is raised by read once the
+    frames before it are read.
+    """
+
+    def __init__(self, buffer_size=4):
+        self.buffer = RingBuffer(buffer_size)
+        self.index = 0
+        self.thread = None
+        self.running = False
+        self.error = None
+
+    def grab(self):
+        raise NotImplementedError
+
+    def next_frame(self):
+        """ Grab one frame synchronously, or return None at the end"""
+        image = self.grab()
+        if image is None:
+            return None
+        frame = Frame(self.index, time.time(), image)
+        self.index += 1
+        return frame
+
+    def _run(self):
+        try:
+            while self.running:
+                frame = self.next_frame()
+                if frame is None:
+                    break
+                self.buffer.put(frame)
+        except Exception as error:
+            self.error = error
+        finally:
+            # Readers waiting without a timeout would otherwise never return
+            self.buffer.close()
+
+    def start(self):
+        """ Start grabbing frames in a background thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def read(self, timeout=None):
+        """ Return the next frame, or None at the end"""
+        if self.thread is None:
+            return self.next_frame()
+        frame = self.buffer.get(timeout)
+        if frame is None and self.error is not None:
+            raise self.error
+        return frame
+
+    def close(self):
+        self.stop()
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DirectorySource(FrameSource):
+    """ Images of a directory in name order, or of a list of files"""
+
+    def __init__(self, path, flags=cv2.IMREAD_COLOR, loop=False, buffer_size=4):
+        super().__init__(buffer_size)
+        self.files = list_images([path] if isinstance(path, str) else path)
+        self.flags = flags
+        self.loop = loop
+        self.position = 0
+
+    def grab(self):
+        if self.position >= len(self.files):
+            if not self.loop or not self.files:
+                return None
+            self.position = 0
+        filename = self.files[self.position]
+        self.position += 1
+        img = cv2.imread(filename, self.flags)
+        if img is None:
+            raise IOError('Could not read image {}'.format(filename))
+        return img
+
+
+class VideoSource(FrameSource):
+    """ Frames of a video file or a camera device through cv2.VideoCapture"""
+
+    def __init__(self, filename, resolution=None, buffer_size=4):
+        super().__init__(buffer_size)
+        self.capture = cv2.VideoCapture(filename)
+        if not self.capture.isOpened():
+            raise IOError('Could not open video {}'.format(filename))
+        if resolution is not None:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+
+    def grab(self):
+        ok, img = self.capture.read()
+        return img if ok else None
+
+    def close(self):
+        super().close()
+        self.capture.release()
+
+
+class SyntheticSource(FrameSource):
+    """
+    Rendered frames of a grid of markers drifting over a white
+    background, for running without a camera.
+    """
+
+    def __init__(self, dictionary, resolution=(320, 240), ids=range(4),
+                 marker_size=None, frames=None, drift=(1.0, 0.5), noise=2.0,
+                 seed=0, buffer_size=4):
+        super().__init__(buffer_size)
+        width, height = resolution
+        ids = list(ids)
+        columns = int(np.ceil(np.sqrt(len(ids))))
+        rows = int(np.ceil(len(ids) / columns))
+        cell = min(width // (columns + 1), height // (rows + 1))
+        marker_size = marker_size or cell // 2
+        # Markers centered in the cells of a grid
+        self.scene = np.full((height, width), 255, dtype=np.uint8)
+        for i, marker_id in enumerate(ids):
+            x = (width - columns * cell) // 2 + (i % columns) * cell + (cell - marker_size) // 2
+            y = (height - rows * cell) // 2 + (i // columns) * cell + (cell - marker_size) // 2
+            self.scene[y:y + marker_size, x:x + marker_size] = \
+                cv2.aruco.drawMarker(dictionary, marker_id, marker_size)
+        self.frames = frames
+        self.drift = drift
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+    def grab(self):
+        if self.frames is not None and self.index >= self.frames:
+            return None
+        height, width = self.scene.shape
+        # Slow circular drift around the start position
+        angle = self.index * 2 * np.pi / 100
+        shift = np.float32([
+            [1, 0, self.drift[0] * 10 * np.sin(angle)],
+            [0, 1, self.drift[1] * 10 * np.cos(angle)],
+        ])
+        img = cv2.warpAffine(
+            self.scene, shift, (width, height), borderValue=255
+        )
+        if self.noise:
+            img = cv2.add(
+                img, self.rng.normal(0, self.noise, img.shape).astype(np.int8),
+                dtype=cv2.CV_8U
+            )
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+
+class PiCameraSource(FrameSource):
+    """
+    Frames of the Raspberry Pi camera, captured in process through the
+    picamera package from the video port, without temporary files.
+    """
+
+    def __init__(self, resolution=(320, 240), framerate=30, buffer_size=4):
+        super().__init__(buffer_size)
+        try:
+            import picamera
+            import picamera.array
+        except ImportError:
+            raise ImportError('PiCameraSource requires the picamera package')
+        self.picamera = picamera
+        self.camera = picamera.PiCamera(resolution=resolution, framerate=framerate)
+        self.resolution = resolution
+        self.lock = threading.Lock()
+        self.stream = None
+
+    def grab(self):
+        with self.lock:
+            if self.stream is None:
+                self.output = self.picamera.array.PiRGBArray(self.camera)
+                self.stream = self.camera.capture_continuous(
+                    self.output, format='bgr', use_video_port=True
+                )
+            next(self.stream)
+            img = self.output.array
+            self.output.truncate(0)
+            return img
+
+    def capture(self, resolution):
+        """
+        Capture a single still frame at the given resolution, then go back
+        to the preview resolution
+        """
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            self.camera.resolution = resolution
+            output = self.picamera.array.PiRGBArray(self.camera)
+            self.camera.capture(output, format='bgr')
+            self.camera.resolution = self.resolution
+            return output.array
+
+    def close(self):
+        super().close()
+        if self.stream is not None:
+            self.stream.close()
+        self.camera.close()
+
+
+class SessionSource(FrameSource):
+    """
+    Frames of a session directory (see aruco.session), as views of its
+    memory-mapped file, optionally of one resolution only
+    """
+
+    def __init__(self, path, resolution=None, loop=False, buffer_size=4):
+        super().__init__(buffer_size)
+        self.session = Session(path)
+        self.indices = self.session.select(resolution)
+        self.loop = loop
+        self.position = 0
+
+    def grab(self):
+        if self.position >= len(self.indices):
+            if not self.loop or not self.indices:
+                return None
+            self.position = 0
+        img = self.session[self.indices[self.position]]
+        self.position += 1
+        return img
+
+
+def open_source(spec, resolution=(320, 240), dictionary=None, **kwargs):
+    """
+    Create a frame source from a string: 'picamera', 'synthetic', a camera
+    device number, a session, a directory of images, an image or a video
+    file
+    """
+    if spec == 'picamera':
+        return PiCameraSource(resolution, **kwargs)
+    if spec == 'synthetic':
+        dictionary = dictionary or cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
+        return SyntheticSource(dictionary, resolution, **kwargs)
+    if spec.isdigit():
+        return VideoSource(int(spec), resolution, **kwargs)
+    if is_session(spec):
+        return SessionSource(spec, **kwargs)
+    if os.path.isdir(spec) or os.path.splitext(spec)[1].lower() in IMAGE_EXTENSIONS:
+        return DirectorySource(spec, **kwargs)
+    return VideoSource(spec, **kwargs)
+
+
+def estimate_frames(source, detector, results=None):
+    """
+    Feed the frames of source to a Detector. Yield every frame with the
+    MarkerResults its detections are appended to.
+    """
+    if results is None:
+        results = MarkerResults()
+    for frame in source:
+        detector.estimate_markers(frame.image, results=results, frame=frame.index)
+        yield frame, results
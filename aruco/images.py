@@ -0,0 +1,22 @@
+import glob
+import os
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+
+def list_images(paths):
+    """
+    Expand directories to the images they contain, sorted by name.
+    Files are kept in the given order.
+    """
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(sorted(
+                f for f in glob.glob(os.path.join(path, '*'))
+                if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS
+            ))
+        else:
+            images.append(path)
+    return images
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import cv2
+import numpy as np
+
+
+# Enough for the fisheye maps of every resolution in calibration/ (~100 MB)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+MAP_FILES = ('new_cam_mat.npy', 'map1.npy', 'map2.npy')
+
+
+def default_cache_dir():
+    """ Directory used when no cache directory is given"""
+    return os.environ.get(
+        'ARUCO_MAP_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'aruco', 'maps')
+    )
+
+
+def file_hash(filename):
+    """ Given a file, return the sha1 hex digest of its content"""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def array_hash(*arrays):
+    """ Given numpy arrays, return the sha1 hex digest of their values"""
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def fisheye_undistort_maps(cam_mat, dist_coeffs, size, balance=1.0,
+                           map_type=cv2.CV_16SC2):
+    """
+    Compute the new camera matrix and the undistortion maps for a fisheye
+    camera. size is given as (height, width) like CameraParameters.size.
+    """
+    height, width = size
+    new_cam_mat = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(
+        cam_mat, dist_coeffs, (width, height), np.eye(3), balance=balance
+    )
+    map1, map2 = cv2.fisheye.initUndistortRectifyMap(
+        cam_mat, dist_coeffs, np.eye(3),
+        new_cam_mat, (width, height), map_type
+    )
+    return new_cam_mat, map1, map2
+
+
+class UndistortMapCache:
+    """
+    On-disk cache of fisheye undistortion maps.
+
+    Every entry is a directory of .npy files named after a hash of the
+    calibration, the image size, the balance and the map type. Maps are
+    loaded memory-mapped, so a hit costs no copy and processes using the
+    same entry share the pages. The least recently used entries are
+    evicted when the cache grows above max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, calibration_hash, size, balance, map_type):
+        token = '{}:{}x{}:{!r}:{}'.format(
+            calibration_hash, size[0], size[1], float(balance), int(map_type)
+        )
+        return hashlib.sha1(token.encode()).hexdigest()
+
+    def get(self, key):
+        """ Return (new_cam_mat, map1, map2) for key, or None on a miss"""
+        path = os.path.join(self.directory, key)
+        try:
+            new_cam_mat, map1, map2 = (
+                np.load(os.path.join(path, name), mmap_mode='r')
+                for name in MAP_FILES
+            )
+        except (OSError, ValueError):
+            return None
+        # Mark entry as recently used
+        os.utime(path)
+        return np.array(new_cam_mat), map1, map2
+
+    def put(self, key, new_cam_mat, map1, map2):
+        """ Store maps under key and return them memory-mapped"""
+        # Write to a temporary directory and rename it, so concurrent
+        # readers never see a partial entry
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            for name, array in zip(MAP_FILES, (new_cam_mat, map1, map2)):
+                np.save(os.path.join(tmp, name), array)
+            os.rename(tmp, os.path.join(self.directory, key))
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+        maps = self.get(key)
+        return maps if maps is not None else (new_cam_mat, map1, map2)
+
+    def entries(self):
+        """ Return a list of (last use, size in bytes, path) for all entries"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)
+            )
+            entries.append((os.path.getmtime(path), size, path))
+        return entries
+
+    def evict(self):
+        """ Remove least recently used entries until below max_bytes"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        # Always keep the most recently used entry
+        while total > self.max_bytes and len(entries) > 1:
+            _, size, path = entries.pop(0)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def fisheye_maps(self, calibration_hash, cam_mat, dist_coeffs, size,
+                     balance=1.0, map_type=cv2.CV_16SC2):
+        """ Like fisheye_undistort_maps, but computed only on a cache miss"""
+        key = self.key(calibration_hash, size, balance, map_type)
+        maps = self.get(key)
+        if maps is None:
+            maps = self.put(key, *fisheye_undistort_maps(
+                cam_mat, dist_coeffs, size, balance, map_type
+            ))
+        return maps
@@ -0,0 +1,220 @@
+import queue
+import threading
+import time
+import pandas as pd
+
+
+# Seconds between checks for a stopped pipeline while waiting
+POLL_INTERVAL = 0.1
+
+# Marks the end of the items in a queue
+_DONE = object()
+
+
+class _Failure:
+    """ An exception raised for an item, passed on in place of the item"""
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+class PipelineStage:
+    """
+    A named function applied to every item by a pool of worker threads,
+    reading from a queue of at most queue_size items.
+
+    Only stages whose work releases the GIL (OpenCV calls, file I/O)
+    gain from more than one worker.
+    """
+
+    def __init__(self, name, function, workers=1, queue_size=2):
+        assert workers >= 1
+        assert queue_size >= 1
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.items = 0
+        # Seconds spent in function, and waiting for room in the next queue
+        self.busy = 0.0
+        self.blocked = 0.0
+        # Queue depth seen by the workers when taking an item
+        self.depth_sum = 0
+        self.depth_max = 0
+
+
+def _put(target, value, stop):
+    """ Put into a bounded queue, giving up once stop is set"""
+    while not stop.is_set():
+        try:
+            target.put(value, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(source, stop):
+    """ Get from a queue, _DONE once stop is set"""
+    while not stop.is_set():
+        try:
+            return source.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+class Pipeline:
+    """
+    Run items through a sequence of stages, each with its own threads,
+    connected by bounded queues.
+
+    A slow stage fills its queue and blocks the stages before it, and at
+    most max_in_flight items are between the input and the consumer, so
+    memory use is bounded. Items may finish out of order when a stage has
+    several workers; run reorders them and yields results in input order.
+    An exception raised by a stage is raised by run at the position of
+    its item.
+    """
+
+    def __init__(self, stages, max_in_flight=None):
+        assert stages
+        self.stages = list(stages)
+        self.max_in_flight = max_in_flight or sum(
+            stage.workers + stage.queue_size for stage in self.stages
+        )
+        self.wall = 0.0
+        self.reorder_max = 0
+
+    def _feed(self, items, inbox, slots, stop):
+        index = 0
+        try:
+            for item in items:
+                while not slots.acquire(timeout=POLL_INTERVAL):
+                    if stop.is_set():
+                        return
+                if not _put(inbox, (index, item), stop):
+                    return
+                index += 1
+        except Exception as error:
+            _put(inbox, (index, _Failure(error)), stop)
+        finally:
+            for _ in range(self.stages[0].workers):
+                _put(inbox, _DONE, stop)
+
+    def _work(self, stage, inbox, outbox, next_workers, running, stop):
+        while True:
+            value = _get(inbox, stop)
+            if value is _DONE:
+                break
+            depth = inbox.qsize()
+            index, item = value
+            start = time.perf_counter()
+            if not isinstance(item, _Failure):
+                try:
+                    item = stage.function(item)
+                except Exception as error:
+                    item = _Failure(error)
+            busy = time.perf_counter() - start
+            _put(outbox, (index, item), stop)
+            with stage.lock:
+                stage.items += 1
+                stage.busy += busy
+                stage.blocked += time.perf_counter() - start - busy
+                stage.depth_sum += depth
+                stage.depth_max = max(stage.depth_max, depth)
+
+        # The last worker of a stage ends the next one
+        with stage.lock:
+            running[stage.name] -= 1
+            last = running[stage.name] == 0
+        if last:
+            for _ in range(next_workers):
+                _put(outbox, _DONE, stop)
+
+    def run(self, items):
+        """ Generator of the results of the last stage, in item order"""
+        for stage in self.stages:
+            stage.reset()
+        self.reorder_max = 0
+        stop = threading.Event()
+        slots = threading.Semaphore(self.max_in_flight)
+        queues = [queue.Queue(stage.queue_size) for stage in self.stages]
+        # In flight items bound the output queue
+        queues.append(queue.Queue())
+        running = {stage.name: stage.workers for stage in self.stages}
+        threads = [threading.Thread(
+            target=self._feed, args=(items, queues[0], slots, stop), daemon=True
+        )]
+        for i, stage in enumerate(self.stages):
+            next_workers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            threads.extend(
+                threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[i], queues[i + 1], next_workers, running, stop),
+                    name='{}-{}'.format(stage.name, worker), daemon=True
+                )
+                for worker in range(stage.workers)
+            )
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        pending = {}
+        next_index = 0
+        try:
+            while True:
+                value = queues[-1].get()
+                if value is _DONE:
+                    break
+                index, item = value
+                pending[index] = item
+                self.reorder_max = max(self.reorder_max, len(pending))
+                while next_index in pending:
+                    item = pending.pop(next_index)
+                    next_index += 1
+                    slots.release()
+                    if isinstance(item, _Failure):
+                        raise item.error
+                    yield item
+        finally:
+            # Also stops the threads when the consumer quits early
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall = time.perf_counter() - start
+
+    def stats(self):
+        """
+        Return a dataframe with a row per stage: workers, items, mean
+        time per item and mean blocked time in milliseconds, utilization
+        of the workers, and mean and maximum depth of the input queue
+        """
+        rows = []
+        for stage in self.stages:
+            items = max(stage.items, 1)
+            rows.append({
+                'stage': stage.name,
+                'workers': stage.workers,
+                'items': stage.items,
+                'mean_ms': stage.busy / items * 1000,
+                'blocked_ms': stage.blocked / items * 1000,
+                'utilization': stage.busy / (self.wall * stage.workers) if self.wall else 0.0,
+                'queue_mean': stage.depth_sum / items,
+                'queue_max': stage.depth_max,
+                'queue_size': stage.queue_size,
+            })
+        return pd.DataFrame(rows)
+
+    def format_stats(self):
+        """ Stage statistics and throughput as printable text"""
+        items = self.stages[-1].items
+        return '{}\n{} items in {:.2f} s, {:.2f} items/s, reorder buffer max {}'.format(
+            self.stats().to_string(index=False, float_format='{:.2f}'.format),
+            items, self.wall, items / self.wall if self.wall else 0.0, self.reorder_max
+        )
@@ -0,0 +1,148 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+
+class _Stage:
+    """ Context manager timing one stage of a StageTimer"""
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        if self.timer.frame_start is None:
+            self.timer.frame_start = self.start
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.pending.append((self.name, time.perf_counter() - self.start))
+
+
+class StageTimer:
+    """
+    Record the wall time of named pipeline stages in every frame.
+
+    Stages are timed with `with timer.stage('remap'):`. A stage may run
+    several times per frame, its times are summed. end_frame closes the
+    current frame with its marker count; the frame time runs from the
+    start of its first stage to end_frame.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.pending = []
+        self.frame_start = None
+        # (frame, stage, seconds) and (frame, seconds, markers) rows
+        self.records = []
+        self.frames = []
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def end_frame(self, frame=None, markers=0):
+        now = time.perf_counter()
+        if frame is None:
+            frame = len(self.frames)
+        start = now if self.frame_start is None else self.frame_start
+        self.records.extend((frame, name, seconds) for name, seconds in self.pending)
+        self.frames.append((frame, now - start, markers))
+        self.pending = []
+        self.frame_start = None
+
+    def stages(self):
+        """ Stage names in order of first use"""
+        return list(dict.fromkeys(name for _, name, _ in self.records))
+
+    def frame_table(self):
+        """
+        Return a dataframe with a row per frame: frame, total and stage
+        times in milliseconds, and markers
+        """
+        frames = pd.DataFrame(self.frames, columns=['frame', 'total', 'markers'])
+        records = pd.DataFrame(self.records, columns=['frame', 'stage', 'seconds'])
+        stages = records.pivot_table(
+            index='frame', columns='stage', values='seconds', aggfunc='sum', fill_value=0.0
+        ).reindex(columns=self.stages())
+        table = frames.set_index('frame').join(stages).fillna(0.0)
+        table[['total', *stages.columns]] *= 1000
+        table.columns.name = None
+        return table.reset_index()
+
+    def summary(self):
+        """
+        Return a dataframe of per frame time statistics in milliseconds
+        for every stage and the whole frame, with each stage's share of
+        the total time
+        """
+        table = self.frame_table()
+        rows = []
+        for name in [*self.stages(), 'total']:
+            times = table[name].to_numpy()
+            rows.append({
+                'stage': name,
+                'frames': int(np.count_nonzero(times)),
+                'mean': times.mean(),
+                'p50': np.percentile(times, 50),
+                'p95': np.percentile(times, 95),
+                'max': times.max(),
+                'share': times.sum() / max(table['total'].sum(), 1e-12),
+            })
+        return pd.DataFrame(
+            rows, columns=['stage', 'frames', 'mean', 'p50', 'p95', 'max', 'share']
+        )
+
+    def format_summary(self):
+        if not self.frames:
+            return 'No frames timed'
+        lines = ['{:18} {:>6} {:>9} {:>9} {:>9} {:>9} {:>6}'.format(
+            'stage', 'frames', 'mean ms', 'p50 ms', 'p95 ms', 'max ms', 'share')]
+        for row in self.summary().itertuples():
+            lines.append('{:18} {:6} {:9.2f} {:9.2f} {:9.2f} {:9.2f} {:5.1f}%'.format(
+                row.stage, row.frames, row.mean, row.p50, row.p95, row.max, row.share * 100
+            ))
+        markers = sum(markers for _, _, markers in self.frames)
+        lines.append('{} frames, {} markers'.format(len(self.frames), markers))
+        return '\n'.join(lines)
+
+    def write(self, filename):
+        """ Write the frame table to a .json or .csv file"""
+        table = self.frame_table()
+        if os.path.splitext(filename)[1].lower() == '.json':
+            with open(filename, 'w') as stream:
+                json.dump({
+                    'stages': self.stages(),
+                    'frames': table.to_dict(orient='records'),
+                    'summary': self.summary().to_dict(orient='records'),
+                }, stream, indent=2)
+        else:
+            table.to_csv(filename, index=False)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class NullTimer:
+    """ Timer that records nothing, used when profiling is disabled"""
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def end_frame(self, frame=None, markers=0):
+        pass
+
+
+NULL_TIMER = NullTimer()
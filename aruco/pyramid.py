@@ -0,0 +1,119 @@
+import threading
+import cv2
+import numpy as np
+from .camera_parameters import CameraParameters
+from .detector import Detector, marker_regions, UNDISTORT_REMAP, UNDISTORT_CORNERS
+
+
+# Coarse levels are only used between these fractions of the full frame
+# width. Markers get too small to find below, and above little is saved
+MIN_COARSE_SCALE = 0.3
+MAX_COARSE_SCALE = 0.75
+# Scale of the coarse level made from the full resolution calibration
+COARSE_SCALE = 0.5
+# Frames narrower than this are searched without a coarse level
+MIN_COARSE_WIDTH = 480
+
+
+def coarse_level(cam_params, levels=(), map_cache=None):
+    """
+    Pick the calibration to search the downscaled frame with: the largest
+    of levels (CameraParameters of other resolutions) between
+    MIN_COARSE_SCALE and MAX_COARSE_SCALE of the full width, else
+    cam_params scaled by COARSE_SCALE. Return None when the frame is too
+    small to have a coarse level.
+    """
+    if isinstance(levels, CameraParameters):
+        levels = [levels]
+    width = cam_params.size[1]
+    usable = [
+        level for level in levels
+        if MIN_COARSE_SCALE <= level.size[1] / width <= MAX_COARSE_SCALE
+    ]
+    if usable:
+        return max(usable, key=lambda level: level.size[1])
+    if width * COARSE_SCALE < MIN_COARSE_WIDTH:
+        return None
+    return cam_params.scaled(COARSE_SCALE, map_cache=map_cache)
+
+
+class PyramidDetector(Detector):
+    """
+    Coarse to fine detector.
+
+    Markers are first searched for in a downscaled frame, using the
+    calibration of the low resolution (coarse_cam_params). The corners
+    are converted to rays and projected into the full resolution frame
+    with its own calibration, and detectMarkers (including corner
+    refinement) only runs inside padded regions around them. In remap
+    mode only these regions are undistorted. When nothing is found in the
+    downscaled frame, the full frame is searched (full_frame_fallback).
+
+    Markers the coarse level misses are lost, so coarse_cam_params should
+    be an intermediate resolution, see coarse_level.
+    """
+
+    def __init__(self, cam_params, detector_params, default_dictionary, default_marker_length,
+                 coarse_cam_params, undistort_mode=UNDISTORT_REMAP, padding=0.5,
+                 coarse_detector_params=None, timer=None, interpolation=cv2.INTER_CUBIC,
+                 full_frame_fallback=True):
+        super().__init__(
+            cam_params, detector_params, default_dictionary, default_marker_length,
+            undistort_mode=undistort_mode, timer=timer, interpolation=interpolation
+        )
+        # The coarse level never needs a full remap
+        self.coarse = Detector(
+            coarse_cam_params, coarse_detector_params or detector_params,
+            default_dictionary, default_marker_length,
+            undistort_mode=UNDISTORT_CORNERS
+        )
+        self.padding = padding
+        self.full_frame_fallback = full_frame_fallback
+        # Whether the last detect of each thread searched the full frame
+        self.last = threading.local()
+
+    def candidate_regions(self, img):
+        """ Return the regions of img to search, from a downscaled copy"""
+        height, width = self.coarse.cam_params.size
+        # INTER_AREA is only fast for integer factors
+        factor = img.shape[1] / width
+        interpolation = cv2.INTER_AREA if factor == int(factor) else cv2.INTER_LINEAR
+        small = cv2.resize(img, (width, height), interpolation=interpolation)
+        corners, ids, _ = self.coarse.detect(small)
+        if ids is None or not ids.size:
+            return []
+        # Same rays seen by the full resolution camera
+        rays = self.coarse.cam_params.points_to_rays(np.concatenate(corners))
+        points = self.cam_params.rays_to_points(
+            rays, distorted=self.undistort_mode == UNDISTORT_CORNERS
+        )
+        height, width = self.cam_params.size
+        return marker_regions(
+            points.reshape(-1, 4, 2), width, height, self.padding
+        )
+
+    def detect(self, img, undistorted=False):
+        """
+        Find markers in img, searching only the candidate regions, or the
+        full frame when there are none and full_frame_fallback is set.
+        Return corners in undistorted image coordinates, ids and img.
+        """
+        self.last.full_frame = False
+        if undistorted:
+            return super().detect(img, undistorted)
+        # The coarse level is timed as a whole
+        with self.timer.stage('coarse'):
+            regions = self.candidate_regions(img)
+        if not regions and self.full_frame_fallback:
+            self.last.full_frame = True
+            return super().detect(img)
+        return self.detect_regions(img, regions)
+
+    def can_draw(self, undistorted=False):
+        """
+        Whether the image returned by the last detect of this thread
+        matches the corners. Only a full frame fallback in remap mode
+        undistorts the whole frame.
+        """
+        full_frame = getattr(self.last, 'full_frame', False)
+        return undistorted or (full_frame and self.undistort_mode == UNDISTORT_REMAP)
@@ -1,17 +1,30 @@
 import cv2
 import yaml
 
-def read_detector_params(file_name):
+def detector_params_from_dict(params):
+    """ Create DetectorParameters with the given attributes set"""
     detector_params = cv2.aruco.DetectorParameters_create()
+    for key, value in params.items():
+        setattr(detector_params, key, value)
+    return detector_params
+
+def read_detector_params_dict(file_name):
+    """ Read a detector parameters file as a dict"""
     with open(file_name, 'r') as stream:
         try:
-            params = yaml.load(stream)
-            for key, value in params.items():
-                setattr(detector_params, key, value)
+            return yaml.safe_load(stream)
         except yaml.YAMLError as exc:
             print(exc)
             exit(-1)
-    return detector_params
+
+def read_detector_params(file_name):
+    return detector_params_from_dict(read_detector_params_dict(file_name))
+
+def write_detector_params(file_name, params):
+    """ Write a dict of detector parameters in the format of read_detector_params"""
+    with open(file_name, 'w') as stream:
+        stream.write('%YAML 1.0\n---\n')
+        yaml.safe_dump(dict(sorted(params.items())), stream, default_flow_style=False)
 
 def read_camera_file(file_name):
     cam_file = cv2.FileStorage(file_name, cv2.FILE_STORAGE_READ)
@@ -21,6 +34,5 @@ def read_camera_file(file_name):
         int(cam_file.getNode('image_height').real()),
         int(cam_file.getNode('image_width').real())
     )
-    use_fisheye = cam_file.getNode('fisheye_model')
-    print(use_fisheye)
+    cam_file.release()
     return cam_mat, dist_coeffs, img_size
\ No newline at end of file
@@ -0,0 +1,178 @@
+import collections
+import glob
+import json
+import os
+import numpy as np
+from .camera_parameters import CameraParameters, read_calibration, scale_camera_matrix
+from .map_cache import file_hash
+
+
+CALIBRATION_PATTERN = '*_calibration_*.xml'
+INDEX = 'index.json'
+
+
+def default_calibration_cache_dir():
+    """ Directory used when no cache directory is given"""
+    return os.environ.get(
+        'ARUCO_CALIBRATION_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'aruco', 'calibrations')
+    )
+
+
+CalibrationEntry = collections.namedtuple(
+    'CalibrationEntry', ['filename', 'width', 'height', 'fisheye', 'hash']
+)
+
+
+def pack_calibration(cam_mat, dist_coeffs, width, height, use_fisheye):
+    """
+    Flatten a calibration into one float64 vector: width, height, fisheye,
+    number of distortion coefficients, camera matrix, coefficients
+    """
+    dist_coeffs = np.ravel(dist_coeffs)
+    return np.concatenate((
+        [width, height, float(use_fisheye), len(dist_coeffs)],
+        np.ravel(cam_mat), dist_coeffs
+    )).astype(np.float64)
+
+
+def unpack_calibration(packed):
+    """ Inverse of pack_calibration"""
+    width, height, use_fisheye, count = packed[:4]
+    cam_mat = packed[4:13].reshape(3, 3).copy()
+    dist_coeffs = packed[13:13 + int(count)].reshape(-1, 1).copy()
+    return cam_mat, dist_coeffs, int(width), int(height), bool(use_fisheye)
+
+
+class CalibrationRegistry:
+    """
+    Index of the calibration files in a directory by image size and model.
+
+    Files are only parsed when new or changed (by size and modification
+    time); the parsed parameters are kept as small .npy files in
+    cache_dir, named by the hash of the file. CameraParameters, including
+    their undistortion maps, are created once per calibration.
+
+    When a size has both a fisheye and a normal calibration, the fisheye
+    one is used unless prefer_fisheye is False or a model is asked for.
+    """
+
+    def __init__(self, directory='calibration', cache_dir=None, map_cache=None,
+                 prefer_fisheye=True, pattern=CALIBRATION_PATTERN):
+        self.directory = directory
+        self.cache_dir = cache_dir or default_calibration_cache_dir()
+        self.map_cache = map_cache
+        self.prefer_fisheye = prefer_fisheye
+        self.pattern = pattern
+        self.entries = []
+        self.parameters = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.scan()
+
+    def _binary_file(self, calibration_hash):
+        return os.path.join(self.cache_dir, calibration_hash + '.npy')
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, INDEX)) as stream:
+                return json.load(stream)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        # Replace atomically, other processes may be reading it
+        tmp = os.path.join(self.cache_dir, '{}.{}.tmp'.format(INDEX, os.getpid()))
+        with open(tmp, 'w') as stream:
+            json.dump(index, stream, indent=1)
+        os.replace(tmp, os.path.join(self.cache_dir, INDEX))
+
+    def scan(self):
+        """ (Re)index the calibration files of the directory"""
+        index = self._read_index()
+        changed = False
+        entries = []
+        for filename in sorted(glob.glob(os.path.join(self.directory, self.pattern))):
+            filename = os.path.abspath(filename)
+            stat = os.stat(filename)
+            known = index.get(filename)
+            if (known is None or known['size'] != stat.st_size or
+                    known['mtime'] != stat.st_mtime_ns or
+                    not os.path.exists(self._binary_file(known['hash']))):
+                calibration = read_calibration(filename)
+                known = {
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime_ns,
+                    'hash': file_hash(filename),
+                    'width': calibration[2],
+                    'height': calibration[3],
+                    'fisheye': calibration[4],
+                }
+                np.save(self._binary_file(known['hash']), pack_calibration(*calibration))
+                index[filename] = known
+                changed = True
+            entries.append(CalibrationEntry(
+                filename, known['width'], known['height'], known['fisheye'], known['hash']
+            ))
+        if changed:
+            self._write_index(index)
+        self.entries = entries
+        return entries
+
+    def sizes(self):
+        """ Sorted (width, height) of all calibrations"""
+        return sorted({(entry.width, entry.height) for entry in self.entries})
+
+    def find(self, width, height, fisheye=None):
+        """ Return the calibration entry for an image size, or None"""
+        matches = [
+            entry for entry in self.entries
+            if entry.width == width and entry.height == height and
+            (fisheye is None or entry.fisheye == fisheye)
+        ]
+        if not matches:
+            return None
+        # Preferred model first, then by file name
+        return min(matches, key=lambda entry: (entry.fisheye != self.prefer_fisheye, entry.filename))
+
+    def load(self, entry):
+        """ Return cam_mat, dist_coeffs, width, height, use_fisheye of an entry"""
+        return unpack_calibration(np.load(self._binary_file(entry.hash)))
+
+    def camera_parameters(self, entry, reduce=1):
+        """
+        CameraParameters of an entry, created on first use, for images
+        reduced in size by an integer factor
+        """
+        key = (entry.hash, reduce)
+        if key not in self.parameters:
+            cam_mat, dist_coeffs, width, height, use_fisheye = self.load(entry)
+            calibration_hash = entry.hash
+            if reduce != 1:
+                cam_mat = scale_camera_matrix(cam_mat, 1 / reduce)
+                width, height = width // reduce, height // reduce
+                calibration_hash = '{}-x{}'.format(entry.hash, 1 / reduce)
+            self.parameters[key] = CameraParameters(
+                cam_mat, dist_coeffs, width, height, use_fisheye,
+                map_cache=self.map_cache, calibration_hash=calibration_hash
+            )
+        return self.parameters[key]
+
+    def for_size(self, width, height, fisheye=None, reduce=1):
+        """
+        CameraParameters for an image size, KeyError if there is none.
+        With reduce, the image is that many times smaller than the
+        calibration, e.g. 2 for cv2.IMREAD_REDUCED_GRAYSCALE_2.
+        """
+        entry = self.find(width * reduce, height * reduce, fisheye)
+        if entry is None:
+            raise KeyError('No {}calibration for {}x{} in {}, available: {}'.format(
+                '' if fisheye is None else ('fisheye ' if fisheye else 'normal '),
+                width * reduce, height * reduce, self.directory,
+                ', '.join('{}x{}'.format(*size) for size in self.sizes())
+            ))
+        return self.camera_parameters(entry, reduce)
+
+    def for_image(self, img, fisheye=None, reduce=1):
+        """ CameraParameters matching the shape of an image"""
+        height, width = img.shape[:2]
+        return self.for_size(width, height, fisheye, reduce)
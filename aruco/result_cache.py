@@ -0,0 +1,199 @@
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+import numpy as np
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Eviction goes down to this fraction of max_bytes, so a full cache is
+# not scanned again on every put
+EVICT_TO = 0.9
+
+# One record per marker, about 100 bytes
+RESULT_DTYPE = np.dtype([
+    ('id', '<i4'),
+    ('rvec', '<f8', (3,)),
+    ('tvec', '<f8', (3,)),
+    ('corners', '<f4', (4, 2)),
+])
+
+
+def default_result_cache_dir():
+    """ Directory used when no cache directory is given"""
+    return os.environ.get(
+        'ARUCO_RESULT_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'aruco', 'results')
+    )
+
+
+def image_hash(img):
+    """ Given an image, return the sha1 hex digest of its shape and pixels"""
+    digest = hashlib.sha1()
+    digest.update('{}:{}'.format(img.shape, img.dtype).encode())
+    digest.update(np.ascontiguousarray(img).data)
+    return digest.hexdigest()
+
+
+def detector_params_dict(params):
+    """ Return the attributes of cv2 DetectorParameters as a dict"""
+    return {
+        name: getattr(params, name) for name in dir(params)
+        if not name.startswith('_') and not callable(getattr(params, name))
+    }
+
+
+def detector_hash(detector):
+    """
+    Return the sha1 hex digest of everything that changes the results of
+    a Detector: calibration, detector parameters, dictionary, marker
+    length, undistort mode and interpolation, and the coarse level of a
+    PyramidDetector
+    """
+    digest = hashlib.sha1()
+    dictionary = detector.dictionary
+    digest.update(repr((
+        detector.cam_params.calibration_hash,
+        sorted(detector_params_dict(detector.detector_params).items()),
+        dictionary.markerSize, dictionary.maxCorrectionBits,
+        float(detector.marker_length), detector.undistort_mode, detector.interpolation,
+    )).encode())
+    digest.update(np.ascontiguousarray(dictionary.bytesList).data)
+    coarse = getattr(detector, 'coarse', None)
+    if coarse is not None:
+        digest.update(repr((
+            detector_hash(coarse), detector.padding, detector.full_frame_fallback
+        )).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of detection results, addressed by content.
+
+    An entry holds the markers found in one image, as a .npy file of
+    RESULT_DTYPE records named by a hash of the pixels and of the
+    detector configuration (see detector_hash), so only images or
+    settings not seen before are detected again. Images without markers
+    are cached too. The size of the cache is read when it is opened and
+    kept up to date by put, and the least recently used entries are
+    evicted as soon as it grows above max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_result_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.lock = threading.Lock()
+        # Detector configuration hashes, computed once per detector
+        self.detectors = weakref.WeakKeyDictionary()
+        os.makedirs(self.directory, exist_ok=True)
+        self.total = 0
+        self.evict()
+
+    def key(self, detector, img):
+        config = self.detectors.get(detector)
+        if config is None:
+            config = self.detectors[detector] = detector_hash(detector)
+        return hashlib.sha1('{}:{}'.format(config, image_hash(img)).encode()).hexdigest()
+
+    def _path(self, key):
+        # Two level layout keeps directories small
+        return os.path.join(self.directory, key[:2], key + '.npy')
+
+    def get(self, key):
+        """
+        Return (corners, ids, rvecs, tvecs) in the format of detectMarkers
+        and estimatePoseSingleMarkers, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            records = np.load(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        # Mark entry as recently used
+        os.utime(path)
+        with self.lock:
+            self.hits += 1
+        if not len(records):
+            return [], None, None, None
+        # Fields are strided views of the records, OpenCV needs copies
+        return (
+            list(np.ascontiguousarray(records['corners']).reshape(-1, 1, 4, 2)),
+            np.ascontiguousarray(records['id']).reshape(-1, 1),
+            np.ascontiguousarray(records['rvec']).reshape(-1, 1, 3),
+            np.ascontiguousarray(records['tvec']).reshape(-1, 1, 3),
+        )
+
+    def put(self, key, corners, ids, rvecs, tvecs):
+        """ Store the markers found in an image under key"""
+        count = 0 if ids is None else len(ids)
+        records = np.zeros(count, dtype=RESULT_DTYPE)
+        if count:
+            records['id'] = np.reshape(ids, count)
+            records['rvec'] = np.reshape(rvecs, (count, 3))
+            records['tvec'] = np.reshape(tvecs, (count, 3))
+            records['corners'] = np.reshape(corners, (count, 4, 2))
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and rename it, so concurrent readers
+        # never see a partial entry
+        handle, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                np.save(stream, records)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        except OSError:
+            os.unlink(tmp)
+            raise
+        with self.lock:
+            self.puts += 1
+            self.total += size
+            evict = self.total > self.max_bytes
+        if evict:
+            self.evict()
+
+    def entries(self):
+        """ Return a list of (last use, size in bytes, path) for all entries"""
+        entries = []
+        for shard in os.listdir(self.directory):
+            shard = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard):
+                continue
+            for name in os.listdir(shard):
+                if name.startswith('.'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(shard, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(shard, name)))
+        return entries
+
+    def evict(self):
+        """
+        Read the size of the cache and, when it is above max_bytes, remove
+        least recently used entries until below EVICT_TO of max_bytes
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            while total > self.max_bytes * EVICT_TO and entries:
+                _, size, path = entries.pop(0)
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                total -= size
+        with self.lock:
+            self.total = total
+
+    def format_stats(self):
+        return 'result cache: {} hits, {} misses'.format(self.hits, self.misses)
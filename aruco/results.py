@@ -0,0 +1,221 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+COLUMNS = ['frame', 'id', 'tx', 'ty', 'tz', 'rx', 'ry', 'rz']
+CORNER_COLUMNS = ['c{}{}'.format(i, axis) for i in range(4) for axis in 'xy']
+
+# Rows allocated at a time
+CHUNK_SIZE = 1024
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+FEATHER_EXTENSIONS = ('.feather', '.arrow')
+
+
+def is_csv(filename):
+    """ Whether write and read_results use csv for filename"""
+    extension = os.path.splitext(filename)[1].lower()
+    return extension not in PARQUET_EXTENSIONS + FEATHER_EXTENSIONS
+
+
+class MarkerResults:
+    """
+    Marker detections stored column by column in numpy arrays.
+
+    Arrays grow geometrically in chunks, so appending stays linear in the
+    number of detections. A dataframe is only built by to_dataframe.
+    """
+
+    def __init__(self, capacity=CHUNK_SIZE):
+        self.size = 0
+        self._frames = np.empty(capacity, dtype=np.int64)
+        self._ids = np.empty(capacity, dtype=np.int32)
+        self._tvecs = np.empty((capacity, 3), dtype=np.float64)
+        self._rvecs = np.empty((capacity, 3), dtype=np.float64)
+        self._corners = np.empty((capacity, 4, 2), dtype=np.float32)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def frames(self):
+        return self._frames[:self.size]
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    @property
+    def tvecs(self):
+        return self._tvecs[:self.size]
+
+    @property
+    def rvecs(self):
+        return self._rvecs[:self.size]
+
+    @property
+    def corners(self):
+        return self._corners[:self.size]
+
+    def _reserve(self, count):
+        """ Make room for count more rows"""
+        needed = self.size + count
+        capacity = len(self._frames)
+        if needed <= capacity:
+            return
+        capacity = max(2 * capacity, needed + CHUNK_SIZE)
+        for name in ('_frames', '_ids', '_tvecs', '_rvecs', '_corners'):
+            old = getattr(self, name)
+            new = np.empty((capacity, *old.shape[1:]), dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self, frame, ids, rvecs, tvecs, corners):
+        """
+        Append the markers found in one frame, as returned by
+        detectMarkers and estimatePoseSingleMarkers.
+        """
+        count = 0 if ids is None else len(ids)
+        if not count:
+            return
+        self._reserve(count)
+        rows = slice(self.size, self.size + count)
+        self._frames[rows] = frame
+        self._ids[rows] = np.reshape(ids, count)
+        self._rvecs[rows] = np.reshape(rvecs, (count, 3))
+        self._tvecs[rows] = np.reshape(tvecs, (count, 3))
+        self._corners[rows] = np.reshape(corners, (count, 4, 2))
+        self.size += count
+
+    def extend(self, other):
+        """ Append all rows of another MarkerResults"""
+        self._reserve(len(other))
+        rows = slice(self.size, self.size + len(other))
+        self._frames[rows] = other.frames
+        self._ids[rows] = other.ids
+        self._rvecs[rows] = other.rvecs
+        self._tvecs[rows] = other.tvecs
+        self._corners[rows] = other.corners
+        self.size += len(other)
+
+    def to_dataframe(self, corners=False):
+        """ Return a dataframe with one row per detection"""
+        data = {
+            'frame': self.frames,
+            'id': self.ids,
+            'tx': self.tvecs[:, 0],
+            'ty': self.tvecs[:, 1],
+            'tz': self.tvecs[:, 2],
+            'rx': self.rvecs[:, 0],
+            'ry': self.rvecs[:, 1],
+            'rz': self.rvecs[:, 2],
+        }
+        columns = COLUMNS
+        if corners:
+            flat = self.corners.reshape(-1, 8)
+            data.update(zip(CORNER_COLUMNS, flat.T))
+            columns = COLUMNS + CORNER_COLUMNS
+        return pd.DataFrame(data, columns=columns)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """ Create from a dataframe written by to_dataframe"""
+        results = cls(max(len(df), 1))
+        results.size = len(df)
+        results._frames[:len(df)] = df['frame'] if 'frame' in df else 0
+        results._ids[:len(df)] = df['id']
+        results._tvecs[:len(df)] = df[['tx', 'ty', 'tz']]
+        results._rvecs[:len(df)] = df[['rx', 'ry', 'rz']]
+        if set(CORNER_COLUMNS) <= set(df.columns):
+            results._corners[:len(df)] = df[CORNER_COLUMNS].values.reshape(-1, 4, 2)
+        else:
+            results._corners[:len(df)] = np.nan
+        return results
+
+    def save(self, filename):
+        """ Save all columns to a compressed .npz file"""
+        np.savez_compressed(
+            filename, frames=self.frames, ids=self.ids,
+            tvecs=self.tvecs, rvecs=self.rvecs, corners=self.corners
+        )
+
+    @classmethod
+    def load(cls, filename):
+        """ Load a file written by save"""
+        with np.load(filename) as data:
+            results = cls(max(len(data['ids']), 1))
+            results.size = len(data['ids'])
+            results._frames[:results.size] = data['frames']
+            results._ids[:results.size] = data['ids']
+            results._tvecs[:results.size] = data['tvecs']
+            results._rvecs[:results.size] = data['rvecs']
+            results._corners[:results.size] = data['corners']
+        return results
+
+    def write(self, filename, corners=False):
+        """ Write to a .parquet, .feather or (default) csv file"""
+        df = self.to_dataframe(corners)
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in PARQUET_EXTENSIONS:
+            df.to_parquet(filename, index=False)
+        elif extension in FEATHER_EXTENSIONS:
+            df.to_feather(filename)
+        else:
+            df.to_csv(filename, index=False)
+
+
+def read_results(filename):
+    """ Read a file written by MarkerResults.write"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in PARQUET_EXTENSIONS:
+        df = pd.read_parquet(filename)
+    elif extension in FEATHER_EXTENSIONS:
+        df = pd.read_feather(filename)
+    else:
+        df = pd.read_csv(filename)
+    return MarkerResults.from_dataframe(df)
+
+
+class ResultsWriter:
+    """
+    Append detections to a csv file (or open stream) frame by frame, so
+    results are written as they are found instead of kept in memory.
+    """
+
+    def __init__(self, output, corners=False):
+        self.corners = corners
+        self.header = True
+        if isinstance(output, str):
+            assert is_csv(output), 'ResultsWriter only writes csv files'
+            self.stream = open(output, 'w', newline='')
+            self.owned = True
+        else:
+            self.stream = output
+            self.owned = False
+
+    def append(self, frame, ids, rvecs, tvecs, corners):
+        """ Write the markers found in one frame"""
+        results = MarkerResults(0 if ids is None else len(ids))
+        results.append(frame, ids, rvecs, tvecs, corners)
+        self.write(results)
+
+    def write(self, results):
+        """ Write all rows of a MarkerResults"""
+        if not len(results) and not self.header:
+            return
+        results.to_dataframe(self.corners).to_csv(
+            self.stream, header=self.header, index=False
+        )
+        self.stream.flush()
+        self.header = False
+
+    def close(self):
+        if self.owned:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
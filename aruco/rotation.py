@@ -0,0 +1,163 @@
+import numpy as np
+
+
+# Below this angle the first order approximations are used
+EPSILON = 1e-12
+
+
+def rotation_matrices(rvecs):
+    """
+    Given (N, 3) rotation vectors, return the (N, 3, 3) rotation matrices.
+    Same result as cv2.Rodrigues on each row.
+    """
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(rvecs, axis=1)
+    small = theta < EPSILON
+    axis = rvecs / np.where(small, 1.0, theta)[:, None]
+    k = cross_matrices(axis)
+    sin = np.sin(theta)[:, None, None]
+    cos = np.cos(theta)[:, None, None]
+    mats = np.eye(3) + sin * k + (1 - cos) * np.matmul(k, k)
+    mats[small] = np.eye(3)
+    return mats
+
+
+def cross_matrices(vectors):
+    """ Given (N, 3) vectors v, return the (N, 3, 3) matrices of v x"""
+    x, y, z = np.asarray(vectors, dtype=np.float64).reshape(-1, 3).T
+    zero = np.zeros_like(x)
+    return np.stack((
+        np.stack((zero, -z, y), axis=1),
+        np.stack((z, zero, -x), axis=1),
+        np.stack((-y, x, zero), axis=1),
+    ), axis=1)
+
+
+def right_jacobians(rvecs, mats=None):
+    """
+    Given (N, 3) rotation vectors r, return the (N, 3, 3) right Jacobians
+    J of the rotations R, so that the derivative of R v with respect to r
+    is -R [v]x J
+    """
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+    if mats is None:
+        mats = rotation_matrices(rvecs)
+    theta2 = np.sum(rvecs ** 2, axis=1)
+    small = theta2 < EPSILON ** 2
+    outer = rvecs[:, :, None] * rvecs[:, None, :]
+    jacs = (outer + np.matmul(np.transpose(mats, (0, 2, 1)) - np.eye(3), cross_matrices(rvecs))) / \
+        np.where(small, 1.0, theta2)[:, None, None]
+    jacs[small] = np.eye(3)
+    return jacs
+
+
+def rotation_vectors(mats):
+    """
+    Given (N, 3, 3) rotation matrices, return the (N, 3) rotation vectors.
+    Inverse of rotation_matrices.
+    """
+    mats = np.asarray(mats, dtype=np.float64).reshape(-1, 3, 3)
+    trace = np.trace(mats, axis1=1, axis2=2)
+    # Axis from the skew symmetric part, whose norm is 2 sin(theta)
+    skew = np.stack((
+        mats[:, 2, 1] - mats[:, 1, 2],
+        mats[:, 0, 2] - mats[:, 2, 0],
+        mats[:, 1, 0] - mats[:, 0, 1],
+    ), axis=1)
+    sin = np.linalg.norm(skew, axis=1) / 2
+    theta = np.arctan2(sin, (trace - 1) / 2)
+    small = sin < 1e-6
+    rvecs = skew * np.where(small, 0.5, theta / (2 * np.where(small, 1.0, sin)))[:, None]
+
+    # Close to pi the skew part vanishes, use the symmetric part instead
+    near_pi = small & (theta > np.pi / 2)
+    if near_pi.any():
+        sym = (mats[near_pi] + np.eye(3)) / 2
+        diag = np.clip(np.diagonal(sym, axis1=1, axis2=2), 0.0, None)
+        axis = np.sqrt(diag)
+        # Fix relative signs from the off diagonal elements
+        largest = np.argmax(diag, axis=1)
+        rows = sym[np.arange(len(sym)), largest]
+        axis = np.copysign(axis, rows)
+        axis /= np.linalg.norm(axis, axis=1, keepdims=True)
+        rvecs[near_pi] = axis * theta[near_pi, None]
+    return rvecs
+
+
+def normals(rvecs, normal=(0, 0, 1)):
+    """ Given (N, 3) rotation vectors, return (N, 3) rotated normals"""
+    return np.matmul(rotation_matrices(rvecs), np.asarray(normal, dtype=np.float64))
+
+
+def angles_between(a, b):
+    """ Given (N, 3) vectors a and (N, 3) or (3,) vectors b, return angles"""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    cos = np.sum(a * b, axis=-1) / (
+        np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1)
+    )
+    return np.arccos(np.clip(cos, -1.0, 1.0))
+
+
+def rotations_between(a, b):
+    """
+    Given (N, 3) unit vectors a and (N, 3) or (3,) unit vectors b, return
+    the (N, 3) rotation vectors of the shortest rotations taking a to b.
+    """
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    axis = np.cross(a, b)
+    norm = np.linalg.norm(axis, axis=-1, keepdims=True)
+    angles = angles_between(a, b)
+    # Opposite vectors turn around any axis perpendicular to a, here the
+    # one from the basis vector least aligned with a
+    opposite = (norm[..., 0] < EPSILON) & (angles > np.pi / 2)
+    if opposite.any():
+        basis = np.eye(3)[np.argmin(np.abs(a[opposite]), axis=-1)]
+        axis[opposite] = np.cross(a[opposite], basis)
+        norm[opposite] = np.linalg.norm(axis[opposite], axis=-1, keepdims=True)
+    axis = axis / np.where(norm < EPSILON, 1.0, norm)
+    return axis * angles[..., None]
+
+
+def rotate(rvecs, vectors):
+    """ Rotate (N, 3) or (3,) vectors by (N, 3) rotation vectors"""
+    vectors = np.broadcast_to(np.asarray(vectors, dtype=np.float64), (len(rvecs), 3))
+    return np.einsum('nij,nj->ni', rotation_matrices(rvecs), vectors)
+
+
+def rotations_around_axis(rvecs, normal=(0, 0, 1), new_normal=(0, 0, -1), reference=(1, 0, 0)):
+    """
+    Given (N, 3) rotation vectors, rotate each rotated normal the shortest
+    way to new_normal, and measure the remaining rotation around it by the
+    angle the reference vector ends up at.
+    Return (angle around new normal, angle to new normal) as two (N,) arrays.
+    """
+    rot_mats = rotation_matrices(rvecs)
+    current_normals = np.matmul(rot_mats, np.asarray(normal, dtype=np.float64))
+    angle_to_normal = angles_between(current_normals, new_normal)
+    to_normal = rotations_between(current_normals, new_normal)
+    reference = np.asarray(reference, dtype=np.float64)
+    new_reference = rotate(to_normal, np.matmul(rot_mats, reference))
+    angle_around = angles_between(new_reference, reference)
+    return angle_around, angle_to_normal
+
+
+def quaternions(rvecs):
+    """ Given (N, 3) rotation vectors, return (N, 4) unit quaternions (w, x, y, z)"""
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(rvecs, axis=1)
+    # sin(theta / 2) / theta, tending to 1/2
+    scale = np.where(theta < EPSILON, 0.5, np.sin(theta / 2) / np.where(theta < EPSILON, 1.0, theta))
+    return np.column_stack((np.cos(theta / 2), rvecs * scale[:, None]))
+
+
+def quaternion_rotation_vectors(quats):
+    """ Given (N, 4) quaternions (w, x, y, z), return (N, 3) rotation vectors"""
+    quats = np.asarray(quats, dtype=np.float64).reshape(-1, 4)
+    quats = quats / np.linalg.norm(quats, axis=1, keepdims=True)
+    # Same rotation with w >= 0, so theta <= pi
+    quats = quats * np.where(quats[:, :1] < 0, -1.0, 1.0)
+    sin = np.linalg.norm(quats[:, 1:], axis=1)
+    theta = 2 * np.arctan2(sin, quats[:, 0])
+    scale = np.where(sin < EPSILON, 2.0, theta / np.where(sin < EPSILON, 1.0, sin))
+    return quats[:, 1:] * scale[:, None]
@@ -0,0 +1,400 @@
+import argparse
+import base64
+import collections
+import concurrent.futures
+import http.server
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detector import Detector, UNDISTORT_MODES, UNDISTORT_REMAP
+from aruco.map_cache import UndistortMapCache, default_cache_dir
+from aruco.read import read_detector_params
+from aruco.registry import CalibrationRegistry
+
+
+class LatencyCounters:
+    """
+    Thread safe request counters, with latency percentiles over the most
+    recent requests of each kind
+    """
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.window = window
+        self.started = time.time()
+        self.counts = collections.Counter()
+        self.errors = collections.Counter()
+        self.latencies = {}
+
+    def record(self, name, seconds, error=False):
+        with self.lock:
+            self.counts[name] += 1
+            if error:
+                self.errors[name] += 1
+            if name not in self.latencies:
+                self.latencies[name] = collections.deque(maxlen=self.window)
+            self.latencies[name].append(seconds * 1000)
+
+    def snapshot(self):
+        with self.lock:
+            stats = {'uptime': time.time() - self.started}
+            for name, latencies in self.latencies.items():
+                latencies = np.array(latencies)
+                stats[name] = {
+                    'count': self.counts[name],
+                    'errors': self.errors[name],
+                    'mean_ms': float(latencies.mean()),
+                    'p50_ms': float(np.percentile(latencies, 50)),
+                    'p95_ms': float(np.percentile(latencies, 95)),
+                    'max_ms': float(latencies.max()),
+                }
+            return stats
+
+
+def decode_image(data):
+    """ Decode the bytes of an encoded image file (jpeg, png, ...)"""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError('Could not decode image')
+    return img
+
+
+def parse_request(data):
+    """
+    Decode a JSON request, ValueError unless it is an object whose paths
+    and images are lists of strings
+    """
+    request = json.loads(data)
+    if not isinstance(request, dict):
+        raise ValueError('Request must be a JSON object')
+    for name in ('paths', 'images'):
+        values = request.get(name, [])
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError('{} must be a list of strings'.format(name))
+    return request
+
+
+class DetectionService:
+    """
+    Detect markers with detectors kept warm between requests, one per
+    calibration. With a camera file every frame must match its size;
+    otherwise the calibration matching each frame is taken from a
+    CalibrationRegistry.
+
+    A request is a dict with a list of 'paths' of image files and/or
+    'images' of base64 encoded image files. Frames of a request are
+    processed concurrently by a thread pool. The response has a list of
+    'frames' in request order, each with its markers (id, rvec, tvec and
+    optionally corners) or an error.
+    """
+
+    def __init__(self, detector_params, dictionary, marker_length, camera_file=None,
+                 registry=None, map_cache=None, undistort_mode=UNDISTORT_REMAP, workers=None):
+        assert camera_file is not None or registry is not None
+        self.detector_params = detector_params
+        self.dictionary = dictionary
+        self.marker_length = float(marker_length)
+        self.undistort_mode = undistort_mode
+        self.registry = registry
+        self.lock = threading.Lock()
+        self.detectors = {}
+        self.detector = None
+        if camera_file is not None:
+            self.detector = self.make_detector(
+                read_camera_parameters(camera_file, map_cache=map_cache)
+            )
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers or os.cpu_count())
+        self.counters = LatencyCounters()
+
+    def make_detector(self, cam_params):
+        return Detector(
+            cam_params, self.detector_params, self.dictionary, self.marker_length,
+            undistort_mode=self.undistort_mode
+        )
+
+    def warm(self):
+        """ Create detectors, with their maps, for every registry calibration"""
+        if self.registry is not None:
+            for width, height in self.registry.sizes():
+                self.detector_for_size(height, width)
+
+    def detector_for_size(self, height, width):
+        if self.detector is not None:
+            if self.detector.cam_params.size != (height, width):
+                raise ValueError('Frame size {}x{} does not match the calibration {}x{}'.format(
+                    width, height, *self.detector.cam_params.size[::-1]))
+            return self.detector
+        # Creating a detector may compute maps, do it once
+        with self.lock:
+            cam_params = self.registry.for_size(width, height)
+            if cam_params.calibration_hash not in self.detectors:
+                self.detectors[cam_params.calibration_hash] = self.make_detector(cam_params)
+            return self.detectors[cam_params.calibration_hash]
+
+    def detect(self, img, corners=False):
+        """ Return a list of dicts of the markers found in img"""
+        detector = self.detector_for_size(*img.shape[:2])
+        found_corners, ids, _ = detector.detect(img)
+        if ids is None or not ids.size:
+            return []
+        rvecs, tvecs = detector.estimate_poses(found_corners)
+        markers = []
+        for i, marker_id in enumerate(ids[:, 0]):
+            marker = {
+                'id': int(marker_id),
+                'rvec': rvecs[i].ravel().tolist(),
+                'tvec': tvecs[i].ravel().tolist(),
+            }
+            if corners:
+                marker['corners'] = found_corners[i].reshape(4, 2).tolist()
+            markers.append(marker)
+        return markers
+
+    def _frame(self, source, load, corners):
+        start = time.perf_counter()
+        result = {'source': source}
+        try:
+            result['markers'] = self.detect(load(), corners)
+        except Exception as exc:
+            result['error'] = str(exc)
+        elapsed = time.perf_counter() - start
+        result['latency_ms'] = elapsed * 1000
+        self.counters.record('frame', elapsed, 'error' in result)
+        return result
+
+    def _load_path(self, path):
+        img = cv2.imread(path)
+        if img is None:
+            raise IOError('Could not read image {}'.format(path))
+        return img
+
+    def process(self, request):
+        """ Process a request dict, return the response dict"""
+        start = time.perf_counter()
+        corners = bool(request.get('corners', False))
+        tasks = [
+            (path, lambda path=path: self._load_path(path))
+            for path in request.get('paths', [])
+        ]
+        tasks.extend(
+            ('image{}'.format(i), lambda data=data: decode_image(base64.b64decode(data)))
+            for i, data in enumerate(request.get('images', []))
+        )
+        frames = list(self.pool.map(lambda task: self._frame(*task, corners), tasks))
+        self.counters.record('request', time.perf_counter() - start)
+        return {'frames': frames}
+
+    def process_image(self, img, corners=False):
+        """ Process a single decoded frame, return the response dict"""
+        start = time.perf_counter()
+        frame = self._frame('image', lambda: img, corners)
+        self.counters.record('request', time.perf_counter() - start)
+        return {'frames': [frame]}
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class _HTTPHandler(http.server.BaseHTTPRequestHandler):
+    """
+    GET /stats returns the latency counters. POST /detect takes a JSON
+    request, or a single encoded image with an image/* content type.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, self.server.service.counters.snapshot())
+        elif self.path == '/health':
+            self._send(200, {'ok': True})
+        else:
+            self._send(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path != '/detect':
+            self._send(404, {'error': 'Not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            # The body cannot be skipped, so the connection is dropped
+            self.close_connection = True
+            self._send(400, {'error': 'Invalid Content-Length'})
+            return
+        data = self.rfile.read(length)
+        content_type = self.headers.get('Content-Type', 'application/json')
+        service = self.server.service
+        try:
+            if content_type.startswith('image/'):
+                corners = 'corners' in self.headers.get('X-Options', '')
+                response = service.process_image(decode_image(data), corners)
+            else:
+                response = service.process(parse_request(data))
+        except ValueError as exc:
+            self._send(400, {'error': str(exc)})
+            return
+        self._send(200, response)
+
+    def log_message(self, format, *args):
+        # Requests are counted, not logged
+        pass
+
+
+class _UnixHandler(socketserver.StreamRequestHandler):
+    """
+    One JSON request per line, answered by one JSON line. A request with
+    'stats' set returns the latency counters.
+    """
+
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = parse_request(line)
+                if request.get('stats'):
+                    response = service.counters.snapshot()
+                else:
+                    response = service.process(request)
+            except ValueError as exc:
+                response = {'error': str(exc)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(service, port=None, socket_path=None, host='127.0.0.1'):
+    """
+    Serve requests over localhost HTTP and/or a Unix socket, each client
+    in its own thread, until interrupted. Return after shutdown.
+    """
+    servers = []
+    if port is not None:
+        server = http.server.ThreadingHTTPServer((host, port), _HTTPHandler)
+        servers.append(server)
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = _ThreadingUnixServer(socket_path, _UnixHandler)
+        servers.append(server)
+    assert servers, 'Give a port, a socket path or both'
+
+    threads = []
+    for server in servers:
+        server.service = service
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        threads.append(thread)
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def request_unix(socket_path, request):
+    """ Send one request to a service Unix socket, return the response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        stream = sock.makefile('rwb')
+        stream.write(json.dumps(request).encode() + b'\n')
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve marker detection over localhost HTTP or a Unix socket.')
+    parser.add_argument('-c', '--camera-file', required=False,
+                        dest='camera_file', type=str, nargs=1, default=[None],
+                        help='camera file (default: the calibration in '
+                             '--calibration-dir matching each frame size)')
+    parser.add_argument('--calibration-dir', required=False,
+                        dest='calibration_dir', type=str, nargs=1,
+                        default=['calibration'],
+                        help='directory with calibration files')
+    parser.add_argument('-d', '--dictionary', required=True,
+                        dest='dictionary', type=int, nargs=1,
+                        help='dictionary')
+    parser.add_argument('-dp', '--detector-params', required=True,
+                        dest='detect_params', type=str, nargs=1,
+                        help='detector parameters')
+    parser.add_argument('-l', '--length', required=False,
+                        type=float, nargs=1, default=[1.0],
+                        help='marker length')
+    parser.add_argument('-u', '--undistort', required=False,
+                        dest='undistort_mode', type=str, nargs=1,
+                        choices=UNDISTORT_MODES, default=[UNDISTORT_REMAP],
+                        help='undistort the whole image or only the corners')
+    parser.add_argument('-p', '--port', required=False,
+                        type=int, nargs=1, default=[None],
+                        help='localhost HTTP port')
+    parser.add_argument('-s', '--socket', required=False,
+                        type=str, nargs=1, default=[None],
+                        help='Unix socket path')
+    parser.add_argument('-j', '--workers', required=False,
+                        type=int, nargs=1, default=[None],
+                        help='threads processing frames (default: all cores)')
+    parser.add_argument('--map-cache', required=False,
+                        dest='map_cache', type=str, nargs=1,
+                        default=[default_cache_dir()],
+                        help='undistortion map cache directory')
+    args = parser.parse_args()
+
+    if args.port[0] is None and args.socket[0] is None:
+        parser.error('give --port, --socket or both')
+
+    map_cache = UndistortMapCache(args.map_cache[0])
+    registry = None
+    if args.camera_file[0] is None:
+        registry = CalibrationRegistry(args.calibration_dir[0], map_cache=map_cache)
+    service = DetectionService(
+        read_detector_params(args.detect_params[0]),
+        cv2.aruco.getPredefinedDictionary(args.dictionary[0]), args.length[0],
+        camera_file=args.camera_file[0], registry=registry, map_cache=map_cache,
+        undistort_mode=args.undistort_mode[0], workers=args.workers[0]
+    )
+    # Build every detector before the first request
+    service.warm()
+    # Clean up the socket on kill too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print('Serving on{}{}'.format(
+        ' http://127.0.0.1:{}'.format(args.port[0]) if args.port[0] is not None else '',
+        ' unix:{}'.format(args.socket[0]) if args.socket[0] is not None else ''
+    ), flush=True)
+    try:
+        serve(service, args.port[0], args.socket[0])
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
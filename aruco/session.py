@@ -0,0 +1,247 @@
+import argparse
+import collections
+import json
+import os
+import re
+import cv2
+import numpy as np
+import pandas as pd
+from aruco.images import list_images
+from aruco.pipeline import Pipeline, PipelineStage
+from aruco.registry import CalibrationRegistry
+
+
+FRAMES = 'frames.bin'
+INDEX = 'index.json'
+VERSION = 1
+
+# Frames start on page boundaries, so every frame maps to whole pages
+ALIGNMENT = 4096
+
+# Names of RaspiPhotos.py captures, img{i}_{RES}.jpg
+CAPTURE_PATTERN = re.compile(r'img(\d+)_(\w+)\.\w+$')
+
+# Labels of the capture sizes of RaspiPhotos.py, by (width, height)
+RESOLUTION_NAMES = {
+    (320, 240): 'LOW',
+    (2048, 1536): 'MP3',
+    (2592, 1944): 'MP5',
+    (3280, 2464): 'MP8',
+}
+
+SessionFrame = collections.namedtuple(
+    'SessionFrame', ['index', 'timestamp', 'resolution', 'calibration', 'image']
+)
+
+
+def is_session(path):
+    """ Whether path is a session directory"""
+    return (os.path.isfile(os.path.join(path, INDEX)) and
+            os.path.isfile(os.path.join(path, FRAMES)))
+
+
+class SessionWriter:
+    """
+    Write decoded frames into a new session directory: the uint8 pixels
+    of all frames in one file, frames.bin, and their shape, offset and
+    metadata in index.json. The index is written on close.
+    """
+
+    def __init__(self, path, gray=False):
+        if os.path.exists(os.path.join(path, INDEX)):
+            raise FileExistsError('Session {} exists'.format(path))
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.gray = gray
+        self.frames = []
+        self.stream = open(os.path.join(path, FRAMES), 'wb')
+
+    def append(self, img, resolution=None, timestamp=None, calibration=None, source=None):
+        """
+        Add a frame. resolution is a label like 'MP3', calibration the hash
+        of its calibration file and source the file it was decoded from.
+        """
+        if self.gray and img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        position = self.stream.tell()
+        offset = (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        self.stream.seek(offset)
+        self.stream.write(img.data)
+        height, width = img.shape[:2]
+        self.frames.append({
+            'offset': offset,
+            'shape': list(img.shape),
+            'resolution': resolution or RESOLUTION_NAMES.get(
+                (width, height), '{}x{}'.format(width, height)
+            ),
+            'timestamp': timestamp,
+            'calibration': calibration,
+            'source': source,
+        })
+
+    def close(self):
+        self.stream.close()
+        tmp = os.path.join(self.path, INDEX + '.tmp')
+        with open(tmp, 'w') as stream:
+            json.dump({'version': VERSION, 'frames': self.frames}, stream, indent=1)
+        os.replace(tmp, os.path.join(self.path, INDEX))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        # A failed conversion leaves no index, so it is not a session
+        if exc_type is None:
+            self.close()
+        else:
+            self.stream.close()
+
+
+class Session:
+    """
+    Read only, memory-mapped view of a session directory.
+
+    session[i] is an array viewing the pixels of frame i in the mapped
+    file, so nothing is decoded or copied until it is used, and processes
+    reading the same session share the pages.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX)) as stream:
+            index = json.load(stream)
+        assert index['version'] == VERSION
+        self.frames = index['frames']
+        size = os.path.getsize(os.path.join(path, FRAMES))
+        # np.memmap cannot map an empty file
+        self.data = np.memmap(os.path.join(path, FRAMES), dtype=np.uint8, mode='r') \
+            if size else np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        frame = self.frames[index]
+        count = int(np.prod(frame['shape']))
+        return self.data[frame['offset']:frame['offset'] + count].reshape(frame['shape'])
+
+    def resolutions(self):
+        """ Resolution labels in order of first appearance"""
+        return list(dict.fromkeys(frame['resolution'] for frame in self.frames))
+
+    def select(self, resolution=None):
+        """ Indices of the frames of a resolution, or of all frames"""
+        return [
+            i for i, frame in enumerate(self.frames)
+            if resolution is None or frame['resolution'] == resolution
+        ]
+
+    def images(self, resolution=None):
+        """ Views of the frames of a resolution, or of all frames, in order"""
+        for i in self.select(resolution):
+            yield self[i]
+
+    def iter_frames(self, resolution=None):
+        """ Yield a SessionFrame for every frame of a resolution, or all"""
+        for i in self.select(resolution):
+            frame = self.frames[i]
+            yield SessionFrame(
+                i, frame['timestamp'], frame['resolution'], frame['calibration'], self[i]
+            )
+
+    def to_dataframe(self):
+        """ Return the frame metadata as a dataframe"""
+        df = pd.DataFrame(self.frames)
+        df['height'] = [shape[0] for shape in df['shape']]
+        df['width'] = [shape[1] for shape in df['shape']]
+        df['channels'] = [shape[2] if len(shape) > 2 else 1 for shape in df['shape']]
+        return df.drop(columns='shape')
+
+
+def capture_order(filename):
+    """ Sort key of capture files: shot number, then file name"""
+    match = CAPTURE_PATTERN.search(os.path.basename(filename))
+    return (int(match.group(1)) if match else -1, os.path.basename(filename))
+
+
+def convert_images(paths, output, gray=False, registry=None, workers=2):
+    """
+    Decode images, or the images of directories, into a new session.
+    Captures named img{i}_{RES}.jpg are ordered by shot. Frames are
+    labelled with the resolution of their size, not of their name, so a
+    preview frame saved under an MP3 name is not taken for one.
+    Timestamps are the file modification times, and
+    calibrations are looked up by image size in a CalibrationRegistry.
+    Return the number of frames.
+    """
+    filenames = sorted(list_images(paths), key=capture_order)
+
+    def decode(filename):
+        img = cv2.imread(filename, cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR)
+        if img is None:
+            raise IOError('Could not read image {}'.format(filename))
+        return filename, img
+
+    # Decode in parallel, write in order
+    pipeline = Pipeline([PipelineStage('imread', decode, workers)])
+    with SessionWriter(output, gray) as writer:
+        for filename, img in pipeline.run(filenames):
+            height, width = img.shape[:2]
+            calibration = None
+            if registry is not None:
+                entry = registry.find(width, height)
+                calibration = entry.hash if entry is not None else None
+            writer.append(
+                img, timestamp=os.path.getmtime(filename), calibration=calibration,
+                source=os.path.abspath(filename)
+            )
+    return len(filenames)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Store decoded captures in one memory-mapped session file.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert = subparsers.add_parser(
+        'convert', help='decode image files into a new session')
+    convert.add_argument('output', type=str, nargs=1,
+                         help='session directory to create')
+    convert.add_argument('images', metavar='image', type=str, nargs='+',
+                         help='image files or directories')
+    convert.add_argument('--gray', required=False,
+                         dest='gray',
+                         action='store_true', default=False,
+                         help='store grayscale frames')
+    convert.add_argument('--calibration-dir', required=False,
+                         dest='calibration_dir', type=str, nargs=1,
+                         default=['calibration'],
+                         help='directory with calibration files')
+    convert.add_argument('-j', '--workers', required=False,
+                         dest='workers', type=int, nargs=1, default=[2],
+                         help='decoding threads')
+
+    info = subparsers.add_parser(
+        'info', help='list the frames of a session')
+    info.add_argument('session', type=str, nargs=1,
+                      help='session directory')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        count = convert_images(
+            args.images, args.output[0], gray=args.gray,
+            registry=CalibrationRegistry(args.calibration_dir[0]),
+            workers=args.workers[0]
+        )
+        print('Stored {} frames in {}'.format(count, args.output[0]))
+        return
+
+    session = Session(args.session[0])
+    df = session.to_dataframe()
+    print(df.drop(columns='source').to_string())
+    print(df.groupby('resolution').size())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import cv2
+import numpy as np
+from .rotation import rotation_matrices
+
+
+# Pixels per marker side in the texture markers are sampled from
+TEXTURE_SIZE = 240
+
+
+def marker_object_points(marker_length):
+    """ Corners of a marker in its own frame, in estimatePoseSingleMarkers order"""
+    half = marker_length / 2
+    return np.array([
+        [-half, half, 0], [half, half, 0], [half, -half, 0], [-half, -half, 0]
+    ], dtype=np.float64)
+
+
+def pixel_rays(cam_params):
+    """
+    Return a (height, width, 2) map of the normalized ray of every pixel
+    of the distorted image
+    """
+    height, width = cam_params.size
+    xs, ys = np.meshgrid(
+        np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64)
+    )
+    points = np.stack((xs, ys), axis=-1).reshape(-1, 1, 2)
+    if cam_params.use_fisheye:
+        rays = cv2.fisheye.undistortPoints(points, cam_params.cam_mat, cam_params.dist_coeffs)
+    else:
+        rays = cv2.undistortPoints(points, cam_params.cam_mat, cam_params.dist_coeffs)
+    return rays.reshape(height, width, 2).astype(np.float32)
+
+
+def project_points(cam_params, points, rvec=np.zeros(3), tvec=np.zeros(3)):
+    """ Project (N, 3) points to pixels of the distorted image"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 3)
+    rvec = np.asarray(rvec, dtype=np.float64).reshape(3, 1)
+    tvec = np.asarray(tvec, dtype=np.float64).reshape(3, 1)
+    if cam_params.use_fisheye:
+        projected, _ = cv2.fisheye.projectPoints(
+            points, rvec, tvec, cam_params.cam_mat, cam_params.dist_coeffs
+        )
+    else:
+        projected, _ = cv2.projectPoints(
+            points, rvec, tvec, cam_params.cam_mat, cam_params.dist_coeffs
+        )
+    return projected.reshape(-1, 2)
+
+
+class SceneRenderer:
+    """
+    Render markers at known poses as seen through a calibrated camera,
+    including its (fisheye) distortion.
+
+    Every distorted pixel is traced back along its ray to the plane of
+    each marker, so the result is exact for the camera model.
+    """
+
+    def __init__(self, cam_params, dictionary, marker_length):
+        self.cam_params = cam_params
+        self.dictionary = dictionary
+        self.marker_length = marker_length
+        self.rays = pixel_rays(cam_params)
+        self.textures = {}
+
+    def texture(self, marker_id):
+        if marker_id not in self.textures:
+            self.textures[marker_id] = cv2.aruco.drawMarker(
+                self.dictionary, int(marker_id), TEXTURE_SIZE
+            )
+        return self.textures[marker_id]
+
+    def corners(self, rvec, tvec):
+        """ Ground truth (4, 2) corners of a marker in the distorted image"""
+        return project_points(
+            self.cam_params, marker_object_points(self.marker_length), rvec, tvec
+        )
+
+    def render(self, ids, rvecs, tvecs, background=255, noise=0.0, blur=0.0, rng=None):
+        """
+        Render markers with the given ids and (N, 3) poses into a color
+        image of the camera size
+        """
+        height, width = self.cam_params.size
+        img = np.full((height, width), background, dtype=np.uint8)
+        half = self.marker_length / 2
+        scale = TEXTURE_SIZE / self.marker_length
+        for marker_id, rot_mat, tvec in zip(ids, rotation_matrices(rvecs), np.reshape(tvecs, (-1, 3))):
+            corners = self.corners(cv2.Rodrigues(rot_mat)[0], tvec)
+            x0, y0 = np.maximum(np.floor(corners.min(axis=0)).astype(int) - 2, 0)
+            x1, y1 = np.minimum(np.ceil(corners.max(axis=0)).astype(int) + 3, (width, height))
+            if x0 >= x1 or y0 >= y1:
+                continue
+            # Homography from the marker plane to normalized coordinates
+            homography = np.column_stack((rot_mat[:, 0], rot_mat[:, 1], tvec))
+            inverse = np.linalg.inv(homography)
+            rays = self.rays[y0:y1, x0:x1]
+            plane = (
+                inverse[:, 0] * rays[..., :1] + inverse[:, 1] * rays[..., 1:] + inverse[:, 2]
+            )
+            # Marker plane coordinates to texture pixels, top left is (-half, half)
+            map_x = ((plane[..., 0] / plane[..., 2] + half) * scale - 0.5).astype(np.float32)
+            map_y = ((half - plane[..., 1] / plane[..., 2]) * scale - 0.5).astype(np.float32)
+            # Pixels outside the marker keep what is already drawn
+            region = img[y0:y1, x0:x1].copy()
+            cv2.remap(
+                self.texture(marker_id), map_x, map_y, cv2.INTER_LINEAR,
+                dst=region, borderMode=cv2.BORDER_TRANSPARENT
+            )
+            img[y0:y1, x0:x1] = region
+        if blur:
+            img = cv2.GaussianBlur(img, (0, 0), blur)
+        if noise:
+            rng = rng or np.random.default_rng()
+            img = np.clip(img + rng.normal(0, noise, img.shape), 0, 255).astype(np.uint8)
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+
+def floor_scene(rng, ids, marker_length=0.174, distance=(1.5, 2.5), spacing=2.5,
+                max_tilt=20.0, spread=0.6):
+    """
+    Random poses for markers lying on a floor seen from above: a jittered
+    grid on a plane at a random distance and tilt, with random rotation
+    of each marker in the plane. Return (N, 3) rvecs and tvecs.
+    """
+    ids = list(ids)
+    columns = int(np.ceil(np.sqrt(len(ids))))
+    rows = int(np.ceil(len(ids) / columns))
+    step = spacing * marker_length
+    # Plane pose: facing the camera, tilted by up to max_tilt degrees
+    tilt_axis = rng.normal(size=2)
+    tilt_axis = np.append(tilt_axis / np.linalg.norm(tilt_axis), 0)
+    tilt = np.radians(rng.uniform(0, max_tilt))
+    # Markers face the camera when rotated pi around x
+    plane_rot = rotation_matrices(tilt_axis * tilt)[0] @ rotation_matrices([np.pi, 0, 0])[0]
+    center = np.array([
+        *rng.uniform(-spread, spread, 2) * 0.2, rng.uniform(*distance)
+    ])
+
+    rvecs, tvecs = [], []
+    for i in range(len(ids)):
+        offset = np.array([
+            (i % columns - (columns - 1) / 2) * step,
+            (i // columns - (rows - 1) / 2) * step,
+            0,
+        ])
+        offset[:2] += rng.uniform(-0.2, 0.2, 2) * step
+        spin = rotation_matrices([0, 0, rng.uniform(-np.pi, np.pi)])[0]
+        rot_mat = plane_rot @ spin
+        rvecs.append(cv2.Rodrigues(rot_mat)[0].ravel())
+        tvecs.append(center + plane_rot @ offset)
+    return np.array(rvecs), np.array(tvecs)
@@ -0,0 +1,174 @@
+import argparse
+import time
+import cv2
+import numpy as np
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detector import Detector, marker_regions, UNDISTORT_MODES, UNDISTORT_REMAP
+from aruco.map_cache import UndistortMapCache, default_cache_dir
+from aruco.read import read_detector_params
+from aruco.results import MarkerResults
+
+
+class MarkerTracker:
+    """
+    Track markers in a sequence of frames from one camera.
+
+    Only padded regions around the corners found in the previous frame
+    are searched. A full frame search is done every full_search_interval
+    frames, and whenever a tracked marker is lost or nothing is tracked.
+    The latency of every frame is recorded.
+    """
+
+    def __init__(self, detector, full_search_interval=10, padding=0.5):
+        assert isinstance(detector, Detector)
+        self.detector = detector
+        self.full_search_interval = full_search_interval
+        self.padding = padding
+        self.regions = []
+        self.tracked = set()
+        self.frame = 0
+        self.since_full_search = 0
+        self.latencies = []
+        self.full_searches = []
+
+    def reset(self):
+        """ Forget tracked markers, so the next frame is searched fully"""
+        self.regions = []
+        self.tracked = set()
+
+    def detect(self, img):
+        """
+        Find markers in img. Return corners in undistorted image
+        coordinates, ids and whether the full frame was searched.
+        """
+        full_search = (
+            not self.regions or
+            self.since_full_search + 1 >= self.full_search_interval
+        )
+        if not full_search:
+            corners, ids, _ = self.detector.detect_regions(img, self.regions)
+            found = set() if ids is None else set(ids[:, 0])
+            # Lost a marker, search it everywhere
+            full_search = not self.tracked <= found
+        if full_search:
+            corners, ids, _ = self.detector.detect(img)
+            self.since_full_search = 0
+        else:
+            self.since_full_search += 1
+
+        if ids is None or not ids.size:
+            self.reset()
+        else:
+            # Regions to search in the next frame
+            height, width = self.detector.cam_params.size
+            points = self.detector.search_points(np.concatenate(corners))
+            self.regions = marker_regions(
+                points.reshape(-1, 4, 2), width, height, self.padding
+            )
+            self.tracked = set(ids[:, 0])
+        return corners, ids, full_search
+
+    def process(self, img, results=None):
+        """
+        Find markers in img and estimate their poses. Detections are
+        appended to results, which is created if not given.
+        """
+        if results is None:
+            results = MarkerResults()
+        start = time.perf_counter()
+        corners, ids, full_search = self.detect(img)
+        if ids is not None and ids.size:
+            rvecs, tvecs = self.detector.estimate_poses(corners)
+            results.append(self.frame, ids, rvecs, tvecs, corners)
+        self.latencies.append(time.perf_counter() - start)
+        self.detector.timer.end_frame(self.frame, 0 if ids is None else ids.size)
+        self.full_searches.append(full_search)
+        self.frame += 1
+        return results
+
+    def latency_summary(self):
+        """ Return latency statistics in milliseconds"""
+        latencies = np.array(self.latencies) * 1000
+        full = np.array(self.full_searches, dtype=bool)
+        summary = {}
+        for name, selected in (('all', latencies),
+                               ('full', latencies[full]),
+                               ('tracked', latencies[~full])):
+            if not len(selected):
+                continue
+            summary[name] = {
+                'frames': len(selected),
+                'mean': selected.mean(),
+                'p50': np.percentile(selected, 50),
+                'p95': np.percentile(selected, 95),
+                'max': selected.max(),
+            }
+        return summary
+
+
+def main():
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description='Track markers in a recorded image sequence.')
+    parser.add_argument('-c', '--camera-file', required=True,
+                        dest='camera_file', type=str, nargs=1,
+                        help='camera file')
+    parser.add_argument('-d', '--dictionary', required=True,
+                        dest='dictionary', type=int, nargs=1,
+                        help='dictionary')
+    parser.add_argument('-dp', '--detector-params', required=True,
+                        dest='detect_params', type=str, nargs=1,
+                        help='detector parameters')
+    parser.add_argument('-l', '--length', required=False,
+                        type=float, nargs=1, default=[1.0],
+                        help='marker length')
+    parser.add_argument('-n', '--full-search-interval', required=False,
+                        dest='interval', type=int, nargs=1, default=[10],
+                        help='search the full frame every n frames')
+    parser.add_argument('-u', '--undistort', required=False,
+                        dest='undistort_mode', type=str, nargs=1,
+                        choices=UNDISTORT_MODES, default=[UNDISTORT_REMAP],
+                        help='undistort the whole image or only the corners')
+    parser.add_argument('-o', '--output', required=False,
+                        dest='output', type=str, nargs=1,
+                        help='output file')
+    parser.add_argument('--map-cache', required=False,
+                        dest='map_cache', type=str, nargs=1,
+                        default=[default_cache_dir()],
+                        help='undistortion map cache directory')
+    parser.add_argument('images', metavar='image', type=str, nargs='+',
+                        help='image files, in capture order')
+    args = parser.parse_args()
+
+    cam_params = read_camera_parameters(
+        args.camera_file[0], map_cache=UndistortMapCache(args.map_cache[0])
+    )
+    detector = Detector(
+        cam_params, read_detector_params(args.detect_params[0]),
+        cv2.aruco.getPredefinedDictionary(args.dictionary[0]),
+        args.length[0], undistort_mode=args.undistort_mode[0]
+    )
+    tracker = MarkerTracker(detector, full_search_interval=args.interval[0])
+
+    results = MarkerResults()
+    for filename in args.images:
+        img = cv2.imread(filename)
+        if img is None:
+            raise IOError('Could not read image {}'.format(filename))
+        count = len(results)
+        tracker.process(img, results)
+        print('{} {:.1f} ms {} markers{}'.format(
+            filename, tracker.latencies[-1] * 1000, len(results) - count,
+            ' (full search)' if tracker.full_searches[-1] else ''
+        ))
+
+    for name, stats in tracker.latency_summary().items():
+        print('{:8} frames {frames:5} mean {mean:7.1f} ms  p50 {p50:7.1f} ms  '
+              'p95 {p95:7.1f} ms  max {max:7.1f} ms'.format(name, **stats))
+
+    if args.output:
+        results.write(args.output[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from aruco.benchmark import make_frames
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detector import Detector, UNDISTORT_MODES, UNDISTORT_CORNERS
+from aruco.images import list_images
+from aruco.map_cache import UndistortMapCache, default_cache_dir, file_hash
+from aruco.read import detector_params_from_dict, read_detector_params_dict
+from aruco.read import write_detector_params
+from aruco.results import read_results
+from aruco.synthetic import SceneRenderer
+
+
+# Candidate values of the parameters that set the work done per frame
+SEARCH_SPACE = {
+    'adaptiveThreshWinSizeMin': [3, 5, 7],
+    'adaptiveThreshWinSizeMax': [7, 13, 23, 33],
+    'adaptiveThreshWinSizeStep': [4, 10, 20, 30],
+    'cornerRefinementMaxIterations': [5, 10, 30, 100, 1000],
+    'cornerRefinementMinAccuracy': [0.01, 0.05, 0.1, 0.2],
+    'cornerRefinementWinSize': [2, 3, 5],
+    'perspectiveRemovePixelPerCell': [2, 4, 6, 8],
+    'minMarkerPerimeterRate': [0.01, 0.02, 0.03, 0.05],
+    'polygonalApproxAccuracyRate': [0.03, 0.05, 0.08],
+}
+
+
+class Dataset:
+    """
+    Images with the ids and corners of the markers they contain. Corners
+    are (N, 4, 2) pixels of the distorted image.
+    """
+
+    def __init__(self, cam_params, images, ids, corners, key):
+        self.cam_params = cam_params
+        self.images = images
+        self.ids = ids
+        self.corners = corners
+        # Identifies the images and labels in the trial cache
+        self.key = key
+
+    def __len__(self):
+        return len(self.images)
+
+    @classmethod
+    def synthetic(cls, cam_params, dictionary, marker_length, frames=5, markers=9, seed=0):
+        """ Rendered floor scenes, see aruco.synthetic"""
+        renderer = SceneRenderer(cam_params, dictionary, marker_length)
+        images, ids, corners = [], [], []
+        for img, scene_ids, rvecs, tvecs in make_frames(renderer, frames, markers, seed):
+            images.append(img)
+            ids.append(scene_ids)
+            corners.append(np.array([renderer.corners(r, t) for r, t in zip(rvecs, tvecs)]))
+        key = 'synthetic:{}:{}:{}:{}:{}'.format(
+            cam_params.calibration_hash, marker_length, frames, markers, seed
+        )
+        return cls(cam_params, images, ids, corners, key)
+
+    @classmethod
+    def labelled(cls, cam_params, filenames, labels):
+        """
+        Image files with a results file written with corners, e.g. by
+        detect_markers --corners on the same images and calibration, and
+        checked by hand. Frames are indices into filenames.
+        """
+        results = read_results(labels)
+        assert not np.isnan(results.corners).any(), 'labels need corner columns'
+        images = []
+        for filename in filenames:
+            img = cv2.imread(filename)
+            if img is None:
+                raise IOError('Could not read image {}'.format(filename))
+            images.append(img)
+        ids, corners = [], []
+        for frame in range(len(filenames)):
+            rows = results.frames == frame
+            ids.append(results.ids[rows])
+            points = to_distorted(cam_params, results.corners[rows])
+            corners.append(points.reshape(-1, 4, 2))
+        digest = hashlib.sha1()
+        for filename in [*filenames, labels]:
+            digest.update(file_hash(filename).encode())
+        key = 'labelled:{}:{}'.format(cam_params.calibration_hash, digest.hexdigest())
+        return cls(cam_params, images, ids, corners, key)
+
+
+def to_distorted(cam_params, points):
+    """ Undistorted image coordinates to pixels of the distorted image"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+    if not len(points):
+        return points.reshape(-1, 2)
+    rays = cam_params.points_to_rays(points)
+    return cam_params.rays_to_points(rays, distorted=True).reshape(-1, 2)
+
+
+def evaluate(params, dataset, dictionary, marker_length, undistort_mode=UNDISTORT_CORNERS,
+             repeat=3):
+    """
+    Detect markers in the dataset with the given detector parameters.
+    Return the mean time per frame in milliseconds, the fraction of
+    labelled markers found, the mean corner error in pixels and the
+    number of detected ids not in the labels.
+    """
+    detector = Detector(
+        dataset.cam_params, detector_params_from_dict(params), dictionary,
+        float(marker_length), undistort_mode=undistort_mode
+    )
+    elapsed = 0.0
+    found = expected = false = 0
+    errors = []
+    for img, ids, true_corners in zip(dataset.images, dataset.ids, dataset.corners):
+        # Best of repeat runs, to be less sensitive to other load
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            corners, found_ids, _ = detector.detect(img)
+            times.append(time.perf_counter() - start)
+        elapsed += min(times)
+
+        expected += len(ids)
+        if found_ids is None or not found_ids.size:
+            continue
+        truth = {marker_id: i for i, marker_id in enumerate(ids)}
+        points = to_distorted(dataset.cam_params, np.concatenate(corners)).reshape(-1, 4, 2)
+        for marker_id, detected in zip(found_ids[:, 0], points):
+            if marker_id not in truth:
+                false += 1
+                continue
+            found += 1
+            errors.extend(np.linalg.norm(detected - true_corners[truth[marker_id]], axis=1))
+
+    return {
+        'time': elapsed / len(dataset) * 1000,
+        'detection_rate': found / expected if expected else 0.0,
+        'corner_error': float(np.mean(errors)) if errors else None,
+        'false': false,
+    }
+
+
+def meets(result, detection_rate, corner_error):
+    return (
+        result['detection_rate'] >= detection_rate and
+        result['corner_error'] is not None and
+        result['corner_error'] <= corner_error and
+        not result['false']
+    )
+
+
+class TrialCache:
+    """
+    Results of evaluated parameter sets, appended to a json lines file so
+    an interrupted or repeated search reuses them. Times are only valid
+    on the machine they were measured on.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.trials = {}
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as stream:
+                for line in stream:
+                    if line.strip():
+                        trial = json.loads(line)
+                        self.trials[trial['key']] = trial['result']
+
+    @staticmethod
+    def key(params, dataset, undistort_mode):
+        text = json.dumps([dict(sorted(params.items())), dataset.key, undistort_mode])
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def get(self, key):
+        return self.trials.get(key)
+
+    def put(self, key, params, result):
+        self.trials[key] = result
+        if self.filename is not None:
+            with open(self.filename, 'a') as stream:
+                stream.write(json.dumps({'key': key, 'params': params, 'result': result}) + '\n')
+
+
+def tune(base_params, dataset, dictionary, marker_length, detection_rate=1.0,
+         corner_error=1.0, undistort_mode=UNDISTORT_CORNERS, search_space=SEARCH_SPACE,
+         rounds=2, repeat=3, min_gain=0.02, cache=None, log=None):
+    """
+    Coordinate descent over search_space, starting from base_params: each
+    parameter in turn is set to the candidate value giving the fastest
+    detection that still meets the detection rate and corner error
+    targets. Return the best parameters and their result; the result of
+    the base parameters is returned if no candidate meets the targets.
+    """
+    cache = cache or TrialCache()
+
+    def run(params):
+        key = cache.key(params, dataset, undistort_mode)
+        result = cache.get(key)
+        cached = result is not None
+        if not cached:
+            result = evaluate(params, dataset, dictionary, marker_length, undistort_mode, repeat)
+            cache.put(key, params, result)
+        if log is not None:
+            log(params, result, cached)
+        return result
+
+    def score(result):
+        # Feasible sets first, by time; others by rate and error
+        if meets(result, detection_rate, corner_error):
+            return (0, result['time'])
+        return (1, -result['detection_rate'], result['corner_error'] or np.inf)
+
+    best = dict(base_params)
+    best_result = run(best)
+    for _ in range(rounds):
+        changed = False
+        for name, values in search_space.items():
+            for value in values:
+                if best.get(name) == value:
+                    continue
+                params = dict(best, **{name: value})
+                # Skip inconsistent threshold windows
+                if params.get('adaptiveThreshWinSizeMin', 3) > params.get('adaptiveThreshWinSizeMax', 23):
+                    continue
+                result = run(params)
+                # Ignore speedups within timing noise
+                if score(result) < score(best_result) and not (
+                        meets(result, detection_rate, corner_error) and
+                        meets(best_result, detection_rate, corner_error) and
+                        result['time'] > best_result['time'] * (1 - min_gain)):
+                    best, best_result = params, result
+                    changed = True
+        if not changed:
+            break
+    return best, best_result
+
+
+def format_result(result):
+    error = result['corner_error']
+    return '{:8.2f} ms  rate {:5.3f}  error {} px  false {}'.format(
+        result['time'], result['detection_rate'],
+        '{:5.3f}'.format(error) if error is not None else '    -', result['false']
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Search for the fastest detector parameters that meet a '
+                    'detection rate and corner error.')
+    parser.add_argument('-c', '--camera-file', required=True,
+                        dest='camera_file', type=str, nargs=1,
+                        help='camera file')
+    parser.add_argument('-dp', '--detector-params', required=False,
+                        dest='detect_params', type=str, nargs=1,
+                        default=['detector_params.yaml'],
+                        help='detector parameters to start from')
+    parser.add_argument('-d', '--dictionary', required=False,
+                        dest='dictionary', type=int, nargs=1,
+                        default=[cv2.aruco.DICT_6X6_250],
+                        help='dictionary')
+    parser.add_argument('-l', '--length', required=False,
+                        type=float, nargs=1, default=[0.174],
+                        help='marker length')
+    parser.add_argument('-u', '--undistort', required=False,
+                        dest='undistort_mode', type=str, nargs=1,
+                        choices=UNDISTORT_MODES, default=[UNDISTORT_CORNERS],
+                        help='undistort mode to tune for')
+    parser.add_argument('--labels', required=False,
+                        dest='labels', type=str, nargs=1,
+                        help='results file with corners of the markers in the '
+                             'images; without it rendered scenes are used')
+    parser.add_argument('-f', '--frames', required=False,
+                        dest='frames', type=int, nargs=1, default=[5],
+                        help='rendered frames')
+    parser.add_argument('--rate', required=False,
+                        dest='rate', type=float, nargs=1, default=[1.0],
+                        help='minimum detection rate')
+    parser.add_argument('--error', required=False,
+                        dest='error', type=float, nargs=1, default=[1.0],
+                        help='maximum mean corner error in pixels')
+    parser.add_argument('--rounds', required=False,
+                        dest='rounds', type=int, nargs=1, default=[2],
+                        help='passes over all parameters')
+    parser.add_argument('--trials', required=False,
+                        dest='trials', type=str, nargs=1,
+                        default=['tune_trials.jsonl'],
+                        help='trial cache file')
+    parser.add_argument('-o', '--output', required=True,
+                        dest='output', type=str, nargs=1,
+                        help='output detector parameters file')
+    parser.add_argument('images', metavar='image', type=str, nargs='*',
+                        help='labelled images or directories')
+    args = parser.parse_args()
+
+    dictionary = cv2.aruco.getPredefinedDictionary(args.dictionary[0])
+    marker_length = args.length[0]
+    cam_params = read_camera_parameters(
+        args.camera_file[0], map_cache=UndistortMapCache(default_cache_dir())
+    )
+    if args.labels:
+        dataset = Dataset.labelled(cam_params, list_images(args.images), args.labels[0])
+    else:
+        dataset = Dataset.synthetic(cam_params, dictionary, marker_length, args.frames[0])
+
+    def log(params, result, cached):
+        print(format_result(result), '(cached)' if cached else '', flush=True)
+
+    base_params = read_detector_params_dict(args.detect_params[0])
+    params, result = tune(
+        base_params, dataset, dictionary, marker_length,
+        detection_rate=args.rate[0], corner_error=args.error[0],
+        undistort_mode=args.undistort_mode[0], rounds=args.rounds[0],
+        cache=TrialCache(args.trials[0]), log=log
+    )
+
+    print('Best:', format_result(result))
+    if not meets(result, args.rate[0], args.error[0]):
+        print('No parameters meet the targets', file=sys.stderr)
+        sys.exit(1)
+    for name in sorted(params):
+        if params[name] != base_params.get(name):
+            print('{}: {} -> {}'.format(name, base_params.get(name), params[name]))
+    write_detector_params(args.output[0], params)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import argparse
 import cv2
 import numpy as np
 import pandas as pd
+from aruco.rotation import normals, rotations_around_axis
 
 
 def normal_from_rotationvector(rot_vec):
@@ -15,9 +16,9 @@ def normal_from_rotationvector(rot_vec):
 
 def normals_from_rotationvectors(df):
     """ Given a dataframe of rotation vectors, return its normals"""
-    normals = df.apply(normal_from_rotationvector, raw=True, axis=1)
-    normals.columns = ['nx', 'ny', 'nz']
-    return normals
+    return pd.DataFrame(
+        normals(df.values), index=df.index, columns=['nx', 'ny', 'nz']
+    )
 
 
 def avg_vector(vectors):
@@ -71,7 +72,7 @@ def rotationvector_to_normal(rotation, new_normal):
 def rotate_rotation_to_new_normal(df, normal):
     """ Given a dataframe of rotation vectors, rotate their normals to a given directions"""
     #df_norms = normals_from_rotationvectors(df)
-    rot_vecs = df.apply(rotation_around_z, axis=1, raw=True)
+    rot_vecs = rotations_around_z(df)
     # print(df)
     # print(rot_vecs)
     #print(rot_vecs.apply(np.linalg.norm, axis=1, raw=True))
@@ -89,20 +90,20 @@ def rotation_around_z(rotation):
     Return a tuple of radians. First is rotation around new normal. Second is rotation to get
     to given normal.
     """
-    normal = (0, 0, 1)
-    new_normal = (0, 0, -1)
-    fst, _ = cv2.Rodrigues(rotation)
-    current_normal = np.matmul(fst, normal)
-    angle_to_normal = np.arccos(np.dot(current_normal, new_normal))
-    rot_axis = np.cross(current_normal, new_normal)
-    rot_axis = rot_axis * angle_to_normal / np.linalg.norm(rot_axis)
-    snd, _ = cv2.Rodrigues(rot_axis)
+    angle_around_z, angle_to_normal = rotations_around_axis([rotation])
+    return angle_around_z[0], angle_to_normal[0]
 
-    old_x = (1, 0, 0)
-    new_x = np.matmul(snd, np.matmul(fst, old_x))
-    angle_around_z = np.arccos(np.dot(old_x, new_x))
 
-    return angle_around_z, angle_to_normal
+def rotations_around_z(df):
+    """
+    Given a dataframe of rotation vectors, return a dataframe with the
+    results of rotation_around_z for every row.
+    """
+    angle_around_z, angle_to_normal = rotations_around_axis(df.values)
+    return pd.DataFrame(
+        {'rotation_z': angle_around_z, 'rotation_to_normal': angle_to_normal},
+        index=df.index
+    )
 
 
 def main():
@@ -119,7 +120,7 @@ def main():
     #rtn = avg_normal_from_rotationvectors(data[cols])
     #print('Vector (x,y,z): ({:.4} {:.4} {:.4})'.format(*rtn[0]))
     #print('Variance (x,y,z): ({:.4} {:.4} {:.4})'.format(*rtn[1]))
-    data[['rotation_z', 'rotation_to_normal']] = data[cols].apply(rotation_around_z, raw=True, axis=1).apply(pd.Series)
+    data[['rotation_z', 'rotation_to_normal']] = rotations_around_z(data[cols])
     print(data)
     data.to_csv('lol.csv')
 
@@ -0,0 +1,194 @@
+
+import argparse
+import numpy as np
+import pandas as pd
+
+
+def marker_positions(df):
+    """
+    Given a dataframe of marker poses, return one (mean) position per
+    marker id, sorted by id
+    """
+    return df.groupby('id', sort=True)[['tx', 'ty', 'tz']].mean().reset_index()
+
+
+def pairwise_distances(positions, measured):
+    """
+    Given marker positions and measured pairwise distances, return the
+    distance between each pair of markers on the circumference (ids < 100,
+    even id paired with the following odd id) with the measured distance
+    """
+    on_circumference = positions[positions['id'] < 100]
+    even = on_circumference[on_circumference['id'] % 2 == 0]
+    odd = on_circumference[on_circumference['id'] % 2 == 1].assign(
+        id=lambda df: df['id'] - 1
+    )
+    pairs = even.merge(odd, on='id', suffixes=('_even', '_odd'))
+    diff = (
+        pairs[['tx_odd', 'ty_odd', 'tz_odd']].values -
+        pairs[['tx_even', 'ty_even', 'tz_even']].values
+    )
+    pairs = pd.DataFrame({
+        'id': pairs['id'].values,
+        'distance_xyz': np.linalg.norm(diff, axis=1),
+    })
+    return pairs.merge(
+        measured.rename(columns={'measured_distance': 'actual_distance_xyz'}),
+        on='id'
+    )
+
+
+def fit_plane(points):
+    """
+    Least squares plane through (N, 3) points. Return (normal, offset) of
+    the plane normal . x = offset, with a unit normal and offset >= 0
+    """
+    centroid = points.mean(axis=0)
+    # Direction of least variance
+    _, _, vt = np.linalg.svd(points - centroid, full_matrices=False)
+    normal = vt[-1]
+    offset = np.dot(normal, centroid)
+    if offset < 0:
+        normal, offset = -normal, -offset
+    return normal, offset
+
+
+def fit_plane_ransac(points, threshold, iterations=200, seed=0):
+    """
+    Like fit_plane, but robust to outliers. All candidate planes through
+    three random points are scored at once, and the plane is refitted to
+    the inliers (distance < threshold) of the best one.
+    Return (normal, offset, inlier mask)
+    """
+    if len(points) < 3:
+        raise ValueError('A plane needs at least 3 points, got {}'.format(len(points)))
+    rng = np.random.default_rng(seed)
+    samples = np.array([
+        rng.choice(len(points), 3, replace=False) for _ in range(iterations)
+    ])
+    a, b, c = (points[samples[:, i]] for i in range(3))
+    normals = np.cross(b - a, c - a)
+    norms = np.linalg.norm(normals, axis=1)
+    valid = norms > 1e-12
+    if not valid.any():
+        raise ValueError('Points are on one line, they do not define a plane')
+    normals = normals[valid] / norms[valid, None]
+    offsets = np.sum(normals * a[valid], axis=1)
+    # (candidates, points) distances
+    distances = np.abs(np.matmul(normals, points.T) - offsets[:, None])
+    inliers = distances < threshold
+    best = np.argmax(inliers.sum(axis=1))
+    inliers = inliers[best]
+    normal, offset = fit_plane(points[inliers])
+    return normal, offset, inliers
+
+
+def project_to_plane(points, normal, offset):
+    """
+    Scale each of the (N, 3) points along its ray from the camera so it
+    ends on the plane. Return the projected points and the scale k
+    """
+    k = offset / np.matmul(points, normal)
+    return points * k[:, None], k
+
+
+def scale_factor(pairs):
+    """ Ratio of mean measured distance to mean estimated distance"""
+    return pairs['actual_distance_xyz'].mean() / pairs['distance_xyz'].mean()
+
+
+def estimate_floor(df, measured, ransac_threshold=None, ray=(0.0, 0.0, 1.0)):
+    """
+    Estimate the floor plane from marker poses. Return a dict with the
+    plane, scale factors, the camera to floor distance along ray and a
+    dataframe of positions projected onto the plane (suffix _fpe).
+    """
+    positions = marker_positions(df)
+    points = positions[['tx', 'ty', 'tz']].values
+
+    if ransac_threshold is None:
+        normal, offset = fit_plane(points)
+        inliers = np.ones(len(points), dtype=bool)
+    else:
+        normal, offset, inliers = fit_plane_ransac(points, ransac_threshold)
+
+    projected, k = project_to_plane(points, normal, offset)
+    positions_on_plane = positions.copy()
+    positions_on_plane[['tx', 'ty', 'tz']] = projected
+
+    # Scale from the mean pairwise distances
+    pairs = pairwise_distances(positions, measured)
+    pairs_on_plane = pairwise_distances(positions_on_plane, measured)
+    scaling = scale_factor(pairs)
+    scaling_on_plane = (
+        pairs_on_plane['actual_distance_xyz'] / pairs_on_plane['distance_xyz']
+    ).mean()
+
+    # Camera to floor along the given ray
+    ray = np.asarray(ray, dtype=np.float64)
+    (ray_on_plane,), _ = project_to_plane(ray[None], normal, offset)
+
+    positions['tx_fpe'], positions['ty_fpe'], positions['tz_fpe'] = projected.T
+    positions['k'] = k
+    positions['inlier'] = inliers
+    return {
+        'normal': normal,
+        'offset': offset,
+        # Plane as A x + B y + C z = 1
+        'plane_normal': normal / offset,
+        'scaling_factor': scaling,
+        'scaling_factor_on_plane': scaling_on_plane,
+        'cam2floor_dist': scaling * np.linalg.norm(ray_on_plane),
+        'cam2plane_dist': scaling * offset,
+        'positions': positions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Estimate the floor plane from marker poses.')
+    parser.add_argument('file', type=str, nargs=1,
+                        help='a csv-file with pose data')
+    parser.add_argument('-m', '--measured', type=str, nargs=1,
+                        default=['measured_pairwise_distance.csv'],
+                        help='a csv-file with measured pairwise distances')
+    parser.add_argument('-r', '--ransac', type=float, nargs=1,
+                        help='fit with RANSAC, using this inlier distance')
+    parser.add_argument('--ray', type=float, nargs=2, default=[0.0, 0.0],
+                        metavar=('xp', 'yp'),
+                        help='normalized image point to measure the camera '
+                             'to floor distance along (default: 0 0)')
+    parser.add_argument('-a', '--actual', type=float, nargs=1,
+                        help='actual camera to floor distance along the ray')
+    parser.add_argument('-o', '--output', type=str, nargs=1,
+                        help='output csv-file with projected positions')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.file[0])
+    measured = pd.read_csv(args.measured[0])
+    floor = estimate_floor(
+        df, measured,
+        ransac_threshold=args.ransac[0] if args.ransac else None,
+        ray=(*args.ray, 1.0)
+    )
+
+    print('Plane normal (x,y,z): ({:.4} {:.4} {:.4})'.format(*floor['normal']))
+    print('Scaling factor = %.4f (on plane %.4f)' % (
+        floor['scaling_factor'], floor['scaling_factor_on_plane']))
+    print('Camera to floor plane distance = %.3f m' % floor['cam2plane_dist'])
+    print('Camera to floor distance along ray = %.3f m' % floor['cam2floor_dist'])
+    if args.actual:
+        actual = args.actual[0]
+        print('Actual distance = %.3f m' % actual)
+        print('Difference = %.3f m' % abs(floor['cam2floor_dist'] - actual))
+        print('Difference = %.2f %%' % abs(100 - 100 * (floor['cam2floor_dist'] / actual)))
+    if args.ransac:
+        print('Inliers: {}/{}'.format(
+            floor['positions']['inlier'].sum(), len(floor['positions'])))
+
+    if args.output:
+        floor['positions'].to_csv(args.output[0], index=False)
+
+
+if __name__ == "__main__":
+    main()
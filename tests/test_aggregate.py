@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+from aruco.aggregate import PoseAggregator, read_frames
+from aruco.results import MarkerResults
+from aruco.rotation import normals, rotation_matrices
+
+
+def noisy_poses(count, seed=0):
+    """ Poses of one marker with small noise"""
+    rng = np.random.default_rng(seed)
+    tvecs = np.array([0.2, -0.1, 2.0]) + rng.normal(0, 0.002, (count, 3))
+    rvecs = np.array([3.0, 0.1, -0.2]) + rng.normal(0, 0.01, (count, 3))
+    return rvecs, tvecs
+
+
+def test_mean_and_variance():
+    rvecs, tvecs = noisy_poses(50)
+    aggregator = PoseAggregator(min_samples=1000)
+    for frame, (rvec, tvec) in enumerate(zip(rvecs, tvecs)):
+        aggregator.append(frame, [7], [rvec], [tvec])
+    row = aggregator.snapshot().iloc[0]
+    assert row['id'] == 7 and row['count'] == 50 and aggregator.frames == 50
+    np.testing.assert_allclose(row[['tx', 'ty', 'tz']], tvecs.mean(axis=0))
+    np.testing.assert_allclose(row[['tx_var', 'ty_var', 'tz_var']], tvecs.var(axis=0, ddof=1))
+    np.testing.assert_allclose(row[['nx', 'ny', 'nz']], normals(rvecs).mean(axis=0))
+    # Mean rotation close to every sample
+    mean = rotation_matrices(row[['rx', 'ry', 'rz']].values.astype(float))[0]
+    cos = (np.trace(rotation_matrices(rvecs) @ mean.T, axis1=1, axis2=2) - 1) / 2
+    assert np.degrees(np.arccos(np.clip(cos, -1, 1))).max() < 5
+
+
+def test_rotation_mean_ignores_sign_of_rotation_vector():
+    # Rotations by pi around opposite axes are the same rotation
+    aggregator = PoseAggregator()
+    aggregator.append(0, [1, 1], [[np.pi, 0, 0], [-np.pi, 0, 0]], np.ones((2, 3)))
+    rvec = aggregator.snapshot().iloc[0][['rx', 'ry', 'rz']].values.astype(float)
+    np.testing.assert_allclose(np.abs(rvec), [np.pi, 0, 0], atol=1e-9)
+
+
+def test_outliers_left_out():
+    rvecs, tvecs = noisy_poses(20)
+    aggregator = PoseAggregator(min_samples=5)
+    for frame, (rvec, tvec) in enumerate(zip(rvecs, tvecs)):
+        aggregator.append(frame, [3], [rvec], [tvec])
+    aggregator.append(20, [3], [rvecs[0]], [tvecs[0] + [0, 0, 0.5]])
+    aggregator.append(21, [3], [rvecs[0] * -0.5], [tvecs[0]])
+    row = aggregator.snapshot().iloc[0]
+    assert row['count'] == 20 and row['outliers'] == 2 and row['last_frame'] == 21
+    np.testing.assert_allclose(row[['tx', 'ty', 'tz']], tvecs.mean(axis=0))
+
+
+def test_extend_matches_append():
+    rvecs, tvecs = noisy_poses(30)
+    results = MarkerResults()
+    for frame in range(10):
+        rows = slice(3 * frame, 3 * frame + 3)
+        results.append(frame, [1, 2, 3], rvecs[rows], tvecs[rows], np.zeros((3, 4, 2)))
+    a, b = PoseAggregator(), PoseAggregator()
+    a.extend(results)
+    for frame in range(10):
+        rows = results.frames == frame
+        b.append(frame, results.ids[rows], results.rvecs[rows], results.tvecs[rows])
+    pd.testing.assert_frame_equal(a.snapshot(), b.snapshot())
+    assert a.frames == b.frames == 10
+
+
+def test_read_frames_keeps_frames_whole_across_chunks(tmp_path):
+    rvecs, tvecs = noisy_poses(12)
+    df = pd.DataFrame({
+        'frame': np.repeat([0, 1, 2, 3], 3),
+        'id': np.tile([1, 2, 3], 4),
+        'tx': tvecs[:, 0], 'ty': tvecs[:, 1], 'tz': tvecs[:, 2],
+        'rx': rvecs[:, 0], 'ry': rvecs[:, 1], 'rz': rvecs[:, 2],
+    })
+    filename = str(tmp_path / 'poses.csv')
+    df.to_csv(filename, index=False)
+    for chunk_size in (1, 2, 4, 5, 100):
+        frames = list(read_frames(filename, chunk_size))
+        assert [frame for frame, _ in frames] == [0, 1, 2, 3]
+        assert all(len(rows) == 3 for _, rows in frames)
+
+
+def test_read_frames_without_frame_column(tmp_path):
+    filename = str(tmp_path / 'poses.csv')
+    pd.DataFrame({'id': range(5), 'tx': 0.0, 'ty': 0.0, 'tz': 1.0,
+                  'rx': 0.0, 'ry': 0.0, 'rz': 0.0}).to_csv(filename, index=False)
+    frames = list(read_frames(filename, 2))
+    assert sum(len(rows) for _, rows in frames) == 5
+    assert {frame for frame, _ in frames} == {0}
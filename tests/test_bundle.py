@@ -0,0 +1,141 @@
+import os
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+
+from aruco.bundle import BundleProblem, bundle_adjust, huber_weights
+from aruco.camera_parameters import read_camera_parameters
+from aruco.results import MarkerResults
+from aruco.synthetic import marker_object_points
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def small_problem(pairs=None, distances=None):
+    rng = np.random.default_rng(3)
+    # Frame 2 sees marker 4 twice
+    frames = np.array([0, 0, 1, 1, 2, 2, 2, 2])
+    ids = np.array([4, 5, 4, 5, 5, 6, 4, 4])
+    problem = BundleProblem(
+        frames, ids, rng.normal(0, 0.1, (len(ids), 4, 2)), 0.17, 300.0, pairs, distances
+    )
+    scale, cam_rvecs, cam_tvecs, marker_rvecs, marker_tvecs = problem.unpack(
+        rng.normal(0, 0.3, problem.n_params)
+    )
+    cam_tvecs = cam_tvecs.copy()
+    cam_tvecs[1:, 2] += 3
+    return problem, problem.pack(1.1, cam_rvecs, cam_tvecs, marker_rvecs, marker_tvecs)
+
+
+def dense_jacobian(problem, x, h=1e-6):
+    def residuals(x):
+        reprojection, distance = problem.residuals(x)
+        return np.concatenate((reprojection.ravel(), distance))
+
+    jacobian = np.zeros((problem.n_residuals, problem.n_params))
+    for i in range(len(x)):
+        offset = np.zeros(len(x))
+        offset[i] = h
+        jacobian[:, i] = (residuals(x + offset) - residuals(x - offset)) / (2 * h)
+    return jacobian, residuals(x)
+
+
+PAIRS = [(None, None), (np.array([[4, 5], [5, 6]]), [3.0, 1.0])]
+
+
+@pytest.mark.parametrize('pairs, distances', PAIRS)
+def test_jacobian_matches_finite_differences(pairs, distances):
+    problem, x = small_problem(pairs, distances)
+    expected = dense_jacobian(problem, x)[0]
+    blocks, unit = problem.jacobian(x)
+    scales = int(problem.free_scale)
+    offset = scales + 6 * (problem.n_cameras - 1)
+    for k, (camera, marker) in enumerate(zip(problem.det_frames, problem.det_markers)):
+        rows = expected[8 * k:8 * k + 8]
+        if scales:
+            np.testing.assert_allclose(blocks[k, :, 0], rows[:, 0], atol=1e-5)
+        if camera:
+            columns = slice(scales + 6 * (camera - 1), scales + 6 * camera)
+            np.testing.assert_allclose(blocks[k, :, 1:7], rows[:, columns], atol=1e-5)
+        columns = slice(offset + 6 * marker, offset + 6 * marker + 6)
+        np.testing.assert_allclose(blocks[k, :, 7:], rows[:, columns], atol=1e-5)
+    for p, (first, second) in enumerate(problem.pairs):
+        row = expected[8 * len(problem.points) + p]
+        np.testing.assert_allclose(row[offset + 6 * first + 3:offset + 6 * first + 6], unit[p], atol=1e-5)
+        np.testing.assert_allclose(row[offset + 6 * second + 3:offset + 6 * second + 6], -unit[p], atol=1e-5)
+
+
+@pytest.mark.parametrize('pairs, distances', PAIRS)
+@pytest.mark.parametrize('f_scale', [None, 1.0])
+def test_schur_step_matches_dense_solve(pairs, distances, f_scale):
+    problem, x = small_problem(pairs, distances)
+    jacobian, residuals = dense_jacobian(problem, x)
+    weights = np.ones(problem.n_residuals)
+    if f_scale is not None:
+        reprojection, distance = problem.residuals(x)
+        weights = np.concatenate((
+            np.repeat(huber_weights(np.linalg.norm(reprojection, axis=2).ravel(), f_scale), 2),
+            huber_weights(np.abs(distance), f_scale),
+        ))
+    hessian = jacobian.T @ (weights[:, None] * jacobian)
+    damping = 0.1
+    expected = -np.linalg.solve(
+        hessian + damping * np.diag(np.diag(hessian)), jacobian.T @ (weights * residuals)
+    )
+    step = problem.step(problem.normal_equations(x, f_scale), damping)[0]
+    np.testing.assert_allclose(step, expected, atol=1e-6 * np.abs(expected).max())
+
+
+def test_recovers_synthetic_markers():
+    rng = np.random.default_rng(0)
+    cam_params = read_camera_parameters(os.path.join(ROOT, 'calibration', 'fisheye_calibration_mp3.xml'))
+    cam_mat = cam_params.pose_cam_mat
+    height, width = cam_params.size
+    marker_length = 0.174
+    object_points = marker_object_points(marker_length)
+    ids = np.arange(12)
+    positions = np.column_stack((ids % 4 * 0.8, ids // 4 * 0.8, np.zeros(len(ids))))
+    positions[:, :2] += rng.normal(0, 0.05, (len(ids), 2))
+    marker_rots = [cv2.Rodrigues(np.array([0, 0, angle]))[0] for angle in rng.uniform(-np.pi, np.pi, len(ids))]
+
+    results = MarkerResults()
+    for frame in range(15):
+        center = np.array([rng.uniform(0, 2.4), rng.uniform(0, 1.6), 2.0])
+        # Looking down at the floor
+        rot = cv2.Rodrigues(rng.normal(0, 0.1, 3))[0] @ np.diag([1.0, -1.0, -1.0])
+        t = -rot @ center
+        frame_ids, rvecs, tvecs, corners = [], [], [], []
+        for marker_id in ids:
+            cam = (rot @ (marker_rots[marker_id] @ object_points.T + positions[marker_id, :, None])).T + t
+            pixels = (cam_mat @ (cam / cam[:, 2:]).T).T[:, :2]
+            if (pixels < 20).any() or (pixels > (width - 20, height - 20)).any():
+                continue
+            pixels += rng.normal(0, 0.3, pixels.shape)
+            _, rvec, tvec = cv2.solvePnP(
+                object_points, pixels, cam_mat, None, flags=cv2.SOLVEPNP_IPPE_SQUARE
+            )
+            frame_ids.append(marker_id)
+            rvecs.append(rvec.ravel())
+            tvecs.append(tvec.ravel())
+            corners.append(pixels)
+        if frame_ids:
+            results.append(frame, np.array(frame_ids), np.array(rvecs), np.array(tvecs), np.array(corners))
+
+    # Wrong marker length, the measured distances give the scale
+    even = ids[::2]
+    measured = pd.DataFrame({
+        'id': even,
+        'measured_distance': np.linalg.norm(positions[even] - positions[even + 1], axis=1),
+    })
+    solution = bundle_adjust(results, cam_params, 0.17, measured)
+    assert solution['rms_px'] < 1.0
+    np.testing.assert_allclose(solution['scale'], marker_length / 0.17, rtol=0.01)
+
+    # Distances between markers do not depend on the common frame
+    markers = solution['markers'].set_index('id')
+    estimated = markers.loc[ids, ['tx', 'ty', 'tz']].values
+    expected = np.linalg.norm(positions[:, None] - positions[None], axis=2)
+    found = np.linalg.norm(estimated[:, None] - estimated[None], axis=2)
+    np.testing.assert_allclose(found, expected, atol=0.01)
@@ -0,0 +1,163 @@
+import os
+import shutil
+import sys
+import cv2
+import numpy as np
+import pytest
+
+from aruco.calibrate import CornerCache, main, read_image_list, read_settings, run_calibration
+from aruco.calibrate import write_calibration, write_image_list
+from aruco.camera_parameters import read_camera_parameters
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG = os.path.join(ROOT, 'calibration', 'normal_config_low.xml')
+CAM_MAT = np.array([[500.0, 0, 319.5], [0, 500.0, 239.5], [0, 0, 1]])
+SIZE = (640, 480)
+
+
+def render_board(settings, rvec, tvec, scale=4):
+    """ A chessboard of settings seen by the CAM_MAT pinhole camera"""
+    width, height = settings.board_size
+    square = int(settings.square_size * scale)
+    # One square around the inner corners, and a white border of one square
+    board = np.full(((height + 3) * square, (width + 3) * square), 255, np.uint8)
+    for i in range(height + 1):
+        for j in range(width + 1):
+            if (i + j) % 2 == 0:
+                board[(i + 1) * square:(i + 2) * square, (j + 1) * square:(j + 2) * square] = 0
+    # Board pixels to the plane of board_points, the first inner corner at 0
+    offset = 2 * settings.square_size
+    to_plane = np.array([[1 / scale, 0, 0.5 / scale - offset],
+                         [0, 1 / scale, 0.5 / scale - offset],
+                         [0, 0, 1]])
+    rotation = cv2.Rodrigues(np.asarray(rvec, np.float64))[0]
+    homography = CAM_MAT @ np.column_stack((rotation[:, 0], rotation[:, 1], tvec)) @ to_plane
+    return cv2.warpPerspective(board, homography, SIZE, flags=cv2.INTER_AREA, borderValue=255)
+
+
+def write_views(settings, directory, count=8):
+    rng = np.random.RandomState(0)
+    width, height = settings.board_size
+    center = np.array([(width - 1) / 2, (height - 1) / 2, 0]) * settings.square_size
+    filenames = []
+    for i in range(count):
+        rvec = np.array([np.pi, 0, 0]) + rng.uniform(-0.4, 0.4, 3)
+        rotation = cv2.Rodrigues(rvec)[0]
+        tvec = np.array([rng.uniform(-60, 60), rng.uniform(-40, 40), rng.uniform(650, 800)])
+        tvec -= rotation @ center
+        filenames.append(os.path.join(str(directory), 'view{}.png'.format(i)))
+        cv2.imwrite(filenames[-1], render_board(settings, rvec, tvec))
+    return filenames
+
+
+@pytest.fixture
+def config(tmp_path):
+    """ A copy of a normal config, with an empty image list"""
+    filename = str(tmp_path / 'normal_config_low.xml')
+    shutil.copy(CONFIG, filename)
+    settings = read_settings(filename)
+    write_image_list(settings.image_list, [])
+    return filename
+
+
+def test_read_settings():
+    settings = read_settings(CONFIG)
+    assert settings.board_size == (10, 7)
+    assert settings.square_size == 30
+    assert settings.pattern == 'CHESSBOARD'
+    assert settings.image_list == os.path.join(ROOT, 'calibration', 'normal_imagelist_low.xml')
+    assert settings.output == os.path.join(ROOT, 'calibration', 'normal_calibration_low.xml')
+    assert settings.frames == 50
+    assert settings.fix_aspect_ratio == 1
+    assert settings.zero_tangent_dist and settings.fix_principal_point
+    assert not settings.use_fisheye
+    assert settings.fix_k == (False,) * 5
+    with pytest.raises(IOError):
+        read_settings(os.path.join(ROOT, 'calibration', 'missing.xml'))
+
+
+def test_image_list_round_trip(tmp_path):
+    images = [str(tmp_path / 'a.jpg'), str(tmp_path / 'photos' / 'b.jpg')]
+    filename = str(tmp_path / 'lists' / 'imagelist.xml')
+    os.makedirs(os.path.dirname(filename))
+    write_image_list(filename, images)
+    assert read_image_list(filename) == images
+    # Paths are stored relative to the list
+    with open(filename) as stream:
+        assert '../a.jpg' in stream.read()
+
+
+def test_corner_cache(tmp_path):
+    cache = CornerCache(str(tmp_path))
+    assert cache.get('missing') is None
+    corners = np.arange(12, dtype=np.float32).reshape(-1, 2)
+    cache.put('found', (640, 480), corners)
+    cache.put('not-found', (640, 480), None)
+    size, cached = cache.get('found')
+    assert size == (640, 480)
+    np.testing.assert_array_equal(cached, corners)
+    assert cache.get('not-found') == ((640, 480), None)
+    assert sorted(os.listdir(str(tmp_path))) == ['found.npy', 'not-found.npy']
+
+
+def test_run_calibration_recovers_camera(config, tmp_path):
+    settings = read_settings(config)
+    images = write_views(settings, tmp_path)
+    # Views without the pattern are skipped
+    blank = str(tmp_path / 'blank.png')
+    cv2.imwrite(blank, np.full(SIZE[::-1], 255, np.uint8))
+    cache_dir = str(tmp_path / 'corners')
+
+    log = []
+    image_size, filenames, image_points, result = run_calibration(
+        settings, images + [blank], cache_dir=cache_dir, workers=2,
+        progress=lambda *args: log.append(args)
+    )
+    assert image_size == SIZE
+    assert filenames == images
+    assert sorted(log) == sorted([(image, True, False) for image in images] + [(blank, False, False)])
+    assert result['avg_error'] < 0.2
+    np.testing.assert_allclose(result['cam_mat'], CAM_MAT, rtol=0.01, atol=1.0)
+
+    # A second run reads the corners from the cache
+    log = []
+    _, _, cached_points, _ = run_calibration(
+        settings, images + [blank], cache_dir=cache_dir, workers=2,
+        progress=lambda *args: log.append(args)
+    )
+    assert all(cached for _, _, cached in log)
+    for points, cached in zip(image_points, cached_points):
+        np.testing.assert_allclose(cached, points, atol=1e-3)
+
+    output = str(tmp_path / 'calibration.xml')
+    write_calibration(output, settings, image_size, image_points, result)
+    cam_params = read_camera_parameters(output)
+    assert not cam_params.use_fisheye
+    assert cam_params.size == SIZE[::-1]
+    np.testing.assert_allclose(cam_params.cam_mat, result['cam_mat'])
+    np.testing.assert_allclose(cam_params.dist_coeffs.ravel(), result['dist_coeffs'].ravel())
+
+
+def test_failed_calibration_keeps_image_list(config, tmp_path, monkeypatch):
+    settings = read_settings(config)
+    images = write_views(settings, tmp_path, count=3)
+    write_image_list(settings.image_list, images)
+    # An image of another size fails the calibration
+    other = str(tmp_path / 'other.png')
+    cv2.imwrite(other, np.full((240, 320), 255, np.uint8))
+    monkeypatch.setattr(sys, 'argv', [
+        'calibrate', config, '--add', other, '--no-corner-cache', '-j', '1'
+    ])
+    with pytest.raises(ValueError):
+        main()
+    assert read_image_list(settings.image_list) == images
+
+    added = str(tmp_path / 'added.png')
+    shutil.copy(images[0], added)
+    monkeypatch.setattr(sys, 'argv', [
+        'calibrate', config, '--add', added, '--no-corner-cache', '-j', '1',
+        '-o', str(tmp_path / 'calibration.xml')
+    ])
+    main()
+    assert read_image_list(settings.image_list) == images + [added]
@@ -0,0 +1,44 @@
+import os
+import cv2
+import numpy as np
+
+from aruco.benchmark import make_frames
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detect_markers import compare_undistort_modes
+from aruco.detector import Detector, UNDISTORT_CORNERS, UNDISTORT_REMAP
+from aruco.read import read_detector_params
+from aruco.synthetic import SceneRenderer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DICTIONARY = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
+
+
+def test_corner_poses_match_remap_poses():
+    cam_params = read_camera_parameters(
+        os.path.join(ROOT, 'calibration', 'fisheye_calibration_mp3.xml')
+    )
+    params = read_detector_params(os.path.join(ROOT, 'detector_params.yaml'))
+    scenes = make_frames(SceneRenderer(cam_params, DICTIONARY, 0.174), 2, 4, 0)
+    images = [img for img, _, _, _ in scenes]
+    height, width = cam_params.size
+
+    diffs = compare_undistort_modes(
+        images, (height, width), cam_params.cam_mat, cam_params.dist_coeffs,
+        DICTIONARY, params, 0.174, use_fisheye=True
+    )
+    assert len(diffs) == 8
+    assert diffs['dcorner'].max() < 0.5
+    assert diffs['dt'].max() < 0.03
+    # Rotations of single small markers are noisy in both modes
+    assert diffs['drot'].median() < 5.0
+
+    # Both modes also match the rendered poses
+    for mode in (UNDISTORT_REMAP, UNDISTORT_CORNERS):
+        detector = Detector(cam_params, params, DICTIONARY, 0.174, mode)
+        for img, ids, _, tvecs in scenes:
+            corners, found, _ = detector.detect(img)
+            _, found_tvecs = detector.estimate_poses(corners)
+            order = np.argsort(found[:, 0])
+            np.testing.assert_array_equal(found[order, 0], ids)
+            np.testing.assert_allclose(found_tvecs[order, 0], tvecs, atol=0.05)
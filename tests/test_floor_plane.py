@@ -0,0 +1,68 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from floor_plane import estimate_floor, fit_plane, fit_plane_ransac, project_to_plane
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Results of floor_plane_estimation-exp.ipynb on eureka.csv
+NOTEBOOK_SCALING_FACTOR = 1.7263873860158416
+NOTEBOOK_SCALING_FACTOR_ON_PLANE = 1.7282088877340631
+NOTEBOOK_NORMAL = np.array([0.15851261, -0.06538722, 2.54122161]) / 2.547
+NOTEBOOK_RAY = (0.0663123588482741, -0.023728146422643644, 1.0)
+NOTEBOOK_CAM2FLOOR_DIST = 2.510
+
+
+def plane_points(normal, offset, count=50, seed=0):
+    rng = np.random.default_rng(seed)
+    normal = np.asarray(normal, dtype=np.float64) / np.linalg.norm(normal)
+    basis = np.linalg.svd(normal[None])[2][1:]
+    return normal * offset + rng.uniform(-1, 1, (count, 2)) @ basis
+
+
+def test_matches_notebook():
+    df = pd.read_csv(os.path.join(ROOT, 'eureka.csv'))
+    measured = pd.read_csv(os.path.join(ROOT, 'measured_pairwise_distance.csv'))
+    floor = estimate_floor(df, measured, ray=NOTEBOOK_RAY)
+    np.testing.assert_allclose(floor['normal'], NOTEBOOK_NORMAL, atol=1e-5)
+    np.testing.assert_allclose(floor['scaling_factor'], NOTEBOOK_SCALING_FACTOR, rtol=1e-9)
+    np.testing.assert_allclose(
+        floor['scaling_factor_on_plane'], NOTEBOOK_SCALING_FACTOR_ON_PLANE, rtol=1e-4
+    )
+    assert abs(floor['cam2floor_dist'] - NOTEBOOK_CAM2FLOOR_DIST) < 5e-4
+
+
+def test_fit_plane():
+    points = plane_points((0.1, -0.2, 1.0), 2.0)
+    normal, offset = fit_plane(points)
+    np.testing.assert_allclose(normal, np.array([0.1, -0.2, 1.0]) / np.linalg.norm([0.1, -0.2, 1.0]))
+    np.testing.assert_allclose(offset, 2.0)
+
+
+def test_fit_plane_ransac_ignores_outliers():
+    points = plane_points((0.0, 0.3, 1.0), 2.5)
+    points[:5] *= 0.8
+    normal, offset, inliers = fit_plane_ransac(points, 0.01)
+    assert not inliers[:5].any() and inliers[5:].all()
+    np.testing.assert_allclose(offset, 2.5)
+
+
+def test_fit_plane_ransac_needs_a_plane():
+    points = plane_points((0.0, 0.0, 1.0), 1.0)
+    with pytest.raises(ValueError):
+        fit_plane_ransac(points[:2], 0.01)
+    line = np.outer(np.arange(10.0), (1.0, 2.0, 3.0))
+    with pytest.raises(ValueError):
+        fit_plane_ransac(line, 0.01)
+
+
+def test_project_to_plane():
+    normal = np.array([0.0, 0.6, 0.8])
+    rng = np.random.default_rng(1)
+    points = rng.uniform(0.5, 1.5, (20, 3))
+    projected, k = project_to_plane(points, normal, 3.0)
+    np.testing.assert_allclose(projected @ normal, 3.0)
+    np.testing.assert_allclose(projected, points * k[:, None])
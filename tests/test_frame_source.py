@@ -0,0 +1,66 @@
+import os
+import cv2
+import numpy as np
+import pytest
+
+from aruco.frame_source import DirectorySource, RingBuffer, SyntheticSource, open_source
+
+
+DICTIONARY = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
+
+
+def write_images(directory, count):
+    for i in range(count):
+        cv2.imwrite(os.path.join(str(directory), 'img{:02d}.png'.format(i)), np.full((24, 32, 3), i, np.uint8))
+
+
+def test_ring_buffer_drops_oldest_frame():
+    buffer = RingBuffer(2)
+    for frame in range(3):
+        buffer.put(frame)
+    assert buffer.dropped == 1
+    assert [buffer.get(), buffer.get()] == [1, 2]
+    with pytest.raises(TimeoutError):
+        buffer.get(timeout=0.01)
+    buffer.put(3)
+    buffer.close()
+    # Frames put before closing are still read
+    assert buffer.get() == 3
+    assert buffer.get() is None
+
+
+def test_directory_source(tmp_path):
+    write_images(tmp_path, 3)
+    source = open_source(str(tmp_path))
+    assert isinstance(source, DirectorySource)
+    frames = list(source)
+    assert [frame.index for frame in frames] == [0, 1, 2]
+    assert [frame.image[0, 0, 0] for frame in frames] == [0, 1, 2]
+
+    with DirectorySource(str(tmp_path), loop=True) as looping:
+        values = [looping.read().image[0, 0, 0] for _ in range(5)]
+    assert values == [0, 1, 2, 0, 1]
+
+
+def test_synthetic_source_in_background():
+    with SyntheticSource(DICTIONARY, frames=5, buffer_size=8).start() as source:
+        frames = list(source)
+    assert [frame.index for frame in frames] == list(range(5))
+    assert frames[0].image.shape == (240, 320, 3)
+    _, ids, _ = cv2.aruco.detectMarkers(frames[0].image, DICTIONARY)
+    assert sorted(ids[:, 0]) == [0, 1, 2, 3]
+
+
+def test_grab_error_is_raised_by_read(tmp_path):
+    write_images(tmp_path, 2)
+    with open(os.path.join(str(tmp_path), 'img02.jpg'), 'wb') as stream:
+        stream.write(b'not an image')
+
+    with pytest.raises(IOError):
+        list(DirectorySource(str(tmp_path)))
+
+    with DirectorySource(str(tmp_path), buffer_size=8).start() as source:
+        assert source.read().index == 0
+        assert source.read().index == 1
+        with pytest.raises(IOError, match='img02.jpg'):
+            source.read()
@@ -0,0 +1,56 @@
+import os
+import time
+import numpy as np
+
+from aruco.map_cache import UndistortMapCache, array_hash, fisheye_undistort_maps
+
+
+CAM_MAT = np.array([[50.0, 0.0, 40.0], [0.0, 50.0, 30.0], [0.0, 0.0, 1.0]])
+DIST_COEFFS = np.array([0.1, -0.05, 0.01, 0.0])
+SIZE = (60, 80)
+
+
+def test_hit_matches_computed(tmp_path):
+    cache = UndistortMapCache(str(tmp_path))
+    calibration = array_hash(CAM_MAT, DIST_COEFFS)
+    first = cache.fisheye_maps(calibration, CAM_MAT, DIST_COEFFS, SIZE)
+    expected = fisheye_undistort_maps(CAM_MAT, DIST_COEFFS, SIZE)
+    second = cache.fisheye_maps(calibration, CAM_MAT, DIST_COEFFS, SIZE)
+    for a, b, c in zip(first, second, expected):
+        np.testing.assert_array_equal(a, c)
+        np.testing.assert_array_equal(b, c)
+    assert isinstance(second[1], np.memmap)
+    assert len(cache.entries()) == 1
+
+
+def test_key_depends_on_size_and_balance(tmp_path):
+    cache = UndistortMapCache(str(tmp_path))
+    keys = {
+        cache.key('abc', SIZE, 1.0, 0),
+        cache.key('abc', (120, 160), 1.0, 0),
+        cache.key('abc', SIZE, 0.5, 0),
+        cache.key('abd', SIZE, 1.0, 0),
+    }
+    assert len(keys) == 4
+
+
+def test_evicts_least_recently_used(tmp_path):
+    maps = fisheye_undistort_maps(CAM_MAT, DIST_COEFFS, SIZE)
+    entry_bytes = sum(array.nbytes for array in maps)
+    cache = UndistortMapCache(str(tmp_path), max_bytes=int(2.5 * entry_bytes))
+    cache.put('a', *maps)
+    cache.put('b', *maps)
+    # Use a so b becomes the least recently used entry
+    past = time.time() - 10
+    os.utime(os.path.join(str(tmp_path), 'b'), (past, past))
+    assert cache.get('a') is not None
+    cache.put('c', *maps)
+    names = sorted(os.path.basename(path) for _, _, path in cache.entries())
+    assert names == ['a', 'c']
+
+
+def test_keeps_newest_entry_above_limit(tmp_path):
+    cache = UndistortMapCache(str(tmp_path), max_bytes=1)
+    maps = cache.put('a', *fisheye_undistort_maps(CAM_MAT, DIST_COEFFS, SIZE))
+    assert len(cache.entries()) == 1
+    np.testing.assert_array_equal(maps[1], cache.get('a')[1])
@@ -0,0 +1,63 @@
+import random
+import time
+import pytest
+
+from aruco.pipeline import Pipeline, PipelineStage
+
+
+def jitter(value):
+    # Random delays make workers finish out of order
+    time.sleep(random.random() * 0.002)
+    return value
+
+
+def test_results_in_input_order():
+    pipeline = Pipeline([
+        PipelineStage('double', lambda value: jitter(2 * value), workers=4),
+        PipelineStage('add', lambda value: jitter(value + 1), workers=3),
+    ])
+    assert list(pipeline.run(range(50))) == [2 * value + 1 for value in range(50)]
+    stats = pipeline.stats()
+    assert list(stats['stage']) == ['double', 'add']
+    assert list(stats['items']) == [50, 50]
+
+
+def test_in_flight_items_are_bounded():
+    pipeline = Pipeline([PipelineStage('jitter', jitter, workers=4)], max_in_flight=3)
+    assert list(pipeline.run(range(30))) == list(range(30))
+    assert pipeline.reorder_max <= 3
+
+
+def test_stage_error_raised_at_its_item():
+    def fail_on_five(value):
+        if value == 5:
+            raise ValueError('five')
+        return jitter(value)
+
+    pipeline = Pipeline([PipelineStage('fail', fail_on_five, workers=3)])
+    results = []
+    with pytest.raises(ValueError, match='five'):
+        for value in pipeline.run(range(20)):
+            results.append(value)
+    assert results == [0, 1, 2, 3, 4]
+
+
+def test_input_error_raised_after_earlier_items():
+    def items():
+        yield from range(3)
+        raise IOError('no more images')
+
+    pipeline = Pipeline([PipelineStage('identity', jitter, workers=2)])
+    results = []
+    with pytest.raises(IOError, match='no more images'):
+        for value in pipeline.run(items()):
+            results.append(value)
+    assert results == [0, 1, 2]
+
+
+def test_consumer_stopping_early_ends_threads():
+    pipeline = Pipeline([PipelineStage('identity', jitter, workers=2)])
+    results = pipeline.run(range(1000))
+    assert next(results) == 0
+    results.close()
+    assert pipeline.wall > 0
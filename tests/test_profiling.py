@@ -0,0 +1,41 @@
+from contextlib import closing
+import cv2
+import numpy as np
+
+from aruco.detect_markers import iter_markers
+from aruco.detector import UNDISTORT_CORNERS
+from aruco.profiling import StageTimer
+
+
+def test_stage_times_are_summed_per_frame():
+    timer = StageTimer()
+    for frame in range(3):
+        for _ in range(2):
+            with timer.stage('detect'):
+                pass
+        with timer.stage('pose'):
+            pass
+        timer.end_frame(frame, markers=frame)
+    table = timer.frame_table()
+    assert list(table['frame']) == [0, 1, 2]
+    assert list(table['markers']) == [0, 1, 2]
+    assert timer.stages() == ['detect', 'pose']
+    assert (table['total'] >= table['detect'] + table['pose'] - 1e-9).all()
+    assert '3 frames, 3 markers' in timer.format_summary()
+
+
+def test_last_frame_ended_when_consumer_stops_early():
+    cam_mat = np.array([[100.0, 0, 80], [0, 100.0, 60], [0, 0, 1]])
+    images = [np.full((120, 160, 3), 255, np.uint8) for _ in range(3)]
+    timer = StageTimer()
+    markers = iter_markers(
+        images, (120, 160), cam_mat, np.zeros((5, 1)),
+        cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250),
+        cv2.aruco.DetectorParameters_create(), undistort_mode=UNDISTORT_CORNERS,
+        draw=False, timer=timer
+    )
+    with closing(markers):
+        for frame, *_ in markers:
+            if frame == 1:
+                break
+    assert [frame for frame, _, _ in timer.frames] == [0, 1]
@@ -0,0 +1,81 @@
+import os
+import cv2
+import numpy as np
+
+from aruco.benchmark import check_recall, make_frames
+from aruco.camera_parameters import CameraParameters, read_camera_parameters
+from aruco.detector import Detector, UNDISTORT_CORNERS
+from aruco.pyramid import PyramidDetector, coarse_level
+from aruco.read import read_detector_params
+from aruco.synthetic import SceneRenderer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DICTIONARY = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
+
+
+def pinhole(width, height):
+    cam_mat = np.array([[width, 0, width / 2], [0, width, height / 2], [0, 0, 1]], dtype=np.float64)
+    return CameraParameters(cam_mat, np.zeros((5, 1)), width, height, False)
+
+
+def test_coarse_level_prefers_intermediate_calibration():
+    low, mp3, mp8 = pinhole(320, 240), pinhole(2048, 1536), pinhole(3280, 2464)
+    assert coarse_level(mp8, [low, mp3]) is mp3
+
+
+def test_coarse_level_scales_when_levels_are_too_small():
+    low, mp3 = pinhole(320, 240), pinhole(2048, 1536)
+    coarse = coarse_level(mp3, [low])
+    assert coarse.size == (768, 1024)
+    np.testing.assert_allclose(coarse.cam_mat[0, 0], mp3.cam_mat[0, 0] / 2)
+
+
+def test_no_coarse_level_for_small_frames():
+    assert coarse_level(pinhole(320, 240)) is None
+
+
+def test_full_frame_fallback():
+    cam_params = read_camera_parameters(
+        os.path.join(ROOT, 'calibration', 'fisheye_calibration_mp3.xml')
+    ).scaled(0.5)
+    params = read_detector_params(os.path.join(ROOT, 'detector_params.yaml'))
+    scenes = make_frames(SceneRenderer(cam_params, DICTIONARY, 0.174), 1, 4, 0)
+    img = scenes[0][0]
+    # Markers are a few pixels wide at this level, so it finds nothing
+    too_coarse = cam_params.scaled(0.1)
+    expected = Detector(cam_params, params, DICTIONARY, 0.174, UNDISTORT_CORNERS).detect(img)[1]
+    assert expected is not None and len(expected) == 4
+    for fallback, count in ((True, 4), (False, 0)):
+        detector = PyramidDetector(
+            cam_params, params, DICTIONARY, 0.174, too_coarse,
+            undistort_mode=UNDISTORT_CORNERS, full_frame_fallback=fallback
+        )
+        _, ids, _ = detector.detect(img)
+        assert (0 if ids is None else len(ids)) == count
+
+
+def test_full_frame_fallback_is_drawn_in_remap_mode():
+    cam_params = read_camera_parameters(
+        os.path.join(ROOT, 'calibration', 'fisheye_calibration_mp3.xml')
+    ).scaled(0.5)
+    params = read_detector_params(os.path.join(ROOT, 'detector_params.yaml'))
+    img = make_frames(SceneRenderer(cam_params, DICTIONARY, 0.174), 1, 4, 0)[0][0]
+    for coarse, full_frame in ((cam_params.scaled(0.1), True), (cam_params.scaled(0.5), False)):
+        detector = PyramidDetector(cam_params, params, DICTIONARY, 0.174, coarse)
+        _, ids, found_in = detector.detect(img)
+        assert ids is not None
+        assert detector.can_draw() == full_frame
+        if full_frame:
+            np.testing.assert_array_equal(found_in, detector.undistort_image(img))
+
+
+def test_check_recall():
+    results = {'mp3': {
+        'remap': {'detection_rate': 1.0},
+        'corners': {'detection_rate': 0.9},
+        'pyramid': {'detection_rate': 0.5},
+        'pyramid-corners': {'detection_rate': 0.9},
+    }}
+    failures = check_recall(results)
+    assert len(failures) == 1 and failures[0].startswith('mp3 pyramid ')
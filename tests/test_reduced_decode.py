@@ -0,0 +1,84 @@
+import glob
+import os
+import shutil
+import cv2
+import numpy as np
+import pytest
+
+from aruco.benchmark import make_frames
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detect_markers import REDUCED_FLAGS, collect_markers, image_flags, iter_registry_markers
+from aruco.detect_markers import read_images
+from aruco.detector import Detector, UNDISTORT_CORNERS, UNDISTORT_REMAP
+from aruco.read import read_detector_params
+from aruco.registry import CalibrationRegistry
+from aruco.synthetic import SceneRenderer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DICTIONARY = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
+MP3 = os.path.join(ROOT, 'calibration', 'fisheye_calibration_mp3.xml')
+
+
+@pytest.fixture
+def registry(tmp_path):
+    directory = tmp_path / 'calibration'
+    directory.mkdir()
+    for filename in glob.glob(os.path.join(ROOT, 'calibration', 'fisheye_calibration_*.xml')):
+        shutil.copy(filename, str(directory))
+    return CalibrationRegistry(str(directory), cache_dir=str(tmp_path / 'cache'))
+
+
+def test_image_flags_decode_reduced(tmp_path):
+    filename = str(tmp_path / 'img.png')
+    cv2.imwrite(filename, np.full((64, 96, 3), 200, np.uint8))
+    for reduce in sorted(REDUCED_FLAGS):
+        assert cv2.imread(filename, image_flags(False, reduce)).shape == (64 // reduce, 96 // reduce, 3)
+        assert cv2.imread(filename, image_flags(True, reduce)).shape == (64 // reduce, 96 // reduce)
+    assert image_flags() == cv2.IMREAD_COLOR
+    assert image_flags(True, 2) == cv2.IMREAD_REDUCED_GRAYSCALE_2
+
+
+def test_registry_scales_calibration_for_reduced_images(registry):
+    cam_params = read_camera_parameters(MP3)
+    reduced = registry.for_size(1024, 768, reduce=2)
+    scaled = cam_params.scaled(0.5)
+    assert reduced.size == scaled.size == (768, 1024)
+    np.testing.assert_allclose(reduced.cam_mat, scaled.cam_mat)
+    np.testing.assert_allclose(scaled.cam_mat[:2, :2], cam_params.cam_mat[:2, :2] / 2)
+    # Pixel centers stay on the same rays
+    np.testing.assert_allclose(scaled.cam_mat[:2, 2], (cam_params.cam_mat[:2, 2] + 0.5) / 2 - 0.5)
+
+
+def test_undistort_single_channel():
+    cam_params = read_camera_parameters(MP3).scaled(0.5)
+    detector = Detector(cam_params, cv2.aruco.DetectorParameters_create(), DICTIONARY, 0.174, UNDISTORT_REMAP)
+    img = make_frames(SceneRenderer(cam_params, DICTIONARY, 0.174), 1, 4, 0)[0][0]
+    gray = img[..., 0].copy()
+    undistorted = detector.undistort_image(gray)
+    assert undistorted.shape == gray.shape
+    np.testing.assert_array_equal(undistorted, detector.undistort_image(img)[..., 0])
+
+
+def test_gray_reduced_detection_matches_full_size(registry, tmp_path):
+    cam_params = read_camera_parameters(MP3)
+    scenes = make_frames(SceneRenderer(cam_params, DICTIONARY, 0.174), 2, 4, 0)
+    filenames = []
+    for frame, (img, _, _, _) in enumerate(scenes):
+        filenames.append(str(tmp_path / 'img{}.png'.format(frame)))
+        cv2.imwrite(filenames[-1], img)
+    params = read_detector_params(os.path.join(ROOT, 'detector_params.yaml'))
+
+    def detect(gray, reduce):
+        markers = iter_registry_markers(
+            read_images(filenames, image_flags(gray, reduce)), registry, DICTIONARY, params,
+            0.174, fisheye=True, undistort_mode=UNDISTORT_CORNERS, draw=False, reduce=reduce
+        )
+        return collect_markers(markers, keep_images=False)[0]
+
+    full, reduced = detect(False, 1), detect(True, 2)
+    assert len(full) == len(reduced) == 8
+    full_order = np.lexsort((full.ids, full.frames))
+    reduced_order = np.lexsort((reduced.ids, reduced.frames))
+    np.testing.assert_array_equal(reduced.ids[reduced_order], full.ids[full_order])
+    np.testing.assert_allclose(reduced.tvecs[reduced_order], full.tvecs[full_order], atol=0.03)
@@ -0,0 +1,81 @@
+import glob
+import os
+import shutil
+import numpy as np
+import pytest
+
+import aruco.registry
+from aruco.camera_parameters import read_calibration
+from aruco.registry import CalibrationRegistry, pack_calibration, unpack_calibration
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def calibration_dir(tmp_path):
+    directory = tmp_path / 'calibration'
+    directory.mkdir()
+    for filename in glob.glob(os.path.join(ROOT, 'calibration', '*_calibration_*.xml')):
+        shutil.copy(filename, str(directory))
+    return str(directory)
+
+
+def make_registry(calibration_dir, **kwargs):
+    return CalibrationRegistry(
+        calibration_dir, cache_dir=os.path.join(calibration_dir, '..', 'cache'), **kwargs
+    )
+
+
+def test_pack_round_trip():
+    calibration = read_calibration(os.path.join(ROOT, 'calibration', 'normal_calibration_mp3.xml'))
+    unpacked = unpack_calibration(pack_calibration(*calibration))
+    np.testing.assert_array_equal(unpacked[0], calibration[0])
+    np.testing.assert_array_equal(unpacked[1], calibration[1])
+    assert unpacked[2:] == calibration[2:]
+
+
+def test_sizes(calibration_dir):
+    registry = make_registry(calibration_dir)
+    assert registry.sizes() == [(320, 240), (2048, 1536), (2592, 1944), (3280, 2464)]
+
+
+def test_find_by_size_and_model(calibration_dir):
+    registry = make_registry(calibration_dir)
+    assert os.path.basename(registry.find(2048, 1536).filename) == 'fisheye_calibration_mp3.xml'
+    assert os.path.basename(registry.find(2048, 1536, fisheye=False).filename) == \
+        'normal_calibration_mp3.xml'
+    assert registry.find(3280, 2464, fisheye=False) is None
+    assert registry.find(1000, 1000) is None
+    registry = make_registry(calibration_dir, prefer_fisheye=False)
+    assert not registry.find(2048, 1536).fisheye
+
+
+def test_for_size(calibration_dir):
+    registry = make_registry(calibration_dir)
+    cam_params = registry.for_size(1024, 768, fisheye=False, reduce=2)
+    full = registry.for_size(2048, 1536, fisheye=False)
+    assert cam_params.size == (768, 1024) and not cam_params.use_fisheye
+    np.testing.assert_allclose(cam_params.cam_mat[0, 0], full.cam_mat[0, 0] / 2)
+    assert registry.for_size(2048, 1536, fisheye=False) is full
+    with pytest.raises(KeyError):
+        registry.for_size(640, 480)
+
+
+def test_files_parsed_only_when_changed(calibration_dir, monkeypatch):
+    make_registry(calibration_dir)
+    parsed = []
+
+    def read(filename):
+        parsed.append(os.path.basename(filename))
+        return read_calibration(filename)
+
+    monkeypatch.setattr(aruco.registry, 'read_calibration', read)
+    make_registry(calibration_dir)
+    assert parsed == []
+    changed = os.path.join(calibration_dir, 'normal_calibration_low.xml')
+    stat = os.stat(changed)
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    registry = make_registry(calibration_dir)
+    assert parsed == ['normal_calibration_low.xml']
+    assert len(registry.entries) == 7
@@ -0,0 +1,86 @@
+import os
+import cv2
+import numpy as np
+
+from aruco.benchmark import make_frames
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detect_markers import detect_frame
+from aruco.detector import Detector, UNDISTORT_REMAP
+from aruco.read import read_detector_params
+from aruco.result_cache import ResultCache
+from aruco.synthetic import SceneRenderer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DICTIONARY = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
+
+
+def markers(count):
+    ids = np.arange(count).reshape(-1, 1)
+    rvecs = np.random.rand(count, 1, 3)
+    tvecs = np.random.rand(count, 1, 3)
+    corners = list(np.random.rand(count, 1, 4, 2).astype(np.float32))
+    return corners, ids, rvecs, tvecs
+
+
+def cache_size(cache):
+    return sum(size for _, size, _ in cache.entries())
+
+
+def test_round_trip(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    corners, ids, rvecs, tvecs = markers(3)
+    cache.put('ab01', corners, ids, rvecs, tvecs)
+    cache.put('ab02', [], None, None, None)
+    cached = cache.get('ab01')
+    np.testing.assert_array_equal(cached[0], corners)
+    np.testing.assert_array_equal(cached[1], ids)
+    np.testing.assert_array_equal(cached[2], rvecs)
+    np.testing.assert_array_equal(cached[3], tvecs)
+    assert cache.get('ab02') == ([], None, None, None)
+    assert cache.get('ab03') is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_put_keeps_cache_below_max_bytes(tmp_path):
+    probe = ResultCache(str(tmp_path / 'probe'))
+    probe.put('00', *markers(4))
+    entry = cache_size(probe)
+
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=10 * entry)
+    for i in range(30):
+        cache.put('{:02x}'.format(i), *markers(4))
+        assert cache.total == cache_size(cache) <= 10 * entry
+    # The oldest entries went first
+    assert cache.get('1d') is not None
+    assert cache.get('00') is None
+
+
+def test_evicts_on_open(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    for i in range(10):
+        cache.put('{:02x}'.format(i), *markers(4))
+    size = cache_size(cache)
+    assert cache.total == size
+
+    smaller = ResultCache(str(tmp_path), max_bytes=size // 2)
+    assert smaller.total == cache_size(smaller) <= size // 2
+
+
+def test_cached_results_are_drawn(tmp_path):
+    cam_params = read_camera_parameters(
+        os.path.join(ROOT, 'calibration', 'fisheye_calibration_mp3.xml')
+    ).scaled(0.5)
+    params = read_detector_params(os.path.join(ROOT, 'detector_params.yaml'))
+    detector = Detector(cam_params, params, DICTIONARY, 0.174, UNDISTORT_REMAP)
+    img = make_frames(SceneRenderer(cam_params, DICTIONARY, 0.174), 1, 4, 0)[0][0]
+    cache = ResultCache(str(tmp_path))
+
+    *detected, drawn = detect_frame(detector, img.copy(), True, cache)
+    *cached, cached_drawn = detect_frame(detector, img.copy(), True, cache)
+    assert cache.hits == 1
+    np.testing.assert_array_equal(cached[1], detected[1])
+    np.testing.assert_array_equal(cached_drawn, drawn)
+    # Without drawing, a hit returns the image as given
+    *_, given = detect_frame(detector, img, False, cache)
+    assert given is img
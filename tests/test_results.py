@@ -0,0 +1,100 @@
+import io
+import numpy as np
+import pandas as pd
+import pytest
+
+from aruco.results import MarkerResults, ResultsWriter, is_csv, read_results
+
+
+def make_results(frames=5, markers=3, seed=0):
+    rng = np.random.default_rng(seed)
+    results = MarkerResults(capacity=2)
+    for frame in range(frames):
+        ids = np.arange(markers).reshape(-1, 1) + frame
+        rvecs = rng.normal(size=(markers, 1, 3))
+        tvecs = rng.normal(size=(markers, 1, 3))
+        corners = [rng.uniform(0, 640, size=(1, 4, 2)).astype(np.float32)
+                   for _ in range(markers)]
+        results.append(frame, ids, rvecs, tvecs, corners)
+    return results
+
+
+def assert_same(a, b, corners=True):
+    assert len(a) == len(b)
+    np.testing.assert_array_equal(a.frames, b.frames)
+    np.testing.assert_array_equal(a.ids, b.ids)
+    np.testing.assert_allclose(a.tvecs, b.tvecs)
+    np.testing.assert_allclose(a.rvecs, b.rvecs)
+    if corners:
+        np.testing.assert_allclose(a.corners, b.corners, rtol=1e-6)
+
+
+def test_append_grows():
+    results = make_results(frames=50, markers=4)
+    assert len(results) == 200
+    assert results.frames[-1] == 49
+    assert results.ids[-1] == 52
+
+
+def test_append_none_is_noop():
+    results = MarkerResults()
+    results.append(0, None, None, None, None)
+    assert len(results) == 0
+
+
+def test_extend():
+    a = make_results(seed=1)
+    b = make_results(seed=2)
+    merged = MarkerResults()
+    merged.extend(a)
+    merged.extend(b)
+    assert len(merged) == len(a) + len(b)
+    np.testing.assert_allclose(merged.tvecs[len(a):], b.tvecs)
+
+
+def test_dataframe_round_trip():
+    results = make_results()
+    df = results.to_dataframe(corners=True)
+    assert_same(results, MarkerResults.from_dataframe(df))
+
+
+def test_dataframe_without_corners():
+    df = make_results().to_dataframe()
+    assert list(df.columns) == ['frame', 'id', 'tx', 'ty', 'tz', 'rx', 'ry', 'rz']
+    assert np.isnan(MarkerResults.from_dataframe(df).corners).all()
+
+
+def test_npz_round_trip(tmp_path):
+    results = make_results()
+    path = str(tmp_path / 'results.npz')
+    results.save(path)
+    assert_same(results, MarkerResults.load(path))
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet', '.feather'])
+def test_write_read_round_trip(tmp_path, extension):
+    if extension != '.csv':
+        pytest.importorskip('pyarrow')
+    results = make_results()
+    path = str(tmp_path / ('results' + extension))
+    results.write(path, corners=True)
+    assert_same(results, read_results(path))
+
+
+def test_writer_streams_csv():
+    results = make_results()
+    stream = io.StringIO()
+    with ResultsWriter(stream, corners=True) as writer:
+        for frame in range(5):
+            rows = results.frames == frame
+            writer.append(frame, results.ids[rows], results.rvecs[rows],
+                          results.tvecs[rows], results.corners[rows])
+    stream.seek(0)
+    assert_same(results, MarkerResults.from_dataframe(pd.read_csv(stream)))
+
+
+def test_writer_only_writes_csv(tmp_path):
+    assert is_csv('out.csv') and is_csv('out')
+    assert not is_csv('out.parquet') and not is_csv('OUT.Feather')
+    with pytest.raises(AssertionError):
+        ResultsWriter(str(tmp_path / 'out.parquet'))
@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+import pandas as pd
+
+from aruco.rotation import (angles_between, normals, rotate, rotation_matrices,
+                            rotation_vectors, rotations_around_axis, rotations_between)
+from avg_normal import normal_from_rotationvector, rotations_around_z
+
+
+def random_rvecs(count=200, seed=0):
+    rng = np.random.default_rng(seed)
+    axes = rng.normal(size=(count, 3))
+    axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+    return axes * rng.uniform(0, np.pi, (count, 1))
+
+
+def rotation_around_z_per_row(rotation):
+    """ The per row implementation avg_normal.rotation_around_z replaced"""
+    normal = (0, 0, 1)
+    new_normal = (0, 0, -1)
+    fst, _ = cv2.Rodrigues(rotation)
+    current_normal = np.matmul(fst, normal)
+    angle_to_normal = np.arccos(np.dot(current_normal, new_normal))
+    rot_axis = np.cross(current_normal, new_normal)
+    rot_axis = rot_axis * angle_to_normal / np.linalg.norm(rot_axis)
+    snd, _ = cv2.Rodrigues(rot_axis)
+    old_x = (1, 0, 0)
+    new_x = np.matmul(snd, np.matmul(fst, old_x))
+    angle_around_z = np.arccos(np.dot(old_x, new_x))
+    return angle_around_z, angle_to_normal
+
+
+def test_rotation_matrices_match_rodrigues():
+    rvecs = np.vstack((random_rvecs(), np.zeros(3), [1e-14, 0, 0]))
+    expected = np.array([cv2.Rodrigues(rvec)[0] for rvec in rvecs])
+    np.testing.assert_allclose(rotation_matrices(rvecs), expected, atol=1e-12)
+
+
+def test_rotation_vectors_invert_rotation_matrices():
+    rvecs = random_rvecs()
+    np.testing.assert_allclose(rotation_vectors(rotation_matrices(rvecs)), rvecs, atol=1e-9)
+    expected = np.array([cv2.Rodrigues(mat)[0].ravel() for mat in rotation_matrices(rvecs)])
+    np.testing.assert_allclose(rotation_vectors(rotation_matrices(rvecs)), expected, atol=1e-9)
+
+
+def test_rotation_vectors_near_pi():
+    axes = random_rvecs(50, seed=1)
+    axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+    mats = rotation_matrices(axes * np.pi)
+    np.testing.assert_allclose(rotation_matrices(rotation_vectors(mats)), mats, atol=1e-9)
+
+
+def test_normals_match_per_row():
+    rvecs = random_rvecs()
+    expected = np.array([normal_from_rotationvector(rvec) for rvec in rvecs])
+    np.testing.assert_allclose(normals(rvecs), expected, atol=1e-12)
+
+
+def test_rotations_between():
+    a = normals(random_rvecs(seed=2))
+    b = normals(random_rvecs(seed=3))
+    np.testing.assert_allclose(rotate(rotations_between(a, b), a), b, atol=1e-9)
+    np.testing.assert_allclose(angles_between(a, a), 0, atol=1e-6)
+
+
+def test_rotations_between_opposite_vectors():
+    a = np.vstack((np.eye(3), normals(random_rvecs(seed=4))))
+    rvecs = rotations_between(a, -a)
+    np.testing.assert_allclose(np.linalg.norm(rvecs, axis=1), np.pi)
+    np.testing.assert_allclose(rotate(rvecs, a), -a, atol=1e-9)
+    # Also against a single vector
+    rvecs = rotations_between(np.array([[0, 0, 1.0], [0, 0, -1.0]]), (0, 0, -1))
+    np.testing.assert_allclose(rotate(rvecs, (0, 0, 1)), [[0, 0, -1], [0, 0, 1]], atol=1e-9)
+
+
+def test_rotations_around_z_match_per_row():
+    rvecs = random_rvecs()
+    df = pd.DataFrame(rvecs, columns=['rx', 'ry', 'rz'])
+    result = rotations_around_z(df)
+    expected = np.array([rotation_around_z_per_row(rvec) for rvec in rvecs])
+    np.testing.assert_allclose(result['rotation_z'], expected[:, 0], atol=1e-7)
+    np.testing.assert_allclose(result['rotation_to_normal'], expected[:, 1], atol=1e-12)
+
+
+def test_rotation_around_axis_already_at_normal():
+    angle_around, angle_to_normal = rotations_around_axis([[np.pi, 0, 0]])
+    assert angle_to_normal[0] == 0
+    assert np.isfinite(angle_around[0])
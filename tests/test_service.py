@@ -0,0 +1,98 @@
+import http.client
+import http.server
+import json
+import os
+import shutil
+import socket
+import threading
+import cv2
+import pytest
+
+from aruco.registry import CalibrationRegistry
+from aruco.service import DetectionService, _HTTPHandler, _ThreadingUnixServer, _UnixHandler
+from aruco.service import parse_request
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+BAD_REQUESTS = (
+    '[1]', '1', '"paths"', 'null', '{',
+    '{"paths": 5}', '{"images": 3}', '{"paths": "a.png"}', '{"paths": [1]}',
+)
+
+
+def make_service(tmp_path):
+    calibration_dir = tmp_path / 'calibration'
+    calibration_dir.mkdir()
+    shutil.copy(os.path.join(ROOT, 'calibration', 'normal_calibration_low.xml'), str(calibration_dir))
+    return DetectionService(
+        cv2.aruco.DetectorParameters_create(),
+        cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250), 0.174,
+        registry=CalibrationRegistry(str(calibration_dir), cache_dir=str(tmp_path / 'cache')),
+        workers=1
+    )
+
+
+def test_parse_request():
+    assert parse_request('{"paths": []}') == {'paths': []}
+    assert parse_request('{"paths": ["a.png"], "images": []}')['paths'] == ['a.png']
+    for data in BAD_REQUESTS:
+        with pytest.raises(ValueError):
+            parse_request(data)
+
+
+def test_unix_socket_answers_bad_requests(tmp_path):
+    service = make_service(tmp_path)
+    socket_path = str(tmp_path / 'service.sock')
+    server = _ThreadingUnixServer(socket_path, _UnixHandler)
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            stream = sock.makefile('rwb')
+            # The connection stays open after a request that is not an object
+            lines = [data.encode() + b'\n' for data in BAD_REQUESTS]
+            lines.append(b'{"paths": ["missing.png"]}\n')
+            for line in lines:
+                stream.write(line)
+                stream.flush()
+                response = json.loads(stream.readline())
+                if line.startswith(b'{"paths": ["'):
+                    assert 'error' in response['frames'][0]
+                else:
+                    assert 'error' in response
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+def test_http_answers_bad_requests(tmp_path):
+    service = make_service(tmp_path)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _HTTPHandler)
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+        # The connection stays open after each bad request
+        for data in BAD_REQUESTS:
+            connection.request('POST', '/detect', data, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            assert response.status == 400
+            assert 'error' in json.loads(response.read())
+
+        connection.putrequest('POST', '/detect')
+        connection.putheader('Content-Length', 'many')
+        connection.endheaders()
+        response = connection.getresponse()
+        assert response.status == 400
+        assert json.loads(response.read()) == {'error': 'Invalid Content-Length'}
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
@@ -0,0 +1,115 @@
+import os
+import shutil
+import cv2
+import numpy as np
+import pytest
+
+from aruco.benchmark import make_frames
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detect_markers import iter_registry_markers
+from aruco.read import read_detector_params
+from aruco.registry import CalibrationRegistry
+from aruco.session import ALIGNMENT, Session, SessionWriter, convert_images, is_session
+from aruco.synthetic import SceneRenderer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DICTIONARY = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
+NORMAL_MP3 = os.path.join(ROOT, 'calibration', 'normal_calibration_mp3.xml')
+
+
+def test_writer_round_trip(tmp_path):
+    path = str(tmp_path / 'session')
+    frames = [
+        np.random.RandomState(0).randint(0, 256, (240, 320, 3)).astype(np.uint8),
+        np.full((50, 70), 7, np.uint8),
+        np.arange(24 * 32 * 3, dtype=np.uint8).reshape(24, 32, 3),
+    ]
+    with SessionWriter(path) as writer:
+        writer.append(frames[0], timestamp=1.5, calibration='abc', source='a.jpg')
+        writer.append(frames[1], resolution='MP3')
+        writer.append(frames[2])
+    assert is_session(path)
+    with pytest.raises(FileExistsError):
+        SessionWriter(path)
+
+    session = Session(path)
+    assert len(session) == 3
+    for i, img in enumerate(frames):
+        assert session.frames[i]['offset'] % ALIGNMENT == 0
+        assert session[i].shape == img.shape
+        np.testing.assert_array_equal(session[i], img)
+        # Views of the mapped file, not copies
+        assert np.shares_memory(session[i], session.data)
+        assert not session[i].flags.writeable
+    assert [frame['resolution'] for frame in session.frames] == ['LOW', 'MP3', '32x24']
+    assert session.frames[0]['timestamp'] == 1.5
+    assert session.frames[0]['calibration'] == 'abc'
+    assert session.frames[0]['source'] == 'a.jpg'
+
+    df = session.to_dataframe()
+    assert list(df['width']) == [320, 70, 32]
+    assert list(df['channels']) == [3, 1, 3]
+
+
+def test_failed_writer_leaves_no_session(tmp_path):
+    path = str(tmp_path / 'session')
+    with pytest.raises(RuntimeError):
+        with SessionWriter(path) as writer:
+            writer.append(np.zeros((4, 4), np.uint8))
+            raise RuntimeError()
+    assert not is_session(path)
+
+
+def test_convert_images_and_select_resolution(tmp_path):
+    images = tmp_path / 'images'
+    images.mkdir()
+    # Shot order, and labels by size: img3 is a preview saved under an MP3 name
+    cv2.imwrite(str(images / 'img10_LOW.png'), np.full((240, 320, 3), 10, np.uint8))
+    cv2.imwrite(str(images / 'img2_LOW.png'), np.full((240, 320, 3), 2, np.uint8))
+    cv2.imwrite(str(images / 'img3_MP3.png'), np.full((240, 320, 3), 3, np.uint8))
+    cv2.imwrite(str(images / 'img2_MP3.png'), np.full((1536, 2048, 3), 20, np.uint8))
+    calibration = tmp_path / 'calibration'
+    calibration.mkdir()
+    shutil.copy(NORMAL_MP3, str(calibration))
+    registry = CalibrationRegistry(str(calibration), cache_dir=str(tmp_path / 'cache'))
+
+    path = str(tmp_path / 'session')
+    assert convert_images([str(images)], path, gray=True, registry=registry) == 4
+    session = Session(path)
+    assert [os.path.basename(frame['source']) for frame in session.frames] == [
+        'img2_LOW.png', 'img2_MP3.png', 'img3_MP3.png', 'img10_LOW.png'
+    ]
+    assert session.resolutions() == ['LOW', 'MP3']
+    assert session.select('LOW') == [0, 2, 3]
+    assert session.select('MP3') == [1]
+    assert session.select() == [0, 1, 2, 3]
+    assert [img[0, 0] for img in session.images('LOW')] == [2, 3, 10]
+    assert [img.shape for img in session.images('MP3')] == [(1536, 2048)]
+    mp3_hash = registry.find(2048, 1536).hash
+    assert [frame.calibration for frame in session.iter_frames()] == [None, mp3_hash, None, None]
+
+
+def test_draw_on_mapped_frames(tmp_path):
+    cam_params = read_camera_parameters(NORMAL_MP3)
+    scenes = make_frames(SceneRenderer(cam_params, DICTIONARY, 0.174), 1, 4, 0)
+    path = str(tmp_path / 'session')
+    with SessionWriter(path) as writer:
+        writer.append(scenes[0][0])
+    calibration = tmp_path / 'calibration'
+    calibration.mkdir()
+    shutil.copy(NORMAL_MP3, str(calibration))
+    registry = CalibrationRegistry(str(calibration), cache_dir=str(tmp_path / 'cache'))
+
+    session = Session(path)
+    markers = list(iter_registry_markers(
+        session.images(), registry, DICTIONARY,
+        read_detector_params(os.path.join(ROOT, 'detector_params.yaml')),
+        0.174, fisheye=False, draw=True
+    ))
+    _, _, ids, _, _, img = markers[0]
+    assert sorted(ids[:, 0]) == sorted(scenes[0][1])
+    # Markers are drawn into a copy, the mapped frame is unchanged
+    assert not np.shares_memory(img, session.data)
+    assert (img != session[0]).any()
+    np.testing.assert_array_equal(session[0], scenes[0][0])
@@ -0,0 +1,47 @@
+import os
+import cv2
+import numpy as np
+
+from aruco.camera_parameters import read_camera_parameters
+from aruco.detector import Detector, UNDISTORT_CORNERS
+from aruco.read import read_detector_params
+from aruco.synthetic import SceneRenderer, floor_scene
+from aruco.tracker import MarkerTracker
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DICTIONARY = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
+
+
+def test_tracks_recorded_sequence():
+    cam_params = read_camera_parameters(
+        os.path.join(ROOT, 'calibration', 'fisheye_calibration_mp3.xml')
+    ).scaled(0.5)
+    params = read_detector_params(os.path.join(ROOT, 'detector_params.yaml'))
+    renderer = SceneRenderer(cam_params, DICTIONARY, 0.174)
+    rng = np.random.default_rng(0)
+    ids = np.arange(4)
+    rvecs, tvecs = floor_scene(rng, ids)
+    # The camera moves slowly, and marker 3 leaves the view at frame 4
+    frames = []
+    for frame in range(6):
+        visible = ids if frame < 4 else ids[:3]
+        moved = tvecs[visible] + (0.005 * frame, 0, 0)
+        frames.append(renderer.render(visible, rvecs[visible], moved, noise=2.0, blur=0.7, rng=rng))
+
+    detector = Detector(cam_params, params, DICTIONARY, 0.174, UNDISTORT_CORNERS)
+    tracker = MarkerTracker(detector, full_search_interval=100)
+    results = None
+    for img in frames:
+        results = tracker.process(img, results)
+    assert tracker.full_searches == [True, False, False, False, True, False]
+
+    # Same poses as full frame detection
+    for frame, img in enumerate(frames):
+        corners, found, _ = detector.detect(img)
+        _, expected = detector.estimate_poses(corners)
+        rows = results.frames == frame
+        order = np.argsort(found[:, 0])
+        np.testing.assert_array_equal(np.sort(results.ids[rows]), found[order, 0])
+        tracked = results.tvecs[rows][np.argsort(results.ids[rows])]
+        np.testing.assert_allclose(tracked, expected[order, 0], atol=1e-3)
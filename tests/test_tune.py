@@ -0,0 +1,67 @@
+import os
+import cv2
+import numpy as np
+import pytest
+
+from aruco.camera_parameters import read_camera_parameters
+from aruco.read import read_detector_params_dict
+from aruco.results import MarkerResults
+from aruco.tune import Dataset, TrialCache, evaluate, tune
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DICTIONARY = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
+SEARCH_SPACE = {
+    'cornerRefinementMaxIterations': [5, 30],
+    'perspectiveRemovePixelPerCell': [4],
+}
+
+
+def camera():
+    return read_camera_parameters(
+        os.path.join(ROOT, 'calibration', 'fisheye_calibration_mp3.xml')
+    ).scaled(0.5)
+
+
+def base_params():
+    return read_detector_params_dict(os.path.join(ROOT, 'detector_params.yaml'))
+
+
+def test_evaluate_synthetic_dataset():
+    dataset = Dataset.synthetic(camera(), DICTIONARY, 0.174, frames=2, markers=4)
+    result = evaluate(base_params(), dataset, DICTIONARY, 0.174, repeat=1)
+    assert result['detection_rate'] == 1.0
+    assert result['corner_error'] < 1.0
+    assert result['false'] == 0
+    assert result['time'] > 0
+
+
+def test_tune_reuses_trial_cache(tmp_path):
+    dataset = Dataset.synthetic(camera(), DICTIONARY, 0.174, frames=2, markers=4)
+    filename = str(tmp_path / 'trials.jsonl')
+    runs = []
+    for _ in range(2):
+        logged = []
+        params, result = tune(
+            base_params(), dataset, DICTIONARY, 0.174, search_space=SEARCH_SPACE,
+            repeat=1, cache=TrialCache(filename),
+            log=lambda params, result, cached: logged.append(cached)
+        )
+        runs.append((params, logged))
+        assert result['detection_rate'] == 1.0
+        assert set(params) == set(base_params())
+    (first, first_log), (second, second_log) = runs
+    # The second round revisits parameters of the first
+    assert not first_log[0] and not all(first_log)
+    # A repeated search only reads the cache, and so ends the same way
+    assert second_log and all(second_log)
+    assert second == first
+
+
+def test_labelled_needs_readable_images(tmp_path):
+    labels = str(tmp_path / 'labels.csv')
+    results = MarkerResults()
+    results.append(0, np.array([1]), np.zeros((1, 3)), np.ones((1, 3)), np.ones((1, 4, 2)))
+    results.write(labels, corners=True)
+    with pytest.raises(IOError, match='missing.png'):
+        Dataset.labelled(camera(), [str(tmp_path / 'missing.png')], labels)